@@ -20,12 +20,49 @@ def create_app(config_name='development'):
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
+    # Números de documento reservados por proceso en cada viaje a la base de datos
+    app.config['NUMERACION_TAMANO_BLOQUE'] = int(os.environ.get('NUMERACION_TAMANO_BLOQUE', 10))
+    # Segundos antes de recargar por completo el índice de códigos de barras
+    app.config['INDICE_PRODUCTOS_TTL'] = int(os.environ.get('INDICE_PRODUCTOS_TTL', 600))
+    # Archivo donde se guarda la impresora USB detectada (IDs y endpoints)
+    app.config['IMPRESORA_CACHE'] = os.environ.get('IMPRESORA_CACHE') or os.path.join(app.instance_path, 'impresora_usb.json')
+    # Directorio donde se guardan los PDFs de facturas ya generados
+    app.config['FACTURAS_CACHE_DIR'] = os.environ.get('FACTURAS_CACHE_DIR') or os.path.join(app.instance_path, 'facturas')
+    # Exportación masiva de facturas: archivos generados y procesos para reportlab (0 = todos los núcleos)
+    app.config['EXPORTACIONES_DIR'] = os.environ.get('EXPORTACIONES_DIR') or os.path.join(app.instance_path, 'exportaciones')
+    app.config['EXPORTACION_PROCESOS'] = int(os.environ.get('EXPORTACION_PROCESOS', 0))
+    # Archivos subidos para importar el catálogo de productos (se borran al terminar)
+    app.config['IMPORTACIONES_DIR'] = os.environ.get('IMPORTACIONES_DIR') or os.path.join(app.instance_path, 'importaciones')
+    # Segundos máximos que se sirve una respuesta de estadísticas en caché (otros procesos pueden escribir)
+    app.config['ESTADISTICAS_CACHE_TTL'] = int(os.environ.get('ESTADISTICAS_CACHE_TTL', 60))
+    # Segundos entre revisiones del stream de stock bajo (cambios de otros procesos y keep-alive)
+    app.config['ALERTAS_STOCK_INTERVALO'] = int(os.environ.get('ALERTAS_STOCK_INTERVALO', 15))
+    # Segundos que dura la reserva de stock de un carrito abierto sin actividad
+    app.config['RESERVAS_TTL'] = int(os.environ.get('RESERVAS_TTL', 300))
+    # Tareas nocturnas (reportes y saldos del kardex): hora local de ejecución (vacía = apagadas) y reportes a generar
+    app.config['REPORTES_HORA'] = os.environ.get('REPORTES_HORA', '02:00')
+    app.config['REPORTES_PROGRAMADOS'] = os.environ.get(
+        'REPORTES_PROGRAMADOS', 'ventas,ganancia_categorias,valor_inventario,gasto_proveedores')
     
     # Inicializar extensiones
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     
+    from app import indice_productos, busqueda_productos, idempotencia, impresion_tickets, exportar_facturas, resumen_diario, cache_estadisticas, reportes_programados, kardex, alertas_stock, reservas_stock, importar_productos
+    indice_productos.init_app(app)
+    busqueda_productos.init_app(app)
+    idempotencia.init_app(app)
+    impresion_tickets.init_app(app)
+    exportar_facturas.init_app(app)
+    resumen_diario.init_app(app)
+    cache_estadisticas.init_app(app)
+    reportes_programados.init_app(app)
+    kardex.init_app(app)
+    alertas_stock.init_app(app)
+    reservas_stock.init_app(app)
+    importar_productos.init_app(app)
+    
     # Configurar Flask-Login
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Por favor inicia sesión para acceder a esta página.'
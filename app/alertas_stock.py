@@ -0,0 +1,212 @@
+"""
+Alertas de stock bajo.
+
+Producto.stock_bajo (indexado) guarda si el producto está activo y su stock
+es menor o igual a stock_minimo. Se mantiene en el mismo flush que cambia
+stock, stock_minimo o activo con un único UPDATE que solo toca las filas cuyo
+estado cambió; esas filas (RETURNING) son las transiciones. Al confirmar la
+transacción se publican a los navegadores suscritos al stream SSE del panel y
+de compras.
+
+Las escrituras fuera del ORM (UPDATE masivos) deben llamar a
+actualizar_productos(ids). Los cambios hechos por otros procesos llegan al
+stream con la revisión periódica (ALERTAS_STOCK_INTERVALO segundos), que
+consulta el índice y envía las diferencias.
+"""
+from flask import current_app, has_app_context
+from app import db
+from app.models import Producto
+from sqlalchemy import event, inspect, select, update, case, and_, true, false
+from sqlalchemy.orm.attributes import set_committed_value
+import json
+import queue
+import threading
+import time
+
+INTERVALO_POR_DEFECTO = 15  # segundos entre revisiones (y keep-alive) del stream
+DURACION_MAXIMA = 600  # segundos de cada conexión; el navegador se reconecta solo
+MAX_PENDIENTES = 100  # eventos en cola por suscriptor antes de descartar
+
+CAMPOS = ('stock', 'stock_minimo', 'activo')
+
+_CLAVE_CAMBIOS = 'alertas_stock_transiciones'
+_CLAVE_PRODUCTOS = 'alertas_stock_productos'
+
+_tabla = Producto.__table__
+_condicion = case(
+    (and_(_tabla.c.activo == true(), _tabla.c.stock <= _tabla.c.stock_minimo), true()),
+    else_=false()
+)
+_COLUMNAS = (_tabla.c.id, _tabla.c.codigo_barras, _tabla.c.nombre, _tabla.c.stock,
+             _tabla.c.stock_minimo, _tabla.c.precio_compra, _tabla.c.stock_bajo)
+
+
+def init_app(app):
+    """Registra la lista de suscriptores y los eventos de sesión"""
+    app.extensions['alertas_stock'] = {
+        'lock': threading.Lock(),
+        'suscriptores': set()
+    }
+
+    if not event.contains(db.session, 'after_flush', _sincronizar_flush):
+        event.listen(db.session, 'before_flush', _anotar_productos)
+        event.listen(db.session, 'after_flush', _sincronizar_flush)
+        event.listen(db.session, 'after_commit', _publicar)
+        event.listen(db.session, 'after_soft_rollback', _descartar)
+
+
+def _estado():
+    return current_app.extensions['alertas_stock']
+
+
+def _a_dict(fila):
+    return {
+        'id': fila.id,
+        'codigo_barras': fila.codigo_barras,
+        'nombre': fila.nombre,
+        'stock': fila.stock,
+        'stock_minimo': fila.stock_minimo,
+        'precio_compra': float(fila.precio_compra),
+        'stock_bajo': bool(fila.stock_bajo)
+    }
+
+
+def _sincronizar(connection, producto_ids):
+    """Actualiza stock_bajo de esos productos; retorna las filas que cambiaron de estado"""
+    if not producto_ids:
+        return []
+    sentencia = update(_tabla).where(_tabla.c.id.in_(producto_ids), _tabla.c.stock_bajo != _condicion) \
+        .values(stock_bajo=_condicion)
+
+    if connection.dialect.update_returning:
+        return connection.execute(sentencia.returning(*_COLUMNAS)).all()
+
+    # Sin RETURNING: leer primero las que van a cambiar
+    filas = connection.execute(
+        select(*_COLUMNAS[:-1], _condicion.label('stock_bajo'))
+        .where(_tabla.c.id.in_(producto_ids), _tabla.c.stock_bajo != _condicion)
+    ).all()
+    if filas:
+        connection.execute(sentencia.where(_tabla.c.id.in_([fila.id for fila in filas])))
+    return filas
+
+
+def _registrar(session, filas):
+    if not filas:
+        return
+    transiciones = session.info.setdefault(_CLAVE_CAMBIOS, {})
+    for fila in filas:
+        transiciones[fila.id] = _a_dict(fila)
+        # Mantener al día el objeto en memoria, si la sesión lo tiene cargado
+        producto = session.identity_map.get(session.identity_key(Producto, fila.id))
+        if producto is not None:
+            set_committed_value(producto, 'stock_bajo', bool(fila.stock_bajo))
+
+
+def actualizar_productos(producto_ids):
+    """Recalcula stock_bajo tras escrituras fuera del ORM (en la misma transacción)"""
+    ids = list(producto_ids)
+    _registrar(db.session, _sincronizar(db.session.connection(), ids))
+
+
+def _anotar_productos(session, flush_context, instances):
+    # Antes del flush: después ya no se ve un stock asignado como expresión SQL (stock + n)
+    nuevos = [obj for obj in session.new if isinstance(obj, Producto)]
+    producto_ids = set()
+    for obj in session.dirty:
+        if isinstance(obj, Producto):
+            estado = inspect(obj)
+            if any(estado.attrs[campo].history.has_changes() for campo in CAMPOS):
+                producto_ids.add(estado.identity[0])
+    if nuevos or producto_ids:
+        session.info[_CLAVE_PRODUCTOS] = (nuevos, producto_ids)
+
+
+def _sincronizar_flush(session, flush_context):
+    anotados = session.info.pop(_CLAVE_PRODUCTOS, None)
+    if anotados:
+        nuevos, producto_ids = anotados
+        producto_ids.update(obj.id for obj in nuevos)  # ya tienen id después del INSERT
+        _registrar(session, _sincronizar(session.connection(), list(producto_ids)))
+
+
+def _publicar(session):
+    transiciones = session.info.pop(_CLAVE_CAMBIOS, None)
+    if not transiciones or not has_app_context() or 'alertas_stock' not in current_app.extensions:
+        return
+    estado = _estado()
+    with estado['lock']:
+        suscriptores = list(estado['suscriptores'])
+    for producto in transiciones.values():
+        for cola in suscriptores:
+            try:
+                cola.put_nowait(producto)
+            except queue.Full:
+                pass  # la revisión periódica de ese stream lo pondrá al día
+
+
+def _descartar(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_CLAVE_CAMBIOS, None)
+
+
+# ========== CONSULTA Y STREAM ==========
+
+def productos_stock_bajo():
+    """Productos activos con stock bajo (usa el índice de stock_bajo)"""
+    filas = db.session.execute(
+        select(*_COLUMNAS).where(_tabla.c.stock_bajo == true()).order_by(_tabla.c.stock, _tabla.c.nombre)
+    ).all()
+    return [_a_dict(fila) for fila in filas]
+
+
+def _evento(nombre, datos):
+    return f'event: {nombre}\ndata: {json.dumps(datos)}\n\n'
+
+
+def stream_eventos():
+    """
+    Generador del stream SSE: primero el estado completo (evento 'estado'),
+    luego cada transición (evento 'cambio', con stock_bajo true o false).
+    Debe ejecutarse con stream_with_context.
+    """
+    estado = _estado()
+    intervalo = current_app.config.get('ALERTAS_STOCK_INTERVALO', INTERVALO_POR_DEFECTO)
+    cola = queue.Queue(maxsize=MAX_PENDIENTES)
+    with estado['lock']:
+        estado['suscriptores'].add(cola)
+
+    try:
+        conocidos = {producto['id']: producto for producto in productos_stock_bajo()}
+        # No retener una conexión del pool mientras el stream espera
+        db.session.close()
+        yield 'retry: 3000\n\n'
+        yield _evento('estado', {'productos': list(conocidos.values())})
+
+        fin = time.monotonic() + DURACION_MAXIMA
+        while time.monotonic() < fin:
+            try:
+                producto = cola.get(timeout=intervalo)
+            except queue.Empty:
+                # Revisión periódica: cambios de otros procesos o eventos descartados
+                actuales = {producto['id']: producto for producto in productos_stock_bajo()}
+                db.session.close()
+                cambios = [producto for producto_id, producto in actuales.items()
+                           if conocidos.get(producto_id) != producto]
+                cambios += [dict(producto, stock_bajo=False) for producto_id, producto in conocidos.items()
+                            if producto_id not in actuales]
+                conocidos = actuales
+                for producto in cambios:
+                    yield _evento('cambio', producto)
+                if not cambios:
+                    yield ': ping\n\n'
+                continue
+
+            if producto['stock_bajo']:
+                conocidos[producto['id']] = producto
+            else:
+                conocidos.pop(producto['id'], None)
+            yield _evento('cambio', producto)
+    finally:
+        with estado['lock']:
+            estado['suscriptores'].discard(cola)
@@ -0,0 +1,213 @@
+"""
+Búsqueda de productos por texto (nombre, descripción y categoría).
+
+En SQLite usa una tabla virtual FTS5 (productos_fts) mantenida por triggers,
+con búsqueda por prefijo y resultados ordenados por relevancia (bm25).
+En PostgreSQL usa índices GIN de pg_trgm con ILIKE ordenado por similitud.
+Si ninguno está disponible se usa LIKE como antes.
+"""
+from flask import current_app
+from app import db
+from app.models import Producto, Categoria
+from sqlalchemy import event, text, func, or_, and_
+from sqlalchemy.orm import joinedload
+import re
+
+# Peso de cada columna en el ranking: nombre > categoría > descripción
+PESOS_FTS = (10.0, 2.0, 4.0)
+
+# Las palabras más cortas se buscan completas y no como prefijo
+LONGITUD_MINIMA_PREFIJO = 2
+
+# Máximo de coincidencias que se puntúan por búsqueda: un prefijo corto puede
+# coincidir con decenas de miles de productos y ordenar todos por bm25 haría
+# el type-ahead lineal en el tamaño del catálogo
+CANDIDATOS_FTS = 100
+
+_DDL_SQLITE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+        nombre, descripcion, categoria,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+        INSERT INTO productos_fts(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, COALESCE(new.descripcion, ''),
+                COALESCE((SELECT nombre FROM categorias WHERE id = new.categoria_id), ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre, descripcion, categoria_id ON productos BEGIN
+        DELETE FROM productos_fts WHERE rowid = old.id;
+        INSERT INTO productos_fts(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, COALESCE(new.descripcion, ''),
+                COALESCE((SELECT nombre FROM categorias WHERE id = new.categoria_id), ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+        DELETE FROM productos_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS categorias_fts_au AFTER UPDATE OF nombre ON categorias BEGIN
+        UPDATE productos_fts SET categoria = new.nombre
+        WHERE rowid IN (SELECT id FROM productos WHERE categoria_id = new.id);
+    END""",
+]
+
+_POBLAR_SQLITE = """
+    INSERT INTO productos_fts(rowid, nombre, descripcion, categoria)
+    SELECT p.id, p.nombre, COALESCE(p.descripcion, ''), COALESCE(c.nombre, '')
+    FROM productos p LEFT JOIN categorias c ON c.id = p.categoria_id
+"""
+
+_DDL_POSTGRESQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_productos_nombre_trgm ON productos USING gin (nombre gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_productos_descripcion_trgm ON productos USING gin (descripcion gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_categorias_nombre_trgm ON categorias USING gin (nombre gin_trgm_ops)",
+]
+
+
+def init_app(app):
+    """Crea el índice de búsqueda junto con las tablas (db.create_all)"""
+    app.extensions['busqueda_productos'] = {'motor': None}
+    if not event.contains(db.metadata, 'after_create', _despues_de_crear_tablas):
+        event.listen(db.metadata, 'after_create', _despues_de_crear_tablas)
+
+
+def _despues_de_crear_tablas(target, connection, **kw):
+    crear_indice_busqueda(connection)
+
+
+def crear_indice_busqueda(connection):
+    """
+    Crea (si no existen) las estructuras de búsqueda para el motor de la conexión.
+    Es idempotente; en SQLite llena la tabla FTS solo cuando se crea por primera vez.
+    """
+    dialecto = connection.dialect.name
+    if dialecto == 'sqlite':
+        existe = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'productos_fts'")
+        ).scalar()
+        if existe:
+            return
+        try:
+            for sentencia in _DDL_SQLITE:
+                connection.execute(text(sentencia))
+            connection.execute(text(_POBLAR_SQLITE))
+        except Exception as e:
+            # SQLite compilado sin FTS5: se usará LIKE
+            print(f"No se pudo crear el índice FTS5 de productos: {e}")
+    elif dialecto == 'postgresql':
+        try:
+            with connection.begin_nested():
+                for sentencia in _DDL_POSTGRESQL:
+                    connection.execute(text(sentencia))
+        except Exception as e:
+            print(f"No se pudo crear el índice pg_trgm de productos: {e}")
+
+
+def _motor():
+    """Motor de búsqueda disponible: 'fts5', 'pg_trgm' o 'like' (se calcula una vez)"""
+    estado = current_app.extensions['busqueda_productos']
+    if estado['motor'] is None:
+        dialecto = db.engine.dialect.name
+        motor = 'like'
+        if dialecto == 'sqlite':
+            existe = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'productos_fts'")
+            ).scalar()
+            if existe:
+                motor = 'fts5'
+        elif dialecto == 'postgresql':
+            existe = db.session.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).scalar()
+            if existe:
+                motor = 'pg_trgm'
+        estado['motor'] = motor
+    return estado['motor']
+
+
+def _terminos(texto):
+    return [t for t in re.findall(r'\w+', texto.lower()) if t]
+
+
+def _filtros_base(query, solo_con_stock):
+    query = query.filter(Producto.activo == True)
+    if solo_con_stock:
+        query = query.filter(Producto.stock > 0)
+    return query
+
+
+def _candidatos_fts(consulta, solo_con_stock, excluir=()):
+    """Hasta CANDIDATOS_FTS coincidencias de la consulta, ordenadas por bm25 entre ellas"""
+    condicion_stock = 'AND productos.stock > 0' if solo_con_stock else ''
+    # El orden se aplica en Python: con ORDER BY (aun en una subconsulta) SQLite
+    # vuelve a evaluar bm25 y la consulta se hace varias veces más lenta
+    filas = db.session.execute(text(f"""
+        SELECT productos_fts.rowid AS rowid,
+               bm25(productos_fts, {', '.join(str(p) for p in PESOS_FTS)}) AS puntaje
+        FROM productos_fts
+        JOIN productos ON productos.id = productos_fts.rowid
+        WHERE productos_fts MATCH :consulta AND productos.activo = 1 {condicion_stock}
+        LIMIT :candidatos
+    """), {'consulta': consulta, 'candidatos': CANDIDATOS_FTS}).all()
+    return [fila.rowid for fila in sorted(filas, key=lambda fila: fila.puntaje) if fila.rowid not in excluir]
+
+
+def _buscar_fts(terminos, limite, solo_con_stock, cualquiera):
+    frases = [f'"{t}"*' if len(t) >= LONGITUD_MINIMA_PREFIJO else f'"{t}"' for t in terminos]
+    consulta_fts = (' OR ' if cualquiera else ' AND ').join(frases)
+    # Primero los productos cuyo nombre empieza por la primera palabra (lo que
+    # espera quien escribe en el type-ahead); solo si no alcanzan para el límite
+    # se completa con el resto de coincidencias. Cada ventana está acotada a
+    # CANDIDATOS_FTS filas, así el costo no crece con el catálogo.
+    consulta_nombre = f'nombre : ^{frases[0]}'
+    if not cualquiera and len(frases) > 1:
+        consulta_nombre = ' AND '.join([consulta_nombre] + frases[1:])
+    ids = _candidatos_fts(consulta_nombre, solo_con_stock)[:limite]
+    if len(ids) < limite:
+        ids += _candidatos_fts(consulta_fts, solo_con_stock, excluir=set(ids))[:limite - len(ids)]
+    if not ids:
+        return []
+
+    productos = Producto.query.options(joinedload(Producto.categoria_rel)).filter(Producto.id.in_(ids)).all()
+    posicion = {producto_id: i for i, producto_id in enumerate(ids)}
+    return sorted(productos, key=lambda p: posicion[p.id])
+
+
+def _buscar_like(texto, terminos, limite, solo_con_stock, cualquiera, ordenar_por_similitud):
+    condiciones = []
+    for termino in terminos:
+        patron = f'%{termino}%'
+        condiciones.append(or_(
+            Producto.nombre.ilike(patron),
+            Producto.descripcion.ilike(patron),
+            Categoria.nombre.ilike(patron)
+        ))
+
+    query = Producto.query.options(joinedload(Producto.categoria_rel)) \
+        .outerjoin(Categoria, Producto.categoria_id == Categoria.id) \
+        .filter(or_(*condiciones) if cualquiera else and_(*condiciones))
+    query = _filtros_base(query, solo_con_stock)
+    if ordenar_por_similitud:
+        query = query.order_by(func.similarity(Producto.nombre, texto).desc())
+    return query.limit(limite).all()
+
+
+def buscar_productos(texto, limite=20, solo_con_stock=False, cualquiera=False):
+    """
+    Busca productos activos por nombre, descripción o nombre de categoría.
+
+    Cada palabra del texto se busca como prefijo (las de una sola letra, como
+    palabra completa); por defecto deben aparecer todas (cualquiera=True acepta
+    cualquiera de ellas, útil para palabras clave).
+    Retorna objetos Producto con la categoría cargada: primero los que empiezan
+    por la primera palabra, ordenados por relevancia dentro de una ventana de
+    CANDIDATOS_FTS coincidencias (no sobre todas, para acotar la latencia).
+    """
+    terminos = _terminos(texto)
+    if not terminos:
+        return []
+
+    motor = _motor()
+    if motor == 'fts5':
+        return _buscar_fts(terminos, limite, solo_con_stock, cualquiera)
+    return _buscar_like(texto.strip(), terminos, limite, solo_con_stock, cualquiera,
+                        ordenar_por_similitud=(motor == 'pg_trgm'))
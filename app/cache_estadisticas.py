@@ -0,0 +1,131 @@
+"""
+Caché de las respuestas de estadísticas del panel de administración.
+
+Cada respuesta se guarda por endpoint y combinación de filtros (query string)
+junto con la versión de los datos con la que se calculó. La versión es un
+contador en memoria que sube con cada commit que escribe ventas, items,
+devoluciones, productos (incluido el stock) o usuarios, así que los sondeos
+del panel se responden desde memoria mientras nada cambie. Las respuestas
+llevan ETag: un sondeo con If-None-Match vigente recibe 304 sin cuerpo.
+
+Con varios procesos cada uno tiene su propia versión; ESTADISTICAS_CACHE_TTL
+limita cuántos segundos puede tardar un proceso en ver lo escrito por otro.
+"""
+from flask import current_app, request, has_app_context
+from app import db
+from app.models import Venta, ItemVenta, Devolucion, ItemDevolucion, Producto, Usuario
+from collections import OrderedDict
+from functools import wraps
+from sqlalchemy import event
+import hashlib
+import threading
+import time
+
+TTL_POR_DEFECTO = 60  # segundos
+MAX_RESPUESTAS = 64  # combinaciones de filtros que se conservan
+
+MODELOS = (Venta, ItemVenta, Devolucion, ItemDevolucion, Producto, Usuario)
+
+_CLAVE_CAMBIOS = 'cache_estadisticas_cambios'
+
+
+def init_app(app):
+    """Registra la caché y los eventos de sesión que suben la versión de los datos"""
+    app.extensions['cache_estadisticas'] = {
+        'lock': threading.Lock(),
+        'version': 0,
+        'respuestas': OrderedDict()  # (endpoint, filtros) -> dict con version, creada, etag y cuerpo
+    }
+
+    if not event.contains(db.session, 'after_flush', _registrar_cambios):
+        event.listen(db.session, 'after_flush', _registrar_cambios)
+        event.listen(db.session, 'after_commit', _aplicar_cambios)
+        event.listen(db.session, 'after_soft_rollback', _descartar_cambios)
+
+
+def _estado():
+    return current_app.extensions['cache_estadisticas']
+
+
+def version_datos():
+    """Versión actual de los datos de estadísticas en este proceso"""
+    return _estado()['version']
+
+
+def invalidar():
+    """Descarta todas las respuestas guardadas (para escrituras fuera del ORM)"""
+    estado = _estado()
+    with estado['lock']:
+        estado['version'] += 1
+        estado['respuestas'].clear()
+
+
+def _registrar_cambios(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, MODELOS):
+            session.info[_CLAVE_CAMBIOS] = True
+            return
+
+
+def _aplicar_cambios(session):
+    if session.info.pop(_CLAVE_CAMBIOS, None) and has_app_context() \
+            and 'cache_estadisticas' in current_app.extensions:
+        invalidar()
+
+
+def _descartar_cambios(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_CLAVE_CAMBIOS, None)
+
+
+def _responder(cuerpo, etag):
+    respuesta = current_app.response_class(cuerpo, mimetype='application/json')
+    respuesta.set_etag(etag)
+    # El navegador guarda la respuesta pero la revalida en cada sondeo
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta.make_conditional(request)
+
+
+def respuesta_en_cache(f):
+    """
+    Decorador para endpoints GET de estadísticas: sirve la respuesta guardada
+    para los mismos filtros si los datos no han cambiado, con ETag y 304.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        estado = _estado()
+        clave = (request.endpoint, tuple(sorted(request.args.items(multi=True))))
+        ttl = current_app.config.get('ESTADISTICAS_CACHE_TTL', TTL_POR_DEFECTO)
+
+        with estado['lock']:
+            version = estado['version']
+            entrada = estado['respuestas'].get(clave)
+            if entrada and (entrada['version'] != version or time.monotonic() - entrada['creada'] > ttl):
+                entrada = None
+            if entrada:
+                estado['respuestas'].move_to_end(clave)
+
+        if entrada:
+            return _responder(entrada['cuerpo'], entrada['etag'])
+
+        respuesta = current_app.make_response(f(*args, **kwargs))
+        if respuesta.status_code != 200:
+            return respuesta
+
+        cuerpo = respuesta.get_data()
+        etag = hashlib.sha1(cuerpo).hexdigest()
+        with estado['lock']:
+            # Si hubo un commit mientras se calculaba, la entrada queda con la versión vieja
+            estado['respuestas'][clave] = {
+                'version': version,
+                'creada': time.monotonic(),
+                'etag': etag,
+                'cuerpo': cuerpo
+            }
+            estado['respuestas'].move_to_end(clave)
+            while len(estado['respuestas']) > MAX_RESPUESTAS:
+                estado['respuestas'].popitem(last=False)
+
+        return _responder(cuerpo, etag)
+
+    return decorated_function
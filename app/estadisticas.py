@@ -0,0 +1,204 @@
+"""
+Agregados de ventas y devoluciones para el panel de administración.
+
+Las cifras se leen del resumen diario (app/resumen_diario.py): un SUM sobre
+unas pocas filas por día en lugar de recorrer ventas, items y devoluciones,
+así que el costo depende de los días del rango y no de la cantidad de ventas.
+Las devoluciones cuentan en el día en que se hicieron.
+"""
+from app import db
+from app.models import ResumenVentaDiaria, Usuario, Producto
+from sqlalchemy import func
+from datetime import datetime, timedelta
+
+PERIODOS = ('dia', 'semana', 'mes')
+VENTANAS = (7, 30, 90, 365)  # días que se pueden consultar en la serie de ventas
+ORDENES_RANKING = ('unidades', 'ingresos', 'ganancia', 'margen')
+
+
+def rango_fechas(fecha_inicio=None, fecha_fin=None):
+    """
+    Convierte las fechas del filtro (AAAA-MM-DD) en datetimes: desde el inicio
+    del primer día hasta el final del último. Las fechas vacías quedan en None.
+    """
+    desde = hasta = None
+    if fecha_inicio:
+        desde = datetime.fromisoformat(fecha_inicio).replace(hour=0, minute=0, second=0, microsecond=0)
+    if fecha_fin:
+        hasta = datetime.fromisoformat(fecha_fin).replace(hour=23, minute=59, second=59, microsecond=999999)
+    return desde, hasta
+
+
+def filtros_resumen(desde=None, hasta=None, usuario_id=None):
+    """Condiciones sobre ResumenVentaDiaria para el rango de días y el usuario"""
+    filtros = []
+    if desde:
+        filtros.append(ResumenVentaDiaria.fecha >= desde.date())
+    if hasta:
+        filtros.append(ResumenVentaDiaria.fecha <= hasta.date())
+    if usuario_id:
+        filtros.append(ResumenVentaDiaria.usuario_id == usuario_id)
+    return filtros
+
+
+def resumen_ventas(desde=None, hasta=None, usuario_id=None):
+    """
+    Totales del rango: cantidad de ventas, ingresos y ganancias netas de
+    devoluciones, y ventas por método de pago. Una consulta agrupada por
+    método de pago sobre el resumen diario.
+    """
+    por_metodo = db.session.query(
+        ResumenVentaDiaria.metodo_pago,
+        func.sum(ResumenVentaDiaria.num_ventas),
+        func.sum(ResumenVentaDiaria.ingresos),
+        func.sum(ResumenVentaDiaria.costo),
+        func.sum(ResumenVentaDiaria.devoluciones),
+        func.sum(ResumenVentaDiaria.costo_devuelto)
+    ).filter(*filtros_resumen(desde, hasta, usuario_id)).group_by(ResumenVentaDiaria.metodo_pago).all()
+
+    pagos = {}
+    total_ventas = 0
+    ganancia_bruta = total_devoluciones = ganancias_perdidas = 0.0
+    for metodo, num_ventas, ingresos, costo, devoluciones, costo_devuelto in por_metodo:
+        if num_ventas:
+            # Un método con solo devoluciones en el rango no aparece en el desglose
+            pagos[metodo] = float(ingresos or 0)
+        total_ventas += int(num_ventas or 0)
+        ganancia_bruta += float(ingresos or 0) - float(costo or 0)
+        total_devoluciones += float(devoluciones or 0)
+        ganancias_perdidas += float(devoluciones or 0) - float(costo_devuelto or 0)
+
+    return {
+        'total_ventas': total_ventas,
+        'total_ingresos': sum(pagos.values()) - total_devoluciones,
+        'total_ganancias': ganancia_bruta - ganancias_perdidas,
+        'total_devoluciones': total_devoluciones,
+        'ganancias_perdidas': ganancias_perdidas,
+        'pagos_por_metodo': pagos
+    }
+
+
+def resumen_empleados(desde=None, hasta=None):
+    """
+    Ventas, ingresos brutos y netos, devoluciones y ganancias por empleado en
+    el rango. Una consulta agrupada por usuario sobre el resumen diario; solo
+    aparecen los empleados con ventas, ordenados por ingresos netos.
+    """
+    filas = db.session.query(
+        Usuario.id,
+        Usuario.username,
+        func.sum(ResumenVentaDiaria.num_ventas),
+        func.sum(ResumenVentaDiaria.ingresos),
+        func.sum(ResumenVentaDiaria.costo),
+        func.sum(ResumenVentaDiaria.devoluciones),
+        func.sum(ResumenVentaDiaria.costo_devuelto)
+    ).join(Usuario, ResumenVentaDiaria.usuario_id == Usuario.id) \
+        .filter(*filtros_resumen(desde, hasta)) \
+        .group_by(Usuario.id, Usuario.username) \
+        .having(func.sum(ResumenVentaDiaria.num_ventas) > 0).all()
+
+    empleados = []
+    for usuario_id, username, num_ventas, ingresos, costo, devoluciones, costo_devuelto in filas:
+        ingresos, costo = float(ingresos or 0), float(costo or 0)
+        devoluciones, costo_devuelto = float(devoluciones or 0), float(costo_devuelto or 0)
+        empleados.append({
+            'usuario_id': usuario_id,
+            'username': username,
+            'total_ventas': int(num_ventas),
+            'ingresos_brutos': round(ingresos, 2),
+            'total_devoluciones': round(devoluciones, 2),
+            'total_ingresos': round(ingresos - devoluciones, 2),
+            'total_ganancias': round((ingresos - costo) - (devoluciones - costo_devuelto), 2)
+        })
+
+    empleados.sort(key=lambda x: x['total_ingresos'], reverse=True)
+    return empleados
+
+
+def ranking_productos(desde=None, hasta=None, usuario_id=None, categoria_id=None, orden='unidades', limite=10):
+    """
+    Productos con más unidades, ingresos, ganancia o margen en el rango, netos
+    de devoluciones. Una consulta sobre el resumen diario unida a productos,
+    agrupada por producto y ordenada por la métrica en la base de datos.
+    """
+    if orden not in ORDENES_RANKING:
+        raise ValueError(f'Orden no válido: {orden}')
+
+    unidades = func.sum(ResumenVentaDiaria.unidades - ResumenVentaDiaria.unidades_devueltas)
+    ingresos = func.sum(ResumenVentaDiaria.ingresos - ResumenVentaDiaria.devoluciones)
+    ganancia = func.sum(
+        ResumenVentaDiaria.ingresos - ResumenVentaDiaria.costo
+        - ResumenVentaDiaria.devoluciones + ResumenVentaDiaria.costo_devuelto
+    )
+    margen = ganancia * 100 / func.nullif(ingresos, 0)
+    metricas = {'unidades': unidades, 'ingresos': ingresos, 'ganancia': ganancia, 'margen': margen}
+
+    filtros = filtros_resumen(desde, hasta, usuario_id)
+    if categoria_id:
+        filtros.append(Producto.categoria_id == categoria_id)
+
+    filas = db.session.query(
+        Producto.id, Producto.nombre, Producto.codigo_barras, unidades, ingresos, ganancia, margen
+    ).select_from(ResumenVentaDiaria).join(Producto, ResumenVentaDiaria.producto_id == Producto.id) \
+        .filter(*filtros) \
+        .group_by(Producto.id, Producto.nombre, Producto.codigo_barras) \
+        .having(func.sum(ResumenVentaDiaria.unidades) > 0) \
+        .order_by(metricas[orden].desc(), Producto.id) \
+        .limit(limite).all()
+
+    return [{
+        'producto_id': producto_id,
+        'nombre': nombre,
+        'codigo_barras': codigo_barras,
+        'cantidad': int(unidades or 0),
+        'ingresos': round(float(ingresos or 0), 2),
+        'ganancia': round(float(ganancia or 0), 2),
+        'margen': round(float(margen), 2) if margen is not None else None
+    } for producto_id, nombre, codigo_barras, unidades, ingresos, ganancia, margen in filas]
+
+
+def inicio_periodo(fecha, periodo):
+    """Primer día del periodo que contiene la fecha (semana = lunes a domingo)"""
+    if periodo == 'semana':
+        return fecha - timedelta(days=fecha.weekday())
+    if periodo == 'mes':
+        return fecha.replace(day=1)
+    return fecha
+
+
+def serie_ventas(dias=7, periodo='dia', usuario_id=None, hoy=None):
+    """
+    Ventas netas de devoluciones por día, semana o mes en los últimos `dias`
+    días (hoy incluido, en UTC). Una consulta agrupada por fecha sobre el rango
+    del resumen diario; los periodos sin ventas quedan en cero.
+    """
+    if periodo not in PERIODOS:
+        raise ValueError(f'Periodo no válido: {periodo}')
+    hoy = hoy or datetime.utcnow().date()
+    desde = hoy - timedelta(days=dias - 1)
+
+    filtros = [ResumenVentaDiaria.fecha >= desde, ResumenVentaDiaria.fecha <= hoy]
+    if usuario_id:
+        filtros.append(ResumenVentaDiaria.usuario_id == usuario_id)
+    por_dia = db.session.query(
+        ResumenVentaDiaria.fecha,
+        func.sum(ResumenVentaDiaria.num_ventas),
+        func.sum(ResumenVentaDiaria.ingresos - ResumenVentaDiaria.devoluciones)
+    ).filter(*filtros).group_by(ResumenVentaDiaria.fecha).all()
+
+    # Todos los periodos del rango, en orden, para que los vacíos aparezcan en cero
+    serie = {}
+    fecha = desde
+    while fecha <= hoy:
+        serie.setdefault(inicio_periodo(fecha, periodo), {'ventas': 0, 'total': 0.0})
+        fecha += timedelta(days=1)
+
+    for fecha, num_ventas, total in por_dia:
+        punto = serie[inicio_periodo(fecha, periodo)]
+        punto['ventas'] += int(num_ventas or 0)
+        punto['total'] += float(total or 0)
+
+    return [
+        {'fecha': fecha.isoformat(), 'ventas': punto['ventas'], 'total': round(punto['total'], 2)}
+        for fecha, punto in serie.items()
+    ]
@@ -0,0 +1,304 @@
+"""
+Exportación de datos (ventas, items, devoluciones y compras) a CSV o XLSX.
+
+Las filas se leen con yield_per (cursor del lado del servidor en PostgreSQL)
+como tuplas de columnas, sin cargar objetos del ORM, y el archivo se genera
+mientras se envía: la memoria no depende de la cantidad de filas y el
+navegador empieza a recibir datos de inmediato.
+
+El XLSX se escribe a mano (un ZIP con XML por hojas) para poder transmitirlo
+sin terminarlo primero; cuando una hoja llega al límite de filas de Excel,
+continúa en la siguiente.
+"""
+from app import db
+from app.models import (Venta, ItemVenta, Devolucion, ItemDevolucion, Compra, ItemCompra,
+                        Producto, Usuario, Proveedor)
+from sqlalchemy import select, func
+from datetime import datetime, date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+import csv
+import io
+import re
+import zipfile
+
+FORMATOS = ('csv', 'xlsx')
+FILAS_POR_LOTE = 1000  # filas que se piden a la base de datos en cada viaje
+MAX_FILAS_HOJA = 1048575  # límite de Excel (sin contar el encabezado)
+
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+
+# ========== CONSULTAS ==========
+
+def _rango(columna, desde, hasta):
+    condiciones = []
+    if desde:
+        condiciones.append(columna >= desde)
+    if hasta:
+        condiciones.append(columna <= hasta)
+    return condiciones
+
+
+def _ventas(desde, hasta):
+    devuelto = select(
+        Devolucion.venta_id,
+        func.sum(Devolucion.total_devolucion).label('total_devuelto')
+    ).group_by(Devolucion.venta_id).subquery()
+    consulta = select(
+        Venta.numero_venta, Venta.fecha_venta, Usuario.username, Venta.metodo_pago,
+        Venta.total, func.coalesce(devuelto.c.total_devuelto, 0), Venta.notas
+    ).outerjoin(Usuario, Venta.usuario_id == Usuario.id) \
+        .outerjoin(devuelto, devuelto.c.venta_id == Venta.id) \
+        .where(*_rango(Venta.fecha_venta, desde, hasta)) \
+        .order_by(Venta.fecha_venta, Venta.id)
+    return ['Número', 'Fecha', 'Empleado', 'Método de pago', 'Total', 'Total devuelto', 'Notas'], consulta
+
+
+def _items_venta(desde, hasta):
+    consulta = select(
+        Venta.numero_venta, Venta.fecha_venta, Producto.codigo_barras, Producto.nombre,
+        ItemVenta.cantidad, ItemVenta.precio_unitario, ItemVenta.subtotal, ItemVenta.costo_unitario
+    ).select_from(ItemVenta).join(Venta, ItemVenta.venta_id == Venta.id) \
+        .outerjoin(Producto, ItemVenta.producto_id == Producto.id) \
+        .where(*_rango(Venta.fecha_venta, desde, hasta)) \
+        .order_by(Venta.fecha_venta, Venta.id, ItemVenta.id)
+    return ['Número venta', 'Fecha', 'Código', 'Producto', 'Cantidad',
+            'Precio unitario', 'Subtotal', 'Costo unitario'], consulta
+
+
+def _devoluciones(desde, hasta):
+    consulta = select(
+        Devolucion.numero_devolucion, Devolucion.fecha_devolucion, Venta.numero_venta,
+        Producto.codigo_barras, Producto.nombre, ItemDevolucion.cantidad,
+        ItemDevolucion.precio_unitario, ItemDevolucion.subtotal, Devolucion.motivo
+    ).select_from(ItemDevolucion).join(Devolucion, ItemDevolucion.devolucion_id == Devolucion.id) \
+        .join(Venta, Devolucion.venta_id == Venta.id) \
+        .outerjoin(Producto, ItemDevolucion.producto_id == Producto.id) \
+        .where(*_rango(Devolucion.fecha_devolucion, desde, hasta)) \
+        .order_by(Devolucion.fecha_devolucion, Devolucion.id, ItemDevolucion.id)
+    return ['Número devolución', 'Fecha', 'Número venta', 'Código', 'Producto', 'Cantidad',
+            'Precio unitario', 'Subtotal', 'Motivo'], consulta
+
+
+def _compras(desde, hasta):
+    consulta = select(
+        Compra.numero_compra, Compra.fecha_recepcion, Proveedor.nombre, Usuario.username,
+        Producto.codigo_barras, Producto.nombre, ItemCompra.cantidad,
+        ItemCompra.precio_unitario, ItemCompra.subtotal
+    ).select_from(ItemCompra).join(Compra, ItemCompra.compra_id == Compra.id) \
+        .outerjoin(Proveedor, Compra.proveedor_id == Proveedor.id) \
+        .outerjoin(Usuario, Compra.usuario_id == Usuario.id) \
+        .outerjoin(Producto, ItemCompra.producto_id == Producto.id) \
+        .where(*_rango(Compra.fecha_recepcion, desde, hasta)) \
+        .order_by(Compra.fecha_recepcion, Compra.id, ItemCompra.id)
+    return ['Número compra', 'Fecha', 'Proveedor', 'Empleado', 'Código', 'Producto',
+            'Cantidad', 'Precio unitario', 'Subtotal'], consulta
+
+
+TIPOS = {
+    'ventas': _ventas,
+    'items_venta': _items_venta,
+    'devoluciones': _devoluciones,
+    'compras': _compras,
+}
+
+
+def filas_exportacion(tipo, desde=None, hasta=None):
+    """Retorna (encabezados, generador de filas) para el tipo de datos y el rango"""
+    if tipo not in TIPOS:
+        raise ValueError(f'Tipo de exportación no válido: {tipo}')
+    encabezados, consulta = TIPOS[tipo](desde, hasta)
+
+    def generar():
+        resultado = db.session.execute(consulta.execution_options(yield_per=FILAS_POR_LOTE))
+        try:
+            for fila in resultado:
+                yield fila
+        finally:
+            resultado.close()
+
+    return encabezados, generar()
+
+
+# ========== FORMATOS ==========
+
+def _valor_csv(valor):
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    return valor
+
+
+def generar_csv(encabezados, filas):
+    """Genera el CSV por bloques de texto (con BOM para que Excel lea los acentos)"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('\ufeff')
+    escritor.writerow(encabezados)
+    for numero, fila in enumerate(filas, 1):
+        escritor.writerow([_valor_csv(valor) for valor in fila])
+        if numero % FILAS_POR_LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _SalidaStream:
+    """Archivo de solo escritura cuyo contenido se va retirando (ZIP hacia la respuesta)"""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def _columna_excel(indice):
+    letras = ''
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+_CONTROL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')  # caracteres que XML no admite
+
+
+def _celda(referencia, valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return f'<c r="{referencia}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c r="{referencia}"><v>{valor}</v></c>'
+    if isinstance(valor, datetime):
+        valor = valor.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(valor, date):
+        valor = valor.isoformat()
+    texto = escape(_CONTROL_XML.sub('', str(valor)))
+    return f'<c r="{referencia}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _fila_xml(numero, valores, columnas):
+    celdas = ''.join(_celda(f'{columnas[i]}{numero}', valor) for i, valor in enumerate(valores))
+    return f'<row r="{numero}">{celdas}</row>'
+
+
+_INICIO_HOJA = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_FIN_HOJA = '</sheetData></worksheet>'
+
+
+def generar_xlsx(encabezados, filas, nombre_hoja='Datos'):
+    """Genera un XLSX por bloques de bytes; las hojas se escriben mientras llegan las filas"""
+    salida = _SalidaStream()
+    columnas = [_columna_excel(i) for i in range(len(encabezados))]
+    hojas = 0
+
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED) as archivo:
+        hoja = None
+        fila_hoja = 0
+        pendientes = []  # filas XML que se comprimen juntas en cada lote
+
+        def abrir_hoja():
+            nonlocal hoja, hojas, fila_hoja
+            hojas += 1
+            hoja = archivo.open(f'xl/worksheets/sheet{hojas}.xml', 'w')
+            hoja.write((_INICIO_HOJA + _fila_xml(1, encabezados, columnas)).encode())
+            fila_hoja = 1
+
+        def cerrar_hoja():
+            hoja.write((''.join(pendientes) + _FIN_HOJA).encode())
+            pendientes.clear()
+            hoja.close()
+
+        for fila in filas:
+            if hoja is None:
+                abrir_hoja()
+            elif fila_hoja > MAX_FILAS_HOJA:
+                cerrar_hoja()
+                abrir_hoja()
+            fila_hoja += 1
+            pendientes.append(_fila_xml(fila_hoja, fila, columnas))
+            if len(pendientes) >= FILAS_POR_LOTE:
+                hoja.write(''.join(pendientes).encode())
+                pendientes.clear()
+                yield salida.retirar()
+
+        if hoja is None:
+            # Sin filas: una hoja solo con encabezados
+            abrir_hoja()
+        cerrar_hoja()
+
+        _escribir_estructura_xlsx(archivo, hojas, nombre_hoja)
+
+    yield salida.retirar()
+
+
+def _escribir_estructura_xlsx(archivo, hojas, nombre_hoja):
+    tipos_hojas = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, hojas + 1)
+    )
+    archivo.writestr('[Content_Types].xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        f'{tipos_hojas}</Types>'
+    ))
+    archivo.writestr('_rels/.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    ))
+    nombres = ''.join(
+        f'<sheet name="{escape(nombre_hoja if i == 1 else f"{nombre_hoja} {i}")}" sheetId="{i}" r:id="rId{i}"/>'
+        for i in range(1, hojas + 1)
+    )
+    archivo.writestr('xl/workbook.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets>{nombres}</sheets></workbook>'
+    ))
+    relaciones = ''.join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, hojas + 1)
+    )
+    archivo.writestr('xl/_rels/workbook.xml.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'{relaciones}</Relationships>'
+    ))
+
+
+def generar_archivo(tipo, formato, desde=None, hasta=None):
+    """Generador con el contenido del archivo de exportación (texto para CSV, bytes para XLSX)"""
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato no válido: {formato}')
+    encabezados, filas = filas_exportacion(tipo, desde, hasta)
+    if formato == 'xlsx':
+        return generar_xlsx(encabezados, filas, nombre_hoja=tipo.replace('_', ' ').capitalize())
+    return generar_csv(encabezados, filas)
@@ -0,0 +1,289 @@
+"""
+Exportación masiva de facturas PDF para un rango de fechas.
+
+Las ventas se leen por lotes de ids con sus items, productos y usuario ya
+cargados. Cada factura se convierte en un dict (facturas_pdf.datos_factura) y
+se genera con reportlab en un pool de procesos, con un número acotado de
+facturas en vuelo. La salida es un ZIP con un PDF por venta, escrito de forma
+incremental (memoria constante), o un único PDF combinado (requiere pypdf).
+pypdf mantiene en memoria todas las páginas hasta escribir el archivo, así que
+el PDF combinado se limita a MAX_FACTURAS_PDF_COMBINADO facturas; para rangos
+mayores se usa el ZIP.
+
+Se usa desde el panel de administración (trabajo en segundo plano con
+progreso consultable) y desde la línea de comandos:
+
+    flask --app run exportar-facturas --desde 2026-10-01 --hasta 2026-10-31
+"""
+from flask import current_app
+from app import db, facturas_pdf
+from app.models import Venta, ItemVenta, Consulta, ConfiguracionNegocio
+from sqlalchemy.orm import selectinload, joinedload
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import click
+import multiprocessing
+import os
+import threading
+import traceback
+import uuid
+import zipfile
+
+FORMATOS = ('zip', 'pdf')
+TAMANO_LOTE = 50  # ventas que se leen de la base de datos por consulta
+MAX_TRABAJOS_HISTORIAL = 20  # exportaciones terminadas que se conservan (con su archivo)
+MAX_FACTURAS_PDF_COMBINADO = 500  # el PDF combinado se arma en memoria antes de escribirlo
+
+PENDIENTE = 'pendiente'
+PROCESANDO = 'procesando'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+
+def init_app(app):
+    """Registra el estado de las exportaciones y el comando de consola"""
+    app.extensions['exportar_facturas'] = {
+        'lock': threading.Lock(),
+        'trabajos': OrderedDict()
+    }
+    app.cli.add_command(comando_exportar_facturas)
+
+
+def _estado():
+    return current_app.extensions['exportar_facturas']
+
+
+def consulta_ventas(desde, hasta, usuario_id=None, metodo_pago=None):
+    """Ventas entre dos fechas (ambos días incluidos), opcionalmente por usuario y método de pago"""
+    query = Venta.query.filter(
+        Venta.fecha_venta >= datetime.combine(desde, datetime.min.time()),
+        Venta.fecha_venta < datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+    )
+    if usuario_id:
+        query = query.filter(Venta.usuario_id == usuario_id)
+    if metodo_pago:
+        query = query.filter(Venta.metodo_pago == metodo_pago)
+    return query
+
+
+def _lotes_datos(venta_ids, config):
+    """Genera los datos de cada factura leyendo las ventas por lotes de ids"""
+    for inicio in range(0, len(venta_ids), TAMANO_LOTE):
+        ids = venta_ids[inicio:inicio + TAMANO_LOTE]
+        ventas = Venta.query.options(
+            selectinload(Venta.items).joinedload(ItemVenta.producto),
+            joinedload(Venta.usuario)
+        ).filter(Venta.id.in_(ids)).all()
+        consultas = {
+            consulta.venta_id: consulta
+            for consulta in Consulta.query.options(joinedload(Consulta.animal)).filter(Consulta.venta_id.in_(ids))
+        }
+
+        por_id = {venta.id: venta for venta in ventas}
+        for venta_id in ids:
+            if venta_id in por_id:
+                yield facturas_pdf.datos_factura(por_id[venta_id], config, consultas.get(venta_id))
+
+        # Soltar los objetos del lote para que la memoria no crezca con el rango
+        db.session.expunge_all()
+
+
+def generar_facturas(venta_ids, procesos=None):
+    """
+    Genera (nombre_archivo, bytes_pdf) en el orden de venta_ids, repartiendo
+    reportlab entre `procesos` procesos (por defecto, todos los núcleos).
+    """
+    config = ConfiguracionNegocio.obtener_configuracion()
+    procesos = procesos or current_app.config.get('EXPORTACION_PROCESOS') or os.cpu_count() or 1
+    # Facturas en vuelo: suficientes para tener los procesos ocupados sin acumular PDFs
+    en_vuelo_max = procesos * 4
+
+    # 'spawn' y no fork: esto corre en un hilo del servidor y fork copiaría el
+    # proceso con locks tomados por otros hilos (pool de SQLAlchemy, impresión)
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        en_vuelo = deque()
+        for datos in _lotes_datos(venta_ids, config):
+            en_vuelo.append((datos['numero_venta'], pool.submit(facturas_pdf.construir_pdf, datos)))
+            if len(en_vuelo) >= en_vuelo_max:
+                numero_venta, futuro = en_vuelo.popleft()
+                yield f'factura_{numero_venta}.pdf', futuro.result()
+        while en_vuelo:
+            numero_venta, futuro = en_vuelo.popleft()
+            yield f'factura_{numero_venta}.pdf', futuro.result()
+
+
+def escribir_zip(destino, facturas, progreso=None):
+    """Escribe un ZIP con un PDF por factura; `destino` es una ruta o un archivo abierto"""
+    cantidad = 0
+    with zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_DEFLATED) as archivo_zip:
+        for nombre, pdf in facturas:
+            archivo_zip.writestr(nombre, pdf)
+            cantidad += 1
+            if progreso:
+                progreso(cantidad)
+    return cantidad
+
+
+def escribir_pdf_combinado(destino, facturas, progreso=None):
+    """
+    Escribe todas las facturas en un único PDF (una tras otra). Las páginas
+    quedan en memoria hasta el final: usar solo con MAX_FACTURAS_PDF_COMBINADO
+    facturas o menos.
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        raise RuntimeError('Para exportar un PDF combinado instala pypdf (pip install pypdf)')
+    from io import BytesIO
+
+    escritor = PdfWriter()
+    cantidad = 0
+    for nombre, pdf in facturas:
+        escritor.append(PdfReader(BytesIO(pdf)))
+        cantidad += 1
+        if progreso:
+            progreso(cantidad)
+    escritor.write(destino)
+    return cantidad
+
+
+def validar_formato(formato, cantidad):
+    """ValueError si el formato no existe o si son demasiadas facturas para un PDF combinado"""
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato no válido: {formato}')
+    if formato == 'pdf' and cantidad > MAX_FACTURAS_PDF_COMBINADO:
+        raise ValueError(f'El PDF combinado admite hasta {MAX_FACTURAS_PDF_COMBINADO} facturas '
+                         f'(el rango tiene {cantidad}); exporta en ZIP o elige un rango menor')
+
+
+def exportar(destino, venta_ids, formato='zip', procesos=None, progreso=None):
+    """Genera las facturas de venta_ids y las escribe en `destino` con el formato pedido"""
+    validar_formato(formato, len(venta_ids))
+    facturas = generar_facturas(venta_ids, procesos)
+    if formato == 'pdf':
+        return escribir_pdf_combinado(destino, facturas, progreso)
+    return escribir_zip(destino, facturas, progreso)
+
+
+# ========== EXPORTACIONES EN SEGUNDO PLANO (PANEL DE ADMINISTRACIÓN) ==========
+
+def iniciar_exportacion(desde, hasta, usuario_id=None, metodo_pago=None, formato='zip'):
+    """
+    Crea un trabajo de exportación y lo ejecuta en un hilo. Retorna el dict del
+    trabajo (None si no hay ventas); el avance se consulta con obtener_exportacion().
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato no válido: {formato}')
+
+    venta_ids = [venta_id for (venta_id,) in consulta_ventas(desde, hasta, usuario_id, metodo_pago)
+                 .with_entities(Venta.id).order_by(Venta.fecha_venta, Venta.id)]
+    if not venta_ids:
+        return None
+    validar_formato(formato, len(venta_ids))
+
+    directorio = current_app.config['EXPORTACIONES_DIR']
+    os.makedirs(directorio, exist_ok=True)
+    trabajo_id = uuid.uuid4().hex
+    trabajo = {
+        'id': trabajo_id,
+        'estado': PENDIENTE,
+        'formato': formato,
+        'total': len(venta_ids),
+        'procesadas': 0,
+        'error': None,
+        'nombre_archivo': f'facturas_{desde.isoformat()}_{hasta.isoformat()}.{formato}',
+        'ruta': os.path.join(directorio, f'exportacion_{trabajo_id}.{formato}'),
+        'fecha_creacion': datetime.utcnow().isoformat()
+    }
+
+    estado = _estado()
+    with estado['lock']:
+        estado['trabajos'][trabajo_id] = trabajo
+        _recortar_historial(estado)
+
+    app = current_app._get_current_object()
+    hilo = threading.Thread(target=_ejecutar, args=(app, trabajo_id, venta_ids), name='exportar-facturas', daemon=True)
+    hilo.start()
+    return dict(trabajo)
+
+
+def obtener_exportacion(trabajo_id):
+    """Estado de una exportación o None si no existe"""
+    estado = _estado()
+    with estado['lock']:
+        trabajo = estado['trabajos'].get(trabajo_id)
+        return dict(trabajo) if trabajo else None
+
+
+def _actualizar(trabajo_id, **campos):
+    estado = _estado()
+    with estado['lock']:
+        if trabajo_id in estado['trabajos']:
+            estado['trabajos'][trabajo_id].update(campos)
+
+
+def _recortar_historial(estado):
+    terminados = [t for t in estado['trabajos'].values() if t['estado'] in (COMPLETADO, ERROR)]
+    for trabajo in terminados[:max(0, len(terminados) - MAX_TRABAJOS_HISTORIAL)]:
+        del estado['trabajos'][trabajo['id']]
+        try:
+            os.remove(trabajo['ruta'])
+        except OSError:
+            pass
+
+
+def _ejecutar(app, trabajo_id, venta_ids):
+    with app.app_context():
+        trabajo = obtener_exportacion(trabajo_id)
+        _actualizar(trabajo_id, estado=PROCESANDO)
+        try:
+            temporal = f"{trabajo['ruta']}.tmp"
+            with open(temporal, 'wb') as destino:
+                exportar(destino, venta_ids, trabajo['formato'],
+                         progreso=lambda cantidad: _actualizar(trabajo_id, procesadas=cantidad))
+            os.replace(temporal, trabajo['ruta'])
+            _actualizar(trabajo_id, estado=COMPLETADO)
+        except Exception as e:
+            print(f"Error al exportar facturas: {traceback.format_exc()}")
+            _actualizar(trabajo_id, estado=ERROR, error=str(e))
+        finally:
+            db.session.remove()
+
+
+# ========== COMANDO DE CONSOLA ==========
+
+@click.command('exportar-facturas')
+@click.option('--desde', required=True, type=click.DateTime(formats=['%Y-%m-%d']), help='Fecha inicial (AAAA-MM-DD)')
+@click.option('--hasta', required=True, type=click.DateTime(formats=['%Y-%m-%d']), help='Fecha final, incluida (AAAA-MM-DD)')
+@click.option('--usuario', 'usuario_id', type=int, help='Solo ventas de este usuario (id)')
+@click.option('--metodo-pago', help='Solo ventas con este método de pago')
+@click.option('--formato', type=click.Choice(FORMATOS), default='zip', show_default=True,
+              help=f'zip (un PDF por venta) o pdf (combinado, hasta {MAX_FACTURAS_PDF_COMBINADO} facturas)')
+@click.option('--salida', type=click.Path(dir_okay=False), help='Archivo de salida')
+@click.option('--procesos', type=int, help='Procesos para generar PDFs (por defecto, todos los núcleos)')
+def comando_exportar_facturas(desde, hasta, usuario_id, metodo_pago, formato, salida, procesos):
+    """Exporta las facturas PDF de un rango de fechas a un ZIP o a un PDF combinado"""
+    desde, hasta = desde.date(), hasta.date()
+    venta_ids = [venta_id for (venta_id,) in consulta_ventas(desde, hasta, usuario_id, metodo_pago)
+                 .with_entities(Venta.id).order_by(Venta.fecha_venta, Venta.id)]
+    total = len(venta_ids)
+    if not total:
+        click.echo('No hay ventas en el rango indicado')
+        return
+    try:
+        validar_formato(formato, total)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    salida = salida or f'facturas_{desde.isoformat()}_{hasta.isoformat()}.{formato}'
+    paso = max(1, total // 20)
+
+    def progreso(cantidad):
+        if cantidad % paso == 0 or cantidad == total:
+            click.echo(f'  {cantidad}/{total} facturas ({cantidad * 100 // total}%)')
+
+    click.echo(f'Exportando {total} facturas a {salida}...')
+    cantidad = exportar(salida, venta_ids, formato, procesos, progreso)
+    click.echo(f'✓ {cantidad} facturas exportadas en {salida}')
@@ -0,0 +1,330 @@
+"""
+Facturas de venta en PDF y su caché en disco.
+
+Una venta no cambia después del commit salvo por devoluciones, así que el PDF
+se genera una vez y se guarda en FACTURAS_CACHE_DIR. El nombre del archivo
+lleva una versión calculada con la fecha de actualización de la configuración
+del negocio y las devoluciones de la venta: si alguna cambia, la versión
+cambia y el PDF se vuelve a generar. La versión también sirve de ETag.
+"""
+from flask import current_app
+from app import db
+from app.models import Devolucion, Consulta
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as ReportLabImage
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from sqlalchemy import func
+from functools import lru_cache
+from io import BytesIO
+import glob
+import hashlib
+import os
+
+# Cambiar al modificar el diseño de la factura para descartar los PDFs guardados
+FORMATO_FACTURA = 1
+
+
+@lru_cache(maxsize=None)
+def _estilos():
+    """Hojas de estilo de la factura (se crean una sola vez por proceso)"""
+    styles = getSampleStyleSheet()
+
+    # Estilos personalizados
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1e40af'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.HexColor('#1e40af'),
+        spaceAfter=12
+    )
+
+    footer_style = ParagraphStyle('Footer', parent=styles['Normal'],
+                                  fontSize=8, textColor=colors.grey,
+                                  alignment=TA_CENTER)
+
+    # Tablas de información (venta y paciente)
+    info_table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e5e7eb')),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+    ])
+
+    productos_table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-2, -2), colors.white),
+        ('TEXTCOLOR', (0, 1), (-2, -2), colors.black),
+        ('FONTNAME', (0, 1), (-2, -2), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-2, -2), 10),
+        ('GRID', (0, 0), (-1, -2), 1, colors.grey),
+        ('LINEBELOW', (0, -2), (-1, -2), 2, colors.black),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#f3f4f6')),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, -1), (-1, -1), 12),
+        ('TOPPADDING', (0, -1), (-1, -1), 12),
+        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
+    ])
+
+    return {
+        'styles': styles,
+        'title': title_style,
+        'heading': heading_style,
+        'footer': footer_style,
+        'info_table': info_table_style,
+        'productos_table': productos_table_style
+    }
+
+
+def datos_factura(venta, config, consulta=None):
+    """
+    Copia en un dict todo lo que se imprime en la factura, para poder generar
+    el PDF sin sesión de base de datos (por ejemplo en otro proceso).
+    """
+    logo_path = None
+    if config and config.logo_path:
+        logo_path = os.path.join(current_app.root_path, 'static', config.logo_path)
+
+    animal = None
+    if consulta and consulta.animal:
+        animal = {
+            'nombre': consulta.animal.nombre,
+            'especie': consulta.animal.especie,
+            'raza': consulta.animal.raza,
+            'edad': consulta.animal.get_edad_display(),
+            'nombre_dueno': consulta.animal.nombre_dueno,
+            'telefono_dueno': consulta.animal.telefono_dueno
+        }
+
+    return {
+        'venta_id': venta.id,
+        'numero_venta': venta.numero_venta,
+        'fecha_venta': venta.fecha_venta.strftime('%d/%m/%Y %H:%M'),
+        'metodo_pago': venta.metodo_pago.upper(),
+        'vendedor': venta.usuario.username if venta.usuario else 'N/A',
+        'total': venta.total,
+        'notas': venta.notas,
+        'items': [{
+            'nombre': item.producto.nombre,
+            'cantidad': item.cantidad,
+            'precio_unitario': item.precio_unitario,
+            'subtotal': item.subtotal
+        } for item in venta.items],
+        'animal': animal,
+        'nombre_negocio': config.nombre_negocio if config and config.nombre_negocio else "VETERINARIA",
+        'nit': config.nit if config else None,
+        'direccion': config.direccion if config else None,
+        'telefono': config.telefono if config else None,
+        'correo': config.correo if config else None,
+        'logo_path': logo_path
+    }
+
+
+def construir_pdf(datos):
+    """Genera el PDF de la factura a partir de datos_factura() y retorna los bytes"""
+    estilos = _estilos()
+    styles = estilos['styles']
+    heading_style = estilos['heading']
+
+    # Crear buffer para el PDF
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter,
+                            rightMargin=72, leftMargin=72,
+                            topMargin=72, bottomMargin=18)
+
+    # Contenedor para los elementos del PDF
+    elements = []
+
+    # Logo si existe
+    if datos['logo_path'] and os.path.exists(datos['logo_path']):
+        try:
+            logo_img = ReportLabImage(datos['logo_path'], width=2*inch, height=1*inch)
+            logo_img.hAlign = 'CENTER'
+            elements.append(logo_img)
+            elements.append(Spacer(1, 0.2*inch))
+        except:
+            pass
+
+    # Título
+    elements.append(Paragraph("FACTURA DE VENTA", estilos['title']))
+    elements.append(Spacer(1, 0.2*inch))
+
+    # Información de la empresa
+    nombre_negocio = datos['nombre_negocio']
+    elements.append(Paragraph(f"<b>{nombre_negocio.upper()}</b>", styles['Heading2']))
+
+    # Información adicional del negocio
+    info_negocio = []
+    if datos['nit']:
+        info_negocio.append(f"NIT: {datos['nit']}")
+    if datos['direccion']:
+        info_negocio.append(datos['direccion'])
+    if datos['telefono']:
+        info_negocio.append(f"Tel: {datos['telefono']}")
+    if datos['correo']:
+        info_negocio.append(f"Email: {datos['correo']}")
+
+    for info in info_negocio:
+        elements.append(Paragraph(info, styles['Normal']))
+
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Información de la venta
+    data_venta = [
+        ['Número de Venta:', datos['numero_venta']],
+        ['Fecha:', datos['fecha_venta']],
+        ['Método de Pago:', datos['metodo_pago']],
+        ['Vendedor:', datos['vendedor']],
+    ]
+
+    # Si la venta viene de una consulta, agregar información del animal
+    animal = datos['animal']
+    if animal:
+        elements.append(Spacer(1, 0.2*inch))
+        elements.append(Paragraph("<b>INFORMACIÓN DEL PACIENTE</b>", heading_style))
+        data_animal = [
+            ['Nombre del Animal:', animal['nombre']],
+            ['Especie:', animal['especie']],
+            ['Raza:', animal['raza'] or 'No especificada'],
+            ['Edad:', animal['edad']],
+            ['Dueño:', animal['nombre_dueno']],
+            ['Contacto:', animal['telefono_dueno'] or 'No registrado'],
+        ]
+        table_animal = Table(data_animal, colWidths=[2.5*inch, 3.5*inch])
+        table_animal.setStyle(estilos['info_table'])
+        elements.append(table_animal)
+        elements.append(Spacer(1, 0.2*inch))
+
+    # Tabla de información de venta
+    table_venta = Table(data_venta, colWidths=[2.5*inch, 3.5*inch])
+    table_venta.setStyle(estilos['info_table'])
+    elements.append(table_venta)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Tabla de productos
+    elements.append(Paragraph("<b>DETALLE DE PRODUCTOS</b>", heading_style))
+
+    data_productos = [['Producto', 'Cantidad', 'Precio Unit.', 'Subtotal']]
+    for item in datos['items']:
+        data_productos.append([
+            item['nombre'],
+            str(item['cantidad']),
+            f"${item['precio_unitario']:,.0f}",
+            f"${item['subtotal']:,.0f}"
+        ])
+
+    # Agregar total
+    data_productos.append(['TOTAL', '', '', f"${datos['total']:,.0f}"])
+
+    table_productos = Table(data_productos, colWidths=[3.5*inch, 1*inch, 1.25*inch, 1.25*inch])
+    table_productos.setStyle(estilos['productos_table'])
+    elements.append(table_productos)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Notas si existen
+    if datos['notas']:
+        elements.append(Paragraph("<b>NOTAS:</b>", styles['Heading3']))
+        elements.append(Paragraph(datos['notas'], styles['Normal']))
+        elements.append(Spacer(1, 0.2*inch))
+
+    # Pie de página
+    elements.append(Spacer(1, 0.5*inch))
+    elements.append(Paragraph("Gracias por su compra", styles['Normal']))
+    footer_text = nombre_negocio
+    if datos['telefono']:
+        footer_text += f" | Tel: {datos['telefono']}"
+    elements.append(Paragraph(footer_text, estilos['footer']))
+
+    # Construir PDF
+    doc.build(elements)
+
+    pdf = buffer.getvalue()
+    buffer.close()
+    return pdf
+
+
+def _directorio():
+    return current_app.config['FACTURAS_CACHE_DIR']
+
+
+def version_factura(venta, config):
+    """
+    Versión del PDF de una venta: cambia si se actualiza la configuración del
+    negocio o si se registra una devolución de la venta.
+    """
+    cantidad, ultima = db.session.query(
+        func.count(Devolucion.id), func.max(Devolucion.id)
+    ).filter(Devolucion.venta_id == venta.id).one()
+
+    sello_config = ''
+    if config:
+        sello_config = f"{config.fecha_actualizacion.isoformat() if config.fecha_actualizacion else ''}|{config.logo_path or ''}"
+
+    sello = f'{FORMATO_FACTURA}|{venta.id}|{venta.numero_venta}|{sello_config}|{cantidad}|{ultima or 0}'
+    return hashlib.sha1(sello.encode()).hexdigest()[:16]
+
+
+def ruta_factura(venta_id, version):
+    return os.path.join(_directorio(), f'factura_{venta_id}_{version}.pdf')
+
+
+def obtener_factura(venta, config, version=None):
+    """
+    Retorna la ruta del PDF de la venta, generándolo solo si no está en caché.
+    Las versiones anteriores de la misma factura se eliminan al generar una nueva.
+    """
+    version = version or version_factura(venta, config)
+    ruta = ruta_factura(venta.id, version)
+    if os.path.exists(ruta):
+        return ruta
+
+    consulta = Consulta.query.filter_by(venta_id=venta.id).first()
+    pdf = construir_pdf(datos_factura(venta, config, consulta))
+
+    invalidar_factura(venta.id)
+    os.makedirs(_directorio(), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(pdf)
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def invalidar_factura(venta_id):
+    """Elimina los PDFs guardados de una venta (p. ej. tras una devolución)"""
+    for ruta in glob.glob(os.path.join(_directorio(), f'factura_{venta_id}_*.pdf')):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def invalidar_todas():
+    """Elimina todos los PDFs guardados (p. ej. tras cambiar la configuración del negocio)"""
+    for ruta in glob.glob(os.path.join(_directorio(), 'factura_*.pdf')):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
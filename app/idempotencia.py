@@ -0,0 +1,163 @@
+from flask import current_app, request, g, jsonify, make_response, has_request_context
+from flask_login import current_user
+from app import db
+from app.models import SolicitudIdempotente
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from sqlalchemy import event
+import threading
+import zlib
+
+ENCABEZADO = 'Idempotency-Key'
+CACHE_MAX_POR_DEFECTO = 512
+DIAS_RETENCION = 7
+
+# Un lock por franja de claves: serializa reintentos simultáneos de la misma clave
+_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+def init_app(app):
+    """Registra la caché en memoria y el evento que guarda la clave con la transacción"""
+    app.extensions['idempotencia'] = {
+        'lock': threading.Lock(),
+        'cache': OrderedDict(),
+        'ultima_purga': None
+    }
+    if not event.contains(db.session, 'before_commit', _registrar_clave):
+        event.listen(db.session, 'before_commit', _registrar_clave)
+
+
+def _estado():
+    return current_app.extensions['idempotencia']
+
+
+def _cache_obtener(endpoint, clave):
+    estado = _estado()
+    with estado['lock']:
+        registro = estado['cache'].get((endpoint, clave))
+        if registro is not None:
+            estado['cache'].move_to_end((endpoint, clave))
+        return registro
+
+
+def _cache_guardar(endpoint, clave, registro):
+    estado = _estado()
+    maximo = current_app.config.get('IDEMPOTENCIA_CACHE_MAX', CACHE_MAX_POR_DEFECTO)
+    with estado['lock']:
+        estado['cache'][(endpoint, clave)] = registro
+        estado['cache'].move_to_end((endpoint, clave))
+        while len(estado['cache']) > maximo:
+            estado['cache'].popitem(last=False)
+
+
+def _buscar(endpoint, clave):
+    """Busca el resultado guardado: primero en la caché, luego en la tabla"""
+    registro = _cache_obtener(endpoint, clave)
+    if registro is not None:
+        return registro
+
+    solicitud = SolicitudIdempotente.query.filter_by(endpoint=endpoint, clave=clave).first()
+    if not solicitud:
+        return None
+    registro = {
+        'usuario_id': solicitud.usuario_id,
+        'codigo_estado': solicitud.codigo_estado,
+        'respuesta': solicitud.respuesta
+    }
+    if registro['codigo_estado'] is not None:
+        _cache_guardar(endpoint, clave, registro)
+    return registro
+
+
+def _responder_guardada(registro):
+    if registro['usuario_id'] != current_user.id:
+        return jsonify({'error': 'La clave de idempotencia pertenece a otra solicitud'}), 409
+    if registro['codigo_estado'] is None:
+        # La transacción original se confirmó pero su respuesta no alcanzó a guardarse
+        return jsonify({'error': 'La solicitud original ya fue registrada. Verifica el historial antes de reintentar.'}), 409
+
+    respuesta = current_app.response_class(
+        registro['respuesta'], status=registro['codigo_estado'], mimetype='application/json'
+    )
+    respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+
+def _guardar_respuesta(endpoint, clave, respuesta):
+    registro = {
+        'usuario_id': current_user.id,
+        'codigo_estado': respuesta.status_code,
+        'respuesta': respuesta.get_data(as_text=True)
+    }
+    SolicitudIdempotente.query.filter_by(endpoint=endpoint, clave=clave).update({
+        'codigo_estado': registro['codigo_estado'],
+        'respuesta': registro['respuesta']
+    })
+    _purgar_antiguas()
+    db.session.commit()
+    _cache_guardar(endpoint, clave, registro)
+
+
+def _purgar_antiguas():
+    """Elimina, como máximo una vez al día, las claves con más de DIAS_RETENCION días"""
+    estado = _estado()
+    ahora = datetime.utcnow()
+    if estado['ultima_purga'] and ahora - estado['ultima_purga'] < timedelta(days=1):
+        return
+    estado['ultima_purga'] = ahora
+    SolicitudIdempotente.query.filter(
+        SolicitudIdempotente.fecha_creacion < ahora - timedelta(days=DIAS_RETENCION)
+    ).delete(synchronize_session=False)
+
+
+def _registrar_clave(session):
+    """Agrega la clave pendiente a la transacción que confirma la operación"""
+    if not has_request_context():
+        return
+    pendiente = g.pop('solicitud_idempotente', None)
+    if pendiente:
+        session.add(SolicitudIdempotente(**pendiente))
+
+
+def idempotente(f):
+    """
+    Decorador para endpoints POST que crean documentos (ventas, compras, devoluciones).
+
+    Si la petición trae el encabezado Idempotency-Key, la clave se guarda en la
+    misma transacción que la operación y la respuesta exitosa queda registrada.
+    Un reintento con la misma clave recibe la respuesta original sin volver a
+    ejecutar la operación. Las respuestas de error no se guardan.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        clave = request.headers.get(ENCABEZADO, '').strip()[:100]
+        if not clave:
+            return f(*args, **kwargs)
+
+        endpoint = request.endpoint
+        lock = _LOCKS[zlib.crc32(f'{endpoint}:{clave}'.encode()) % len(_LOCKS)]
+        with lock:
+            registro = _buscar(endpoint, clave)
+            if registro is not None:
+                return _responder_guardada(registro)
+
+            g.solicitud_idempotente = {'endpoint': endpoint, 'clave': clave, 'usuario_id': current_user.id}
+            try:
+                respuesta = make_response(f(*args, **kwargs))
+            finally:
+                confirmada = 'solicitud_idempotente' not in g
+                g.pop('solicitud_idempotente', None)
+
+            if respuesta.status_code >= 400 or not confirmada:
+                db.session.rollback()
+                # Otro proceso pudo haber confirmado la misma clave primero
+                registro = _buscar(endpoint, clave)
+                if registro is not None:
+                    return _responder_guardada(registro)
+                return respuesta
+
+            _guardar_respuesta(endpoint, clave, respuesta)
+            return respuesta
+
+    return decorated_function
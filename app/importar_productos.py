@@ -0,0 +1,543 @@
+"""
+Importación masiva del catálogo de productos desde CSV o XLSX.
+
+El archivo se lee fila por fila (el XLSX se recorre con iterparse, sin cargar
+la hoja completa) y se procesa por lotes de TAMANO_LOTE filas. Cada lote hace
+una consulta IN por código de barras, un INSERT multi-fila para los productos
+nuevos y un UPDATE con executemany para los existentes, y se confirma por
+separado: un lote con errores de base de datos no deshace los anteriores.
+
+- Las categorías que no existen se crean (la comparación ignora mayúsculas).
+- En un producto existente, las celdas vacías conservan el valor actual; los
+  productos importados quedan activos.
+- El stock del archivo es el stock real: la diferencia se registra en el
+  kardex como ajuste (o como inventario inicial en los productos nuevos).
+- Las filas inválidas se informan con su número y no detienen la importación.
+
+Se usa desde la lista de productos (trabajo en segundo plano con progreso
+consultable) y desde la línea de comandos:
+
+    flask --app run importar-productos catalogo.xlsx
+"""
+from flask import current_app
+from app import db, kardex, alertas_stock, indice_productos, cache_estadisticas
+from app.models import Producto, Categoria
+from sqlalchemy import select, insert, update, bindparam, func
+from sqlalchemy.exc import SQLAlchemyError
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from xml.etree import ElementTree
+import click
+import codecs
+import csv
+import io
+import itertools
+import os
+import re
+import threading
+import traceback
+import unicodedata
+import uuid
+import zipfile
+
+FORMATOS = ('csv', 'xlsx')
+TAMANO_LOTE = 1000  # filas por consulta, INSERT/UPDATE y commit
+MAX_ERRORES = 200  # errores por fila que se guardan en el resultado (se cuentan todos)
+MAX_TRABAJOS_HISTORIAL = 20  # importaciones terminadas que se conservan
+PRECIO_MAXIMO = Decimal('99999999.99')  # Numeric(10, 2)
+
+PENDIENTE = 'pendiente'
+PROCESANDO = 'procesando'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+# Nombres de columna aceptados (sin tildes, en minúsculas y con _ en vez de espacios)
+COLUMNAS = {
+    'codigo_barras': ('codigo_barras', 'codigo_de_barras', 'codigo', 'ean', 'sku'),
+    'nombre': ('nombre', 'producto'),
+    'descripcion': ('descripcion',),
+    'categoria': ('categoria',),
+    'precio_venta': ('precio_venta', 'precio'),
+    'precio_compra': ('precio_compra', 'costo'),
+    'stock': ('stock', 'existencias', 'cantidad'),
+    'stock_minimo': ('stock_minimo',)
+}
+OBLIGATORIAS_NUEVO = ('nombre', 'precio_venta', 'precio_compra')
+ACTUALIZABLES = ('nombre', 'descripcion', 'categoria_id', 'precio_venta', 'precio_compra', 'stock', 'stock_minimo')
+
+_XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELACIONES = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_RELACIONES_PAQUETE = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def init_app(app):
+    """Registra el estado de las importaciones y el comando de consola"""
+    app.extensions['importar_productos'] = {
+        'lock': threading.Lock(),
+        'trabajos': OrderedDict()
+    }
+    app.cli.add_command(comando_importar_productos)
+
+
+def _estado():
+    return current_app.extensions['importar_productos']
+
+
+def formato_de_archivo(nombre):
+    """Formato según la extensión del archivo ('csv' o 'xlsx'), o None"""
+    extension = os.path.splitext(nombre or '')[1].lower().lstrip('.')
+    return extension if extension in FORMATOS else None
+
+
+# ========== LECTURA DEL ARCHIVO ==========
+
+def _codificacion(archivo):
+    """UTF-8 si el inicio del archivo lo es; si no, cp1252 (CSV guardado por Excel en español)"""
+    muestra = archivo.read(64 * 1024)
+    archivo.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(muestra)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+
+def _filas_csv(archivo):
+    """Genera (número de línea, valores); detecta el separador (; , o tabulador) en el encabezado"""
+    texto = io.TextIOWrapper(archivo, encoding=_codificacion(archivo), newline='')
+    encabezado = texto.readline()
+    separador = max((';', ',', '\t'), key=encabezado.count)
+    lector = csv.reader(itertools.chain([encabezado], texto), delimiter=separador)
+    for valores in lector:
+        yield lector.line_num, valores
+
+
+def _hoja_principal(libro):
+    """Ruta dentro del ZIP de la primera hoja del libro"""
+    try:
+        hoja = ElementTree.fromstring(libro.read('xl/workbook.xml')).find(f'{_XLSX}sheets/{_XLSX}sheet')
+        relaciones = ElementTree.fromstring(libro.read('xl/_rels/workbook.xml.rels'))
+        for relacion in relaciones.iter(f'{_RELACIONES_PAQUETE}Relationship'):
+            if relacion.get('Id') == hoja.get(f'{_RELACIONES}id'):
+                destino = relacion.get('Target')
+                return destino.lstrip('/') if destino.startswith('/') else f'xl/{destino}'
+    except (KeyError, AttributeError, ElementTree.ParseError):
+        pass
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _cadenas_compartidas(libro):
+    try:
+        contenido = libro.open('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    cadenas = []
+    with contenido:
+        for _, elemento in ElementTree.iterparse(contenido):
+            if elemento.tag == f'{_XLSX}si':
+                cadenas.append(''.join(t.text or '' for t in elemento.iter(f'{_XLSX}t')))
+                elemento.clear()
+    return cadenas
+
+
+def _indice_columna(referencia):
+    """'C12' -> 2"""
+    indice = 0
+    for letra in re.match(r'[A-Z]*', referencia).group():
+        indice = indice * 26 + ord(letra) - ord('A') + 1
+    return indice - 1
+
+
+def _valor_celda(celda, compartidas):
+    tipo = celda.get('t')
+    if tipo == 'inlineStr':
+        return ''.join(t.text or '' for t in celda.iter(f'{_XLSX}t'))
+    valor = celda.findtext(f'{_XLSX}v')
+    if valor is None or tipo == 'e':
+        return None
+    if tipo == 's':
+        return compartidas[int(valor)]
+    if tipo in ('str', 'b'):
+        return valor
+    try:
+        return Decimal(valor)
+    except InvalidOperation:
+        return valor
+
+
+def _filas_xlsx(archivo):
+    """Genera (número de fila, valores) de la primera hoja sin cargarla completa"""
+    with zipfile.ZipFile(archivo) as libro:
+        compartidas = _cadenas_compartidas(libro)
+        with libro.open(_hoja_principal(libro)) as hoja:
+            for _, elemento in ElementTree.iterparse(hoja):
+                if elemento.tag != f'{_XLSX}row':
+                    continue
+                valores = {}
+                for posicion, celda in enumerate(elemento.iter(f'{_XLSX}c')):
+                    referencia = celda.get('r')
+                    valores[_indice_columna(referencia) if referencia else posicion] = _valor_celda(celda, compartidas)
+                numero = int(elemento.get('r') or 0)
+                elemento.clear()
+                yield numero, [valores.get(indice) for indice in range(max(valores, default=-1) + 1)]
+
+
+def _normalizar(nombre):
+    texto = unicodedata.normalize('NFKD', str(nombre or '')).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+
+
+def _mapear_columnas(encabezado):
+    """Retorna ({índice: campo}, columnas ignoradas)"""
+    alias = {nombre: campo for campo, nombres in COLUMNAS.items() for nombre in nombres}
+    columnas, ignoradas = {}, []
+    for indice, titulo in enumerate(encabezado):
+        campo = alias.get(_normalizar(titulo))
+        if campo and campo not in columnas.values():
+            columnas[indice] = campo
+        elif titulo not in (None, ''):
+            ignoradas.append(str(titulo))
+    return columnas, ignoradas
+
+
+# ========== VALIDACIÓN DE FILAS ==========
+
+def _texto(valor):
+    if isinstance(valor, Decimal):
+        # Celdas numéricas de Excel (p. ej. códigos de barras): sin ".0" ni notación científica
+        return str(int(valor)) if valor == valor.to_integral_value() else str(valor)
+    return str(valor).strip()
+
+
+def _decimal(valor):
+    """
+    Convierte un precio; acepta '1500', '1.500', '1.500,50', '1,500.50' y '$ 1.500'.
+    Un solo separador seguido de exactamente tres dígitos se toma como separador de miles.
+    """
+    if isinstance(valor, Decimal):
+        return valor
+    texto = re.sub(r'[^\d,.\-]', '', str(valor))
+    if ',' in texto and '.' in texto:
+        miles, decimal = ('.', ',') if texto.rfind(',') > texto.rfind('.') else (',', '.')
+        texto = texto.replace(miles, '').replace(decimal, '.')
+    elif ',' in texto or '.' in texto:
+        separador = ',' if ',' in texto else '.'
+        partes = texto.split(separador)
+        if len(partes) > 2 or len(partes[-1]) == 3:
+            texto = texto.replace(separador, '')
+        else:
+            texto = texto.replace(separador, '.')
+    return Decimal(texto)
+
+
+def _leer_fila(valores, columnas):
+    """Dict con los campos de la fila (None en las celdas vacías); ValueError si algún valor no es válido"""
+    datos = dict.fromkeys(COLUMNAS)
+    for indice, campo in columnas.items():
+        valor = valores[indice] if indice < len(valores) else None
+        if valor is None or _texto(valor) == '':
+            continue
+        try:
+            if campo in ('precio_venta', 'precio_compra'):
+                precio = _decimal(valor).quantize(Decimal('0.01'))
+                if precio < 0 or precio > PRECIO_MAXIMO:
+                    raise ValueError
+                datos[campo] = precio
+            elif campo in ('stock', 'stock_minimo'):
+                numero = _decimal(valor)
+                if numero < 0 or numero != numero.to_integral_value():
+                    raise ValueError
+                datos[campo] = int(numero)
+            else:
+                datos[campo] = _texto(valor)
+        except (ValueError, InvalidOperation):
+            raise ValueError(f'Valor no válido en {campo}: {_texto(valor)}')
+
+    if not datos['codigo_barras']:
+        raise ValueError('Falta el código de barras')
+    if len(datos['codigo_barras']) > 50:
+        raise ValueError('El código de barras supera 50 caracteres')
+    if datos['nombre'] and len(datos['nombre']) > 200:
+        raise ValueError('El nombre supera 200 caracteres')
+    if datos['categoria'] and len(datos['categoria']) > 100:
+        raise ValueError('La categoría supera 100 caracteres')
+    return datos
+
+
+def _error(resultado, fila, codigo, mensaje):
+    resultado['total_errores'] += 1
+    if len(resultado['errores']) < MAX_ERRORES:
+        resultado['errores'].append({'fila': fila, 'codigo_barras': codigo, 'error': mensaje})
+
+
+# ========== IMPORTACIÓN POR LOTES ==========
+
+def _crear_categorias(nombres, categorias, resultado):
+    """Crea (un INSERT) las categorías del lote que no existen y las agrega a `categorias`"""
+    nuevas = {}
+    for nombre in nombres:
+        if nombre.casefold() not in categorias:
+            nuevas.setdefault(nombre.casefold(), nombre)
+    if not nuevas:
+        return
+    db.session.execute(insert(Categoria), [{'nombre': nombre} for nombre in nuevas.values()])
+    for categoria_id, nombre in db.session.execute(
+            select(Categoria.id, Categoria.nombre).where(Categoria.nombre.in_(nuevas.values()))):
+        categorias[nombre.casefold()] = categoria_id
+    resultado['categorias_creadas'] += len(nuevas)
+
+
+def _importar_lote(lote, categorias, usuario_id, resultado):
+    tabla = Producto.__table__
+    existentes = {
+        fila.codigo_barras: fila for fila in db.session.execute(
+            select(tabla.c.id, tabla.c.codigo_barras, tabla.c.stock)
+            .where(tabla.c.codigo_barras.in_([datos['codigo_barras'] for _, datos in lote])))
+    }
+    _crear_categorias({datos['categoria'] for _, datos in lote if datos['categoria']}, categorias, resultado)
+
+    nuevos, cambios, ajustes = [], [], []
+    for fila, datos in lote:
+        categoria_id = categorias.get(datos['categoria'].casefold()) if datos['categoria'] else None
+        actual = existentes.get(datos['codigo_barras'])
+        if actual is None:
+            faltan = [campo for campo in OBLIGATORIAS_NUEVO if datos[campo] is None]
+            if faltan:
+                _error(resultado, fila, datos['codigo_barras'], f'Producto nuevo sin {", ".join(faltan)}')
+                continue
+            nuevos.append({
+                'codigo_barras': datos['codigo_barras'],
+                'nombre': datos['nombre'],
+                'descripcion': datos['descripcion'] or '',
+                'precio_venta': datos['precio_venta'],
+                'precio_compra': datos['precio_compra'],
+                'stock': datos['stock'] or 0,
+                'stock_minimo': datos['stock_minimo'] or 0,
+                'categoria_id': categoria_id
+            })
+        else:
+            valores = dict(datos, categoria_id=categoria_id)
+            cambios.append({'b_id': actual.id, **{f'v_{campo}': valores[campo] for campo in ACTUALIZABLES}})
+            if datos['stock'] is not None and datos['stock'] != actual.stock:
+                ajustes.append((actual.id, datos['stock'] - actual.stock))
+
+    producto_ids = [cambio['b_id'] for cambio in cambios]
+    if nuevos:
+        db.session.execute(insert(tabla), nuevos)
+        creados = db.session.execute(
+            select(tabla.c.id, tabla.c.stock).where(tabla.c.codigo_barras.in_([n['codigo_barras'] for n in nuevos]))
+        ).all()
+        producto_ids += [fila.id for fila in creados]
+        kardex.registrar_movimientos(kardex.INICIAL, [(fila.id, fila.stock) for fila in creados],
+                                     usuario_id=usuario_id)
+    if cambios:
+        # Celdas vacías (None) conservan el valor actual
+        db.session.execute(
+            update(tabla).where(tabla.c.id == bindparam('b_id')).values(
+                activo=True,
+                **{campo: func.coalesce(bindparam(f'v_{campo}', type_=tabla.c[campo].type), tabla.c[campo])
+                   for campo in ACTUALIZABLES}
+            ),
+            cambios
+        )
+        kardex.registrar_movimientos(kardex.AJUSTE, ajustes, usuario_id=usuario_id)
+
+    alertas_stock.actualizar_productos(producto_ids)
+    db.session.commit()
+    resultado['creados'] += len(nuevos)
+    resultado['actualizados'] += len(cambios)
+
+
+def _procesar_lote(lote, categorias, usuario_id, resultado):
+    try:
+        _importar_lote(lote, categorias, usuario_id, resultado)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"Error al importar lote de productos: {e}")
+        for fila, datos in lote:
+            _error(resultado, fila, datos['codigo_barras'], f'No se importó el lote: {e.__class__.__name__}')
+        # Las categorías creadas en el lote se deshicieron
+        categorias.clear()
+        categorias.update({nombre.casefold(): categoria_id
+                           for categoria_id, nombre in db.session.query(Categoria.id, Categoria.nombre)})
+
+
+def importar(archivo, formato, usuario_id=None, progreso=None):
+    """
+    Importa el catálogo desde `archivo` (binario, CSV o XLSX) con la primera
+    fila como encabezado. `progreso` recibe el resultado parcial después de
+    cada lote. Retorna el resultado: filas procesadas, productos creados y
+    actualizados, categorías creadas y errores por fila.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato no válido: {formato}')
+    filas = _filas_csv(archivo) if formato == 'csv' else _filas_xlsx(archivo)
+    _, encabezado = next(filas, (None, None))
+    if not encabezado:
+        raise ValueError('El archivo está vacío')
+    columnas, ignoradas = _mapear_columnas(encabezado)
+    if 'codigo_barras' not in columnas.values():
+        raise ValueError('Falta la columna codigo_barras')
+
+    resultado = {
+        'procesadas': 0,
+        'creados': 0,
+        'actualizados': 0,
+        'categorias_creadas': 0,
+        'columnas_ignoradas': ignoradas,
+        'errores': [],
+        'total_errores': 0
+    }
+    categorias = {nombre.casefold(): categoria_id
+                  for categoria_id, nombre in db.session.query(Categoria.id, Categoria.nombre)}
+    vistos = {}  # código de barras -> fila (repetidos en el archivo)
+    lote = []
+    try:
+        for fila, valores in filas:
+            if all(valor is None or _texto(valor) == '' for valor in valores):
+                continue
+            resultado['procesadas'] += 1
+            try:
+                datos = _leer_fila(valores, columnas)
+            except ValueError as e:
+                codigo = next((_texto(valores[indice]) for indice, campo in columnas.items()
+                               if campo == 'codigo_barras' and indice < len(valores) and valores[indice] is not None), None)
+                _error(resultado, fila, codigo or None, str(e))
+                continue
+            if datos['codigo_barras'] in vistos:
+                _error(resultado, fila, datos['codigo_barras'],
+                       f'Código repetido en el archivo (fila {vistos[datos["codigo_barras"]]})')
+                continue
+            vistos[datos['codigo_barras']] = fila
+
+            lote.append((fila, datos))
+            if len(lote) >= TAMANO_LOTE:
+                _procesar_lote(lote, categorias, usuario_id, resultado)
+                lote = []
+                if progreso:
+                    progreso(resultado)
+        if lote:
+            _procesar_lote(lote, categorias, usuario_id, resultado)
+    finally:
+        # Escrituras fuera del ORM: recargar índice de códigos y estadísticas
+        indice_productos.invalidar_todo()
+        cache_estadisticas.invalidar()
+    resultado['errores'].sort(key=lambda error: error['fila'])
+    if progreso:
+        progreso(resultado)
+    return resultado
+
+
+# ========== IMPORTACIONES EN SEGUNDO PLANO ==========
+
+def iniciar_importacion(archivo, nombre_archivo, usuario_id=None):
+    """
+    Guarda el archivo subido y lo importa en un hilo. Retorna el dict del
+    trabajo; el avance se consulta con obtener_importacion().
+    """
+    formato = formato_de_archivo(nombre_archivo)
+    if not formato:
+        raise ValueError('El archivo debe ser .csv o .xlsx')
+
+    directorio = current_app.config['IMPORTACIONES_DIR']
+    os.makedirs(directorio, exist_ok=True)
+    trabajo_id = uuid.uuid4().hex
+    trabajo = {
+        'id': trabajo_id,
+        'estado': PENDIENTE,
+        'formato': formato,
+        'nombre_archivo': nombre_archivo,
+        'ruta': os.path.join(directorio, f'importacion_{trabajo_id}.{formato}'),
+        'resultado': None,
+        'error': None,
+        'fecha_creacion': datetime.utcnow().isoformat()
+    }
+    archivo.save(trabajo['ruta'])
+
+    estado = _estado()
+    with estado['lock']:
+        estado['trabajos'][trabajo_id] = trabajo
+        _recortar_historial(estado)
+
+    app = current_app._get_current_object()
+    hilo = threading.Thread(target=_ejecutar, args=(app, trabajo_id, usuario_id), name='importar-productos', daemon=True)
+    hilo.start()
+    return dict(trabajo)
+
+
+def obtener_importacion(trabajo_id):
+    """Estado de una importación o None si no existe"""
+    estado = _estado()
+    with estado['lock']:
+        trabajo = estado['trabajos'].get(trabajo_id)
+        return dict(trabajo) if trabajo else None
+
+
+def _actualizar(trabajo_id, **campos):
+    estado = _estado()
+    with estado['lock']:
+        if trabajo_id in estado['trabajos']:
+            estado['trabajos'][trabajo_id].update(campos)
+
+
+def _recortar_historial(estado):
+    terminados = [t for t in estado['trabajos'].values() if t['estado'] in (COMPLETADO, ERROR)]
+    for trabajo in terminados[:max(0, len(terminados) - MAX_TRABAJOS_HISTORIAL)]:
+        del estado['trabajos'][trabajo['id']]
+
+
+def _ejecutar(app, trabajo_id, usuario_id):
+    with app.app_context():
+        trabajo = obtener_importacion(trabajo_id)
+        _actualizar(trabajo_id, estado=PROCESANDO)
+        try:
+            with open(trabajo['ruta'], 'rb') as archivo:
+                resultado = importar(archivo, trabajo['formato'], usuario_id,
+                                     progreso=lambda parcial: _actualizar(trabajo_id, resultado=_copiar(parcial)))
+            _actualizar(trabajo_id, estado=COMPLETADO, resultado=resultado)
+        except Exception as e:
+            print(f"Error al importar productos: {traceback.format_exc()}")
+            _actualizar(trabajo_id, estado=ERROR, error=str(e))
+        finally:
+            db.session.remove()
+            try:
+                os.remove(trabajo['ruta'])
+            except OSError:
+                pass
+
+
+def _copiar(resultado):
+    return dict(resultado, errores=list(resultado['errores']))
+
+
+# ========== COMANDO DE CONSOLA ==========
+
+@click.command('importar-productos')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--formato', type=click.Choice(FORMATOS), help='Por defecto, según la extensión del archivo')
+def comando_importar_productos(archivo, formato):
+    """Crea o actualiza productos (por código de barras) desde un CSV o XLSX"""
+    formato = formato or formato_de_archivo(archivo)
+    if not formato:
+        raise click.UsageError('No se reconoce el formato; usa --formato csv o --formato xlsx')
+
+    def progreso(resultado):
+        click.echo(f"  {resultado['procesadas']} filas: {resultado['creados']} creados, "
+                   f"{resultado['actualizados']} actualizados, {resultado['total_errores']} errores")
+
+    click.echo(f'Importando {archivo}...')
+    with open(archivo, 'rb') as entrada:
+        try:
+            resultado = importar(entrada, formato, progreso=progreso)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    for error in resultado['errores']:
+        click.echo(f"  Fila {error['fila']}: {error['error']}", err=True)
+    if resultado['total_errores'] > len(resultado['errores']):
+        click.echo(f"  ... y {resultado['total_errores'] - len(resultado['errores'])} errores más", err=True)
+    if resultado['columnas_ignoradas']:
+        click.echo(f"  Columnas ignoradas: {', '.join(resultado['columnas_ignoradas'])}")
+    click.echo(f"✓ {resultado['creados']} productos creados, {resultado['actualizados']} actualizados, "
+               f"{resultado['categorias_creadas']} categorías nuevas")
@@ -0,0 +1,630 @@
+"""
+Cola de impresión de tickets para la impresora térmica USB.
+
+Un único hilo de trabajo es dueño de la impresora: mantiene la conexión
+abierta entre tickets, atiende los trabajos en orden de llegada y reconecta
+solo si la impresora deja de responder. La petición HTTP solo arma los datos
+del ticket, encola el trabajo y responde de inmediato con su id; el estado se
+consulta con obtener_trabajo().
+
+El dispositivo USB que funcionó (IDs y endpoints) se guarda en un archivo de
+caché (IMPRESORA_CACHE) y se abre directamente en las siguientes conexiones;
+la detección completa solo corre si ese dispositivo falla o desde el botón
+de redetección en la configuración del negocio.
+"""
+from flask import current_app
+from collections import OrderedDict
+from datetime import datetime
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+# Imports opcionales para impresora térmica
+try:
+    import usb.core
+    import usb.util
+    USB_AVAILABLE = True
+except ImportError:
+    USB_AVAILABLE = False
+
+MAX_TRABAJOS_HISTORIAL = 200  # trabajos terminados que se conservan para consultar su estado
+
+ANCHO_LOGO = 384  # píxeles de ancho máximo del logo en el ticket
+UMBRAL_LOGO = 128  # gris por debajo del cual un píxel se imprime negro
+
+# Logos ya convertidos a ESC/POS: ruta del PNG -> (fecha de modificación, bytes)
+_LOGOS = {}
+
+PENDIENTE = 'pendiente'
+IMPRIMIENDO = 'imprimiendo'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+# Tipos de trabajo
+TICKET = 'ticket'
+REDETECTAR = 'redetectar'
+
+
+def init_app(app):
+    """Registra la cola de impresión (el hilo se inicia con el primer trabajo)"""
+    app.extensions['impresion_tickets'] = ColaImpresion(app.config['IMPRESORA_CACHE'])
+
+
+def _cola():
+    return current_app.extensions['impresion_tickets']
+
+
+def encolar_ticket(venta, config):
+    """
+    Arma los datos del ticket de una venta y lo agrega a la cola.
+    Retorna el dict del trabajo (con su id) sin esperar a la impresora.
+    """
+    return _cola().encolar(TICKET, datos_ticket(venta, config))
+
+
+def obtener_trabajo(trabajo_id):
+    """Estado de un trabajo de impresión o None si no existe"""
+    return _cola().obtener(trabajo_id)
+
+
+def redetectar_impresora():
+    """
+    Descarta la impresora guardada en caché y encola una nueva búsqueda.
+    La hace el hilo de impresión (después de los tickets pendientes); se
+    retorna el trabajo sin esperar, su estado se consulta con obtener_trabajo.
+    """
+    return _cola().encolar(REDETECTAR, None)
+
+
+def impresora_en_cache():
+    """Dispositivo USB guardado (id_vendor, id_product, in_ep, out_ep) o None"""
+    return _leer_cache(_cola().ruta_cache)
+
+
+def datos_ticket(venta, config):
+    """
+    Copia en un dict todo lo que se imprime, para que el hilo de impresión
+    no necesite la sesión de base de datos de la petición.
+    """
+    logo_path = None
+    if config and config.logo_path:
+        logo_path = os.path.join(current_app.root_path, 'static', config.logo_path)
+
+    return {
+        'venta_id': venta.id,
+        'numero_venta': venta.numero_venta,
+        'fecha_venta': venta.fecha_venta.strftime('%d/%m/%Y %H:%M'),
+        'vendedor': venta.usuario.username if venta.usuario else 'N/A',
+        'metodo_pago': venta.metodo_pago.upper(),
+        'total': float(venta.total),
+        'items': [{
+            'nombre': item.producto.nombre,
+            'cantidad': item.cantidad,
+            'precio_unitario': float(item.precio_unitario),
+            'subtotal': float(item.subtotal)
+        } for item in venta.items],
+        'nombre_negocio': config.nombre_negocio.upper() if config and config.nombre_negocio else "VETERINARIA",
+        'nit': config.nit if config else None,
+        'direccion': config.direccion if config else None,
+        'telefono': config.telefono if config else None,
+        'correo': config.correo if config else None,
+        'logo_path': logo_path
+    }
+
+
+class ImpresoraSinRespuestaError(Exception):
+    """La impresora no aceptó el primer comando: no se envió nada del ticket"""
+
+
+class ColaImpresion:
+    """Cola FIFO de tickets atendida por un hilo que conserva la conexión USB"""
+
+    def __init__(self, ruta_cache):
+        self.cola = queue.Queue()
+        self.trabajos = OrderedDict()
+        self.lock = threading.Lock()
+        self.hilo = None
+        self.printer = None
+        self.dispositivo = None
+        self.ruta_cache = ruta_cache
+
+    def encolar(self, tipo, datos):
+        trabajo = {
+            'id': uuid.uuid4().hex,
+            'tipo': tipo,
+            'venta_id': datos['venta_id'] if tipo == TICKET else None,
+            'estado': PENDIENTE,
+            'error': None,
+            'dispositivo': None,
+            'fecha_creacion': datetime.utcnow().isoformat(),
+            'fecha_fin': None
+        }
+        with self.lock:
+            self.trabajos[trabajo['id']] = trabajo
+            self._recortar_historial()
+            self._iniciar_hilo()
+            posicion = self.cola.qsize()
+        self.cola.put((trabajo['id'], tipo, datos))
+        return dict(trabajo, posicion=posicion)
+
+    def obtener(self, trabajo_id):
+        with self.lock:
+            trabajo = self.trabajos.get(trabajo_id)
+            return dict(trabajo) if trabajo else None
+
+    def _actualizar(self, trabajo_id, **campos):
+        with self.lock:
+            if trabajo_id in self.trabajos:
+                self.trabajos[trabajo_id].update(campos)
+
+    def _recortar_historial(self):
+        terminados = [t['id'] for t in self.trabajos.values() if t['estado'] in (COMPLETADO, ERROR)]
+        for trabajo_id in terminados[:max(0, len(terminados) - MAX_TRABAJOS_HISTORIAL)]:
+            del self.trabajos[trabajo_id]
+
+    def _iniciar_hilo(self):
+        if self.hilo is None or not self.hilo.is_alive():
+            self.hilo = threading.Thread(target=self._procesar, name='impresion-tickets', daemon=True)
+            self.hilo.start()
+
+    def _procesar(self):
+        while True:
+            trabajo_id, tipo, datos = self.cola.get()
+            self._actualizar(trabajo_id, estado=IMPRIMIENDO)
+            try:
+                if tipo == REDETECTAR:
+                    self._cerrar()
+                    self._conexion(redetectar=True)
+                else:
+                    self._imprimir_con_reintento(datos)
+                self._actualizar(trabajo_id, estado=COMPLETADO, dispositivo=self.dispositivo,
+                                 fecha_fin=datetime.utcnow().isoformat())
+            except Exception as e:
+                print(f"Error completo al imprimir ticket: {traceback.format_exc()}")
+                self._actualizar(trabajo_id, estado=ERROR, error=_mensaje_error(e),
+                                 fecha_fin=datetime.utcnow().isoformat())
+            finally:
+                self.cola.task_done()
+
+    def _conexion(self, redetectar=False):
+        """
+        Retorna la conexión abierta. Si no hay, abre directamente el dispositivo
+        guardado en caché; la detección completa solo corre si ese falla o si
+        se pide redetectar.
+        """
+        if self.printer is not None and getattr(self.printer, 'device', None):
+            return self.printer
+        self._cerrar()
+
+        if not redetectar:
+            dispositivo = _leer_cache(self.ruta_cache)
+            if dispositivo:
+                self.printer = abrir_impresora(**dispositivo)
+                if self.printer:
+                    self.dispositivo = dispositivo
+                    return self.printer
+                print(f"La impresora guardada en caché no respondió, buscando de nuevo: {dispositivo}")
+
+        _borrar_cache(self.ruta_cache)
+        self.printer, dispositivo = buscar_impresora_usb()
+        if not self.printer:
+            raise Exception('No se pudo detectar la impresora. Verifica que esté conectada por USB y que tengas los permisos necesarios.')
+        self.dispositivo = dispositivo
+        _escribir_cache(self.ruta_cache, dispositivo)
+        return self.printer
+
+    def _cerrar(self):
+        if self.printer is not None:
+            try:
+                self.printer.close()
+            except:
+                pass
+        self.printer = None
+        self.dispositivo = None
+
+    def _imprimir_con_reintento(self, ticket):
+        """
+        Si la conexión guardada quedó inválida (impresora reiniciada o
+        desconectada) antes de enviar el ticket, reconecta una vez: primero al
+        dispositivo en caché y solo si ese falla con una detección completa.
+        Un fallo después de empezar a enviar no se reintenta (imprimiría el
+        ticket y abriría el cajón dos veces): el trabajo queda con error.
+        """
+        try:
+            imprimir_ticket(self._conexion(), ticket)
+        except ImpresoraSinRespuestaError as e:
+            print(f"Reintentando impresión con una conexión nueva: {e}")
+            self._cerrar()
+            try:
+                imprimir_ticket(self._conexion(), ticket)
+            except Exception:
+                self._cerrar()
+                raise
+        except Exception:
+            # Envío interrumpido: la siguiente impresión abre una conexión nueva
+            self._cerrar()
+            raise
+
+
+def _mensaje_error(e):
+    error_msg = str(e)
+    # Mensaje más amigable para errores comunes
+    if 'not found' in error_msg.lower() or 'device not found' in error_msg.lower():
+        error_msg = 'Impresora no encontrada. Verifica que esté conectada y encendida. En Linux, puede necesitar permisos USB (ver INSTRUCCIONES_IMPRESORA.md)'
+    elif 'permission' in error_msg.lower() or 'access denied' in error_msg.lower():
+        error_msg = 'Sin permisos para acceder a la impresora. En Linux, configura reglas udev o ejecuta con sudo (ver INSTRUCCIONES_IMPRESORA.md)'
+    return f'Error al imprimir: {error_msg}'
+
+
+def abrir_impresora(id_vendor, id_product, in_ep=None, out_ep=None):
+    """
+    Abre la impresora USB con los IDs (y endpoints, si se indican) dados.
+    Retorna el objeto de la impresora solo si el dispositivo respondió, o None.
+    """
+    from escpos.printer import Usb
+
+    try:
+        if in_ep is None or out_ep is None:
+            printer = Usb(id_vendor, id_product, timeout=0)
+        else:
+            printer = Usb(id_vendor, id_product, timeout=0, in_ep=in_ep, out_ep=out_ep)
+        # python-escpos abre el dispositivo al acceder a .device
+        if printer.device:
+            return printer
+    except Exception:
+        pass
+    return None
+
+
+def buscar_impresora_usb():
+    """
+    Detección completa de la impresora térmica (Xprinter XP-58IIT u otra ESC/POS).
+    Retorna (printer, dispositivo) donde dispositivo es el dict
+    {id_vendor, id_product, in_ep, out_ep} que funcionó, o (None, None).
+    """
+    if not USB_AVAILABLE:
+        return None, None
+
+    try:
+        from escpos.printer import Usb
+
+        # IDs comunes de impresoras Xprinter (pueden variar)
+        # Xprinter XP-58IIT comúnmente usa estos IDs
+        # Puedes agregar más IDs si conoces el de tu impresora específica
+        impresoras_xprinter = [
+            (0x0483, 0x070b),  # Xprinter XP-58IIT detectada (1155, 1803 en decimal)
+            (1155, 1803),       # Xprinter XP-58IIT (IDs en decimal)
+            (0x0483, 0x5743),  # Otra variante Xprinter común
+            (0x04e8, 0x0202),  # Samsung (algunas Xprinter usan este)
+            (0x04b8, 0x0202),  # Epson (compatible ESC/POS)
+            (0x0483, 0x5840),  # Otra variante Xprinter
+        ]
+
+        # Combinaciones de endpoints a probar si la auto-detección falla
+        endpoints_configs = [
+            (None, None),  # Auto-detección (endpoints por defecto)
+            (0x81, 0x03),  # Endpoints comunes
+            (0x82, 0x01),  # Alternativa 1
+            (0x83, 0x02),  # Alternativa 2
+            (0x81, 0x01),  # Alternativa 3
+            (0x82, 0x03),  # Alternativa 4
+        ]
+
+        # Intentar encontrar la impresora con IDs conocidos
+        for vendor_id, product_id in impresoras_xprinter:
+            for in_ep, out_ep in endpoints_configs:
+                printer = abrir_impresora(vendor_id, product_id, in_ep, out_ep)
+                if printer:
+                    return printer, _dispositivo(vendor_id, product_id, in_ep, out_ep)
+
+        # Si no se encuentra con IDs conocidos, intentar buscar todas las impresoras USB
+        # que sean compatibles con ESC/POS
+        try:
+            devices = usb.core.find(find_all=True)
+            for device in devices:
+                for in_ep, out_ep in endpoints_configs[:2]:
+                    printer = abrir_impresora(device.idVendor, device.idProduct, in_ep, out_ep)
+                    if printer:
+                        return printer, _dispositivo(device.idVendor, device.idProduct, in_ep, out_ep)
+        except Exception:
+            pass
+
+        return None, None
+    except ImportError as e:
+        print(f"Error: python-escpos no está instalado: {str(e)}")
+        return None, None
+    except Exception as e:
+        print(f"Error al detectar impresora: {str(e)}")
+        return None, None
+
+
+def detectar_impresora_usb():
+    """
+    Detecta la impresora térmica Xprinter XP-58IIT conectada por USB.
+    Retorna el objeto de la impresora o None si no se encuentra.
+    """
+    printer, _ = buscar_impresora_usb()
+    return printer
+
+
+def _dispositivo(id_vendor, id_product, in_ep, out_ep):
+    return {'id_vendor': id_vendor, 'id_product': id_product, 'in_ep': in_ep, 'out_ep': out_ep}
+
+
+def _leer_cache(ruta):
+    """Dispositivo guardado en el archivo de caché o None"""
+    try:
+        with open(ruta) as f:
+            dispositivo = json.load(f)
+        if dispositivo.get('id_vendor') is not None and dispositivo.get('id_product') is not None:
+            return dispositivo
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _escribir_cache(ruta, dispositivo):
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f'{ruta}.tmp'
+        with open(temporal, 'w') as f:
+            json.dump(dispositivo, f)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        print(f"No se pudo guardar la caché de la impresora: {e}")
+
+
+def _borrar_cache(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+def ruta_logo_escpos(logo_path):
+    """Archivo donde se guarda el logo ya convertido a bytes ESC/POS"""
+    return os.path.splitext(logo_path)[0] + '.escpos'
+
+
+def rasterizar_logo(logo_path):
+    """
+    Convierte el logo PNG a imagen raster ESC/POS (blanco y negro, máximo
+    ANCHO_LOGO px) y guarda los bytes junto al PNG. Se llama al cargar el logo.
+    """
+    from PIL import Image as PILImage
+    from escpos.printer import Dummy
+
+    img = PILImage.open(logo_path)
+    # Las zonas transparentes se imprimen como papel en blanco
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        fondo = PILImage.new('RGBA', img.size, (255, 255, 255, 255))
+        img = PILImage.alpha_composite(fondo, img)
+    img = img.convert('L')  # Escala de grises
+
+    # Redimensionar manteniendo proporción antes del umbral (mejor calidad)
+    if img.width > ANCHO_LOGO:
+        new_height = int(img.height * ANCHO_LOGO / img.width)
+        img = img.resize((ANCHO_LOGO, new_height), PILImage.Resampling.LANCZOS)
+
+    # Convertir a bitmap (umbral)
+    img = img.point([0 if x < UMBRAL_LOGO else 255 for x in range(256)], '1')
+
+    buffer = Dummy()
+    buffer.image(img)
+    datos = buffer.output
+
+    ruta = ruta_logo_escpos(logo_path)
+    temporal = f'{ruta}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+    return datos
+
+
+def logo_escpos(logo_path):
+    """
+    Bytes ESC/POS del logo, leídos una sola vez por archivo. Si el logo se cargó
+    antes de existir la conversión previa, se convierte aquí la primera vez.
+    """
+    if not logo_path or not os.path.exists(logo_path):
+        return None
+
+    ruta = ruta_logo_escpos(logo_path)
+    try:
+        modificado = os.path.getmtime(logo_path)
+        guardado = _LOGOS.get(logo_path)
+        if guardado and guardado[0] == modificado:
+            return guardado[1]
+
+        if os.path.exists(ruta) and os.path.getmtime(ruta) >= modificado:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+        else:
+            datos = rasterizar_logo(logo_path)
+        _LOGOS[logo_path] = (modificado, datos)
+        return datos
+    except ImportError:
+        print("PIL/Pillow no disponible para imprimir logo")
+    except Exception as e:
+        print(f"Error al preparar el logo: {str(e)}")
+        # Continuar sin logo si hay error
+    return None
+
+
+def imprimir_ticket(printer, ticket):
+    """
+    Abre el cajón e imprime el ticket en una conexión ya abierta (no la cierra).
+    Lanza ImpresoraSinRespuestaError si falla antes de enviar algo del ticket.
+    """
+    contenido = renderizar_ticket(ticket)
+
+    # IMPORTANTE: Abrir cajón ANTES de imprimir (como en Eleventa punto de ventas)
+    # Según el manual ESC/POS (serie 80XX):
+    # Comando: ESC p m t1 t2
+    # - m = 0 (pin 2 del conector de expulsión del cajón)
+    # - t1 = tiempo ON en unidades de 2ms (t1 × 2ms = tiempo ON)
+    # - t2 = tiempo OFF en unidades de 2ms (t2 × 2ms = tiempo OFF)
+    #
+    # Comando recomendado según manual: ESC p 0 50 50
+    # - t1 = 50 → 50 × 2ms = 100ms ON
+    # - t2 = 50 → 50 × 2ms = 100ms OFF
+    # Secuencia: \x1B\x70\x00\x32\x32
+
+    # Inicializar impresora primero (importante para algunos modelos). Es la
+    # primera escritura: si falla, la conexión no sirve y no salió nada del
+    # ticket, así que se puede reintentar con otra conexión
+    try:
+        printer._raw(b'\x1B\x40')  # ESC @ - Inicializar impresora
+    except Exception as e:
+        raise ImpresoraSinRespuestaError(str(e)) from e
+    time.sleep(0.1)
+
+    # COMANDO PRINCIPAL según el manual (100ms ON, 100ms OFF)
+    comando_principal = b'\x1B\x70\x00\x32\x32'  # ESC p 0 50 50
+
+    # COMANDO ALTERNATIVO (32ms ON, 32ms OFF) - para cajones más sensibles
+    comando_alternativo = b'\x1B\x70\x00\x10\x10'  # ESC p 0 16 16
+
+    # Enviar el comando principal primero (el más común según el manual)
+    try:
+        printer._raw(comando_principal)
+        time.sleep(0.2)  # Pausa para dar tiempo al cajón
+    except Exception as e:
+        print(f"Error al enviar comando principal del cajón: {e}")
+
+    # Si el principal no funciona, probar el alternativo
+    try:
+        printer._raw(comando_alternativo)
+        time.sleep(0.2)
+    except Exception as e:
+        print(f"Error al enviar comando alternativo del cajón: {e}")
+
+    # También probar con pin 1 (por si acaso)
+    try:
+        printer._raw(b'\x1B\x70\x01\x32\x32')  # ESC p 1 50 50
+        time.sleep(0.2)
+    except:
+        pass
+
+    # Probar cashdraw() como respaldo (pin 2 es el estándar según el manual)
+    try:
+        printer.cashdraw(2)  # Pin 2 según el manual
+        time.sleep(0.2)
+    except:
+        pass
+
+    # Verificar que la conexión siga activa antes de imprimir
+    if not getattr(printer, 'device', None):
+        raise Exception("No se pudo mantener la conexión con la impresora")
+
+    # Todo el ticket se arma en memoria y se envía en una sola escritura USB
+    printer._raw(contenido)
+
+
+def renderizar_ticket(ticket):
+    """Arma el ticket completo (con logo y corte) como un solo bloque de bytes ESC/POS"""
+    from escpos.printer import Dummy
+
+    printer = Dummy()
+    nombre_negocio = ticket['nombre_negocio']
+
+    # Inicializar impresora (reset básico) DESPUÉS de los comandos del cajón
+    printer._raw(b'\x1B\x40')  # ESC @ - Inicializar impresora
+
+    # Configurar impresora (centrado, tamaño de fuente)
+    printer.set(align='center', font='a', width=1, height=1)
+
+    # Logo si existe (ya convertido a imagen raster ESC/POS al cargarlo)
+    logo = logo_escpos(ticket['logo_path'])
+    if logo:
+        printer.set(align='center')
+        printer._raw(logo)
+        printer.text("\n")
+
+    # Encabezado
+    printer.text("\n")
+    printer.set(align='center', font='b', width=2, height=2)
+    printer.text(f"{nombre_negocio}\n")
+    printer.set(align='center', font='a', width=1, height=1)
+
+    # Información adicional del negocio
+    if ticket['nit']:
+        printer.text(f"NIT: {ticket['nit']}\n")
+    if ticket['direccion']:
+        # Dividir dirección si es muy larga
+        direccion = ticket['direccion']
+        if len(direccion) > 32:
+            palabras = direccion.split()
+            linea = ""
+            for palabra in palabras:
+                if len(linea + palabra) <= 32:
+                    linea += palabra + " "
+                else:
+                    if linea:
+                        printer.text(f"{linea.strip()}\n")
+                    linea = palabra + " "
+            if linea:
+                printer.text(f"{linea.strip()}\n")
+        else:
+            printer.text(f"{direccion}\n")
+    if ticket['telefono']:
+        printer.text(f"Tel: {ticket['telefono']}\n")
+    if ticket['correo']:
+        printer.text(f"{ticket['correo']}\n")
+
+    printer.text("=" * 32 + "\n")
+    printer.text("\n")
+
+    # Información de la venta
+    printer.set(align='left')
+    printer.text(f"Venta: {ticket['numero_venta']}\n")
+    printer.text(f"Fecha: {ticket['fecha_venta']}\n")
+    printer.text(f"Vendedor: {ticket['vendedor']}\n")
+    printer.text(f"Pago: {ticket['metodo_pago']}\n")
+    printer.text("-" * 32 + "\n")
+    printer.text("\n")
+
+    # Productos
+    printer.set(align='center', font='b')
+    printer.text("PRODUCTOS\n")
+    printer.set(align='left', font='a')
+    printer.text("-" * 32 + "\n")
+
+    for item in ticket['items']:
+        # Nombre del producto (puede ser largo, ajustar si es necesario)
+        nombre_producto = item['nombre'][:28]  # Limitar a 28 caracteres
+        if len(item['nombre']) > 28:
+            nombre_producto += "..."
+
+        printer.text(f"{nombre_producto}\n")
+        printer.text(f"  {item['cantidad']} x ${item['precio_unitario']:,.0f} = ${item['subtotal']:,.0f}\n")
+        printer.text("\n")
+
+    printer.text("=" * 32 + "\n")
+
+    # Total
+    printer.set(align='right', font='b', width=2, height=2)
+    printer.text(f"TOTAL: ${ticket['total']:,.0f}\n")
+    printer.set(align='left', font='a', width=1, height=1)
+    printer.text("\n")
+    printer.text("=" * 32 + "\n")
+    printer.text("\n")
+
+    # Pie de página
+    printer.set(align='center')
+    printer.text("Gracias por su compra\n")
+    if ticket['telefono']:
+        printer.text(f"{nombre_negocio}\n")
+        printer.text(f"Tel: {ticket['telefono']}\n")
+    printer.text("\n")
+    printer.text("\n")
+
+    # Cortar el ticket
+    printer.cut()
+
+    return printer.output
@@ -0,0 +1,216 @@
+"""
+Índice en memoria de productos por código de barras para los endpoints del escáner.
+
+Guarda solo los campos que necesita el punto de venta y se mantiene al día con
+los eventos de la sesión de SQLAlchemy: cada commit que crea, modifica o
+desactiva productos (incluido el stock) o renombra categorías actualiza el
+índice, así que un escaneo se responde sin ir a la base de datos.
+"""
+from flask import current_app, has_app_context
+from app import db
+from app.models import Producto, Categoria
+from sqlalchemy import event, inspect, select
+import threading
+import time
+
+# Campos del producto que se guardan en el índice (en este orden)
+CAMPOS = ('id', 'codigo_barras', 'nombre', 'descripcion', 'precio_venta',
+          'precio_compra', 'stock', 'stock_minimo', 'categoria_id')
+
+TTL_POR_DEFECTO = 600  # segundos antes de recargar todo el índice
+
+_CLAVE_CAMBIOS = 'indice_productos_cambios'
+_CAMPOS_REQUERIDOS = set(CAMPOS) | {'activo'}
+
+
+def init_app(app):
+    """Registra el estado del índice y los eventos de sesión"""
+    app.extensions['indice_productos'] = {
+        'lock': threading.RLock(),
+        'por_codigo': {},       # codigo_barras -> tupla con CAMPOS
+        'codigo_por_id': {},    # id -> codigo_barras
+        'categorias': {},       # id -> nombre
+        'pendientes': set(),    # ids a recargar desde la base de datos
+        'cargado_en': None
+    }
+
+    if not event.contains(db.session, 'after_flush', _registrar_cambios):
+        event.listen(db.session, 'after_flush', _registrar_cambios)
+        event.listen(db.session, 'after_commit', _aplicar_cambios)
+        event.listen(db.session, 'after_soft_rollback', _descartar_cambios)
+
+
+def _estado():
+    return current_app.extensions['indice_productos']
+
+
+def _tupla_producto(producto):
+    return (
+        producto.id,
+        producto.codigo_barras,
+        producto.nombre,
+        producto.descripcion,
+        float(producto.precio_venta),
+        float(producto.precio_compra),
+        producto.stock,
+        producto.stock_minimo,
+        producto.categoria_id,
+    )
+
+
+def _tupla_fila(fila):
+    """Convierte una fila (columnas en el orden de CAMPOS) a la tupla del índice"""
+    return tuple(fila[:4]) + (float(fila[4]), float(fila[5])) + tuple(fila[6:len(CAMPOS)])
+
+
+def _cargar_todo(estado):
+    """Carga todos los productos activos con una sola consulta"""
+    with db.engine.connect() as conn:
+        categorias = dict(conn.execute(select(Categoria.id, Categoria.nombre)).all())
+        filas = conn.execute(
+            select(*[getattr(Producto, campo) for campo in CAMPOS]).where(Producto.activo == True)
+        ).all()
+
+    por_codigo = {}
+    codigo_por_id = {}
+    for fila in filas:
+        por_codigo[fila.codigo_barras] = _tupla_fila(fila)
+        codigo_por_id[fila.id] = fila.codigo_barras
+
+    estado['categorias'] = categorias
+    estado['por_codigo'] = por_codigo
+    estado['codigo_por_id'] = codigo_por_id
+    estado['pendientes'] = set()
+    estado['cargado_en'] = time.monotonic()
+
+
+def _guardar(estado, tupla):
+    """Inserta o reemplaza la entrada de un producto activo"""
+    producto_id, codigo = tupla[0], tupla[1]
+    codigo_anterior = estado['codigo_por_id'].get(producto_id)
+    if codigo_anterior is not None and codigo_anterior != codigo:
+        estado['por_codigo'].pop(codigo_anterior, None)
+    estado['por_codigo'][codigo] = tupla
+    estado['codigo_por_id'][producto_id] = codigo
+
+
+def _quitar(estado, producto_id):
+    codigo = estado['codigo_por_id'].pop(producto_id, None)
+    if codigo is not None:
+        estado['por_codigo'].pop(codigo, None)
+
+
+def _recargar_pendientes(estado):
+    """Recarga en una consulta los productos que no se pudieron tomar del commit"""
+    ids = estado['pendientes']
+    estado['pendientes'] = set()
+    with db.engine.connect() as conn:
+        filas = conn.execute(
+            select(*[getattr(Producto, campo) for campo in CAMPOS], Producto.activo).where(Producto.id.in_(ids))
+        ).all()
+    encontrados = set()
+    for fila in filas:
+        encontrados.add(fila.id)
+        if fila.activo:
+            _guardar(estado, _tupla_fila(fila))
+        else:
+            _quitar(estado, fila.id)
+    for producto_id in ids - encontrados:
+        _quitar(estado, producto_id)
+
+
+def _preparar(estado):
+    ttl = current_app.config.get('INDICE_PRODUCTOS_TTL', TTL_POR_DEFECTO)
+    if estado['cargado_en'] is None or time.monotonic() - estado['cargado_en'] > ttl:
+        _cargar_todo(estado)
+    elif estado['pendientes']:
+        _recargar_pendientes(estado)
+
+
+def _a_dict(estado, tupla):
+    producto = dict(zip(CAMPOS, tupla))
+    producto['categoria'] = estado['categorias'].get(producto['categoria_id'])
+    producto['activo'] = True
+    return producto
+
+
+def obtener_producto(codigo):
+    """
+    Busca un producto activo por código de barras.
+    Retorna un dict compatible con Producto.to_dict() (sin fechas) o None.
+    """
+    estado = _estado()
+    with estado['lock']:
+        _preparar(estado)
+        tupla = estado['por_codigo'].get(codigo)
+        if tupla is not None:
+            return _a_dict(estado, tupla)
+
+    # Un fallo puede ser un producto creado por otro proceso: confirmar en la BD
+    producto = Producto.query.filter_by(codigo_barras=codigo, activo=True).first()
+    if not producto:
+        return None
+    with estado['lock']:
+        _guardar(estado, _tupla_producto(producto))
+        if producto.categoria_id not in estado['categorias'] and producto.categoria_rel:
+            estado['categorias'][producto.categoria_id] = producto.categoria_rel.nombre
+        return _a_dict(estado, estado['por_codigo'][codigo])
+
+
+def invalidar_productos(producto_ids):
+    """Marca productos para recargarlos en la próxima búsqueda (p. ej. tras un UPDATE masivo)"""
+    estado = _estado()
+    with estado['lock']:
+        estado['pendientes'].update(producto_ids)
+
+
+def invalidar_al_confirmar(producto_ids):
+    """Recarga esos productos cuando se confirme la transacción actual (UPDATE fuera del ORM)"""
+    cambios = db.session.info.setdefault(_CLAVE_CAMBIOS, {'productos': {}, 'categorias': {}, 'pendientes': set()})
+    cambios['pendientes'].update(producto_ids)
+
+
+def invalidar_todo():
+    """Fuerza la recarga completa del índice en la próxima búsqueda"""
+    estado = _estado()
+    with estado['lock']:
+        estado['cargado_en'] = None
+
+
+def _registrar_cambios(session, flush_context):
+    """Toma una foto de los productos y categorías escritos en este flush"""
+    cambios = session.info.setdefault(_CLAVE_CAMBIOS, {'productos': {}, 'categorias': {}, 'pendientes': set()})
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Producto):
+            if inspect(obj).unloaded & _CAMPOS_REQUERIDOS:
+                cambios['pendientes'].add(obj.id)
+            else:
+                cambios['productos'][obj.id] = _tupla_producto(obj) if obj.activo else None
+        elif isinstance(obj, Categoria):
+            cambios['categorias'][obj.id] = obj.nombre
+
+    for obj in session.deleted:
+        if isinstance(obj, Producto):
+            cambios['productos'][obj.id] = None
+
+
+def _aplicar_cambios(session):
+    cambios = session.info.pop(_CLAVE_CAMBIOS, None)
+    if not cambios or not has_app_context() or 'indice_productos' not in current_app.extensions:
+        return
+
+    estado = _estado()
+    with estado['lock']:
+        estado['categorias'].update(cambios['categorias'])
+        for producto_id, tupla in cambios['productos'].items():
+            if tupla is None:
+                _quitar(estado, producto_id)
+            else:
+                _guardar(estado, tupla)
+        estado['pendientes'].update(cambios['pendientes'])
+
+
+def _descartar_cambios(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_CLAVE_CAMBIOS, None)
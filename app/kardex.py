@@ -0,0 +1,220 @@
+"""
+Kardex: libro de movimientos de inventario y saldos diarios.
+
+Cada cambio de Producto.stock (ventas, devoluciones, compras, altas y ajustes
+manuales) agrega una fila a movimientos_inventario en la misma transacción,
+con un solo INSERT por operación. Las filas nunca se modifican: la suma de
+los movimientos de un producto es su stock.
+
+Para no sumar todo el historial, cada noche se guarda en saldos_inventario el
+stock al inicio del día de los productos que tuvieron movimientos desde el
+corte anterior. El stock en cualquier momento es el último saldo anterior
+más los movimientos desde ese corte; ambas búsquedas usan índices.
+
+    flask --app run tomar-saldos-inventario
+"""
+from app import db
+from app.models import MovimientoInventario, SaldoInventario
+from sqlalchemy import event, insert, select, func, literal, and_, or_, text
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, time
+import click
+
+INICIAL = 'inicial'
+VENTA = 'venta'
+DEVOLUCION = 'devolucion'
+COMPRA = 'compra'
+AJUSTE = 'ajuste'
+
+TIPOS = (INICIAL, VENTA, DEVOLUCION, COMPRA, AJUSTE)
+
+
+def init_app(app):
+    """Registra el comando de saldos y la carga inicial del kardex al crear la tabla"""
+    app.cli.add_command(comando_tomar_saldos)
+    if not event.contains(db.metadata, 'after_create', _despues_de_crear_tablas):
+        event.listen(db.metadata, 'after_create', _despues_de_crear_tablas)
+
+
+def _despues_de_crear_tablas(target, connection, tables=(), **kw):
+    # Tabla nueva en una base con productos: registrar su stock actual
+    if MovimientoInventario.__table__ in tables:
+        sembrar_inventario_inicial(connection)
+
+
+def sembrar_inventario_inicial(connection):
+    """
+    Agrega un movimiento 'inicial' por producto para que la suma del kardex
+    coincida con el stock actual (productos anteriores al kardex).
+    """
+    connection.execute(text("""
+        INSERT INTO movimientos_inventario (producto_id, fecha, tipo, cantidad)
+        SELECT productos.id, :fecha, :tipo, productos.stock - COALESCE(
+            (SELECT SUM(m.cantidad) FROM movimientos_inventario m WHERE m.producto_id = productos.id), 0)
+        FROM productos
+        WHERE NOT EXISTS (SELECT 1 FROM movimientos_inventario m
+                          WHERE m.producto_id = productos.id AND m.tipo = :tipo)
+          AND productos.stock - COALESCE(
+            (SELECT SUM(m.cantidad) FROM movimientos_inventario m WHERE m.producto_id = productos.id), 0) <> 0
+    """), {'fecha': datetime.utcnow(), 'tipo': INICIAL})
+
+
+def registrar_movimientos(tipo, movimientos, referencia_id=None, usuario_id=None, fecha=None):
+    """
+    Agrega al kardex los movimientos de una operación con un solo INSERT.
+    `movimientos` son pares (producto_id, cantidad) con signo; se omiten los de cantidad 0.
+    Debe llamarse en la misma transacción que cambia el stock.
+    """
+    fecha = fecha or datetime.utcnow()
+    filas = [{
+        'producto_id': producto_id,
+        'fecha': fecha,
+        'tipo': tipo,
+        'cantidad': cantidad,
+        'referencia_id': referencia_id,
+        'usuario_id': usuario_id
+    } for producto_id, cantidad in movimientos if cantidad]
+    if filas:
+        db.session.execute(insert(MovimientoInventario), filas)
+
+
+# ========== SALDOS ==========
+
+def _inicio_dia(dia):
+    return datetime.combine(dia, time.min)
+
+
+def tomar_saldos(hoy=None):
+    """
+    Guarda el stock al inicio de `hoy` (UTC) de los productos con movimientos
+    desde el último corte. Retorna cuántos saldos se guardaron (0 si el corte ya existía).
+    """
+    hoy = hoy or datetime.utcnow().date()
+    ultimo = db.session.query(func.max(SaldoInventario.fecha)).scalar()
+    if ultimo is not None and ultimo >= hoy:
+        return 0
+
+    condiciones = [MovimientoInventario.fecha < _inicio_dia(hoy)]
+    if ultimo is not None:
+        condiciones.append(MovimientoInventario.fecha >= _inicio_dia(ultimo))
+    movimientos = select(
+        MovimientoInventario.producto_id,
+        func.sum(MovimientoInventario.cantidad).label('cantidad')
+    ).where(*condiciones).group_by(MovimientoInventario.producto_id).subquery()
+
+    # Último saldo de cada producto: los movimientos entre ese saldo y el
+    # corte anterior son cero (si no, ese corte habría guardado otro saldo)
+    ultimos = select(
+        SaldoInventario.producto_id,
+        func.max(SaldoInventario.fecha).label('fecha')
+    ).group_by(SaldoInventario.producto_id).subquery()
+
+    consulta = select(
+        movimientos.c.producto_id,
+        literal(hoy, type_=db.Date),
+        func.coalesce(SaldoInventario.stock, 0) + movimientos.c.cantidad
+    ).select_from(movimientos) \
+        .outerjoin(ultimos, ultimos.c.producto_id == movimientos.c.producto_id) \
+        .outerjoin(SaldoInventario, and_(SaldoInventario.producto_id == ultimos.c.producto_id,
+                                         SaldoInventario.fecha == ultimos.c.fecha))
+
+    try:
+        resultado = db.session.execute(
+            insert(SaldoInventario).from_select(['producto_id', 'fecha', 'stock'], consulta)
+        )
+        db.session.commit()
+    except IntegrityError:
+        # Otro proceso tomó el mismo corte
+        db.session.rollback()
+        return 0
+    return resultado.rowcount
+
+
+def stock_en(momento, producto_ids=None):
+    """
+    Stock de cada producto en `momento` (sin contar los movimientos de ese
+    instante en adelante). Retorna {producto_id: stock} solo con los productos
+    que tienen historial; los demás tenían 0.
+    """
+    corte = db.session.query(func.max(SaldoInventario.fecha)) \
+        .filter(SaldoInventario.fecha <= momento.date()).scalar()
+
+    stock = {}
+    if corte is not None:
+        ultimos = select(
+            SaldoInventario.producto_id,
+            func.max(SaldoInventario.fecha).label('fecha')
+        ).where(SaldoInventario.fecha <= corte)
+        if producto_ids is not None:
+            ultimos = ultimos.where(SaldoInventario.producto_id.in_(producto_ids))
+        ultimos = ultimos.group_by(SaldoInventario.producto_id).subquery()
+        saldos = db.session.query(SaldoInventario.producto_id, SaldoInventario.stock).join(
+            ultimos, and_(SaldoInventario.producto_id == ultimos.c.producto_id,
+                          SaldoInventario.fecha == ultimos.c.fecha))
+        stock = dict(saldos.all())
+
+    movimientos = db.session.query(
+        MovimientoInventario.producto_id,
+        func.sum(MovimientoInventario.cantidad)
+    ).filter(MovimientoInventario.fecha < momento)
+    if corte is not None:
+        movimientos = movimientos.filter(MovimientoInventario.fecha >= _inicio_dia(corte))
+    if producto_ids is not None:
+        movimientos = movimientos.filter(MovimientoInventario.producto_id.in_(producto_ids))
+    for producto_id, cantidad in movimientos.group_by(MovimientoInventario.producto_id).all():
+        stock[producto_id] = stock.get(producto_id, 0) + int(cantidad)
+
+    return stock
+
+
+def historial_producto(producto_id, desde, hasta, cursor=None, limite=100):
+    """
+    Movimientos de un producto entre desde (incluido) y hasta (excluido),
+    del más antiguo al más reciente, con el saldo después de cada uno.
+    `cursor` es (fecha, id) del último movimiento de la página anterior.
+    Retorna (saldo_inicial, movimientos, hay_mas).
+    """
+    consulta = MovimientoInventario.query.filter(
+        MovimientoInventario.producto_id == producto_id,
+        MovimientoInventario.fecha >= desde,
+        MovimientoInventario.fecha < hasta
+    )
+    if cursor:
+        fecha_cursor, id_cursor = cursor
+        consulta = consulta.filter(or_(
+            MovimientoInventario.fecha > fecha_cursor,
+            and_(MovimientoInventario.fecha == fecha_cursor, MovimientoInventario.id > id_cursor)
+        ))
+    filas = consulta.order_by(MovimientoInventario.fecha, MovimientoInventario.id).limit(limite + 1).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+
+    saldo = stock_en(desde, [producto_id]).get(producto_id, 0)
+    if cursor:
+        # Sumar lo que ya se mostró en las páginas anteriores
+        saldo += int(db.session.query(func.coalesce(func.sum(MovimientoInventario.cantidad), 0)).filter(
+            MovimientoInventario.producto_id == producto_id,
+            MovimientoInventario.fecha >= desde,
+            or_(MovimientoInventario.fecha < fecha_cursor,
+                and_(MovimientoInventario.fecha == fecha_cursor, MovimientoInventario.id <= id_cursor))
+        ).scalar())
+
+    saldo_inicial = saldo
+    movimientos = []
+    for movimiento in filas:
+        saldo += movimiento.cantidad
+        datos = movimiento.to_dict()
+        datos['saldo'] = saldo
+        movimientos.append(datos)
+    return saldo_inicial, movimientos, hay_mas
+
+
+# ========== COMANDO DE CONSOLA ==========
+
+@click.command('tomar-saldos-inventario')
+@click.option('--fecha', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Día del corte (AAAA-MM-DD); por defecto, hoy (UTC)')
+def comando_tomar_saldos(fecha):
+    """Guarda el stock al inicio del día de los productos con movimientos"""
+    guardados = tomar_saldos(fecha.date() if fecha else None)
+    click.echo(f'✓ {guardados} saldos guardados')
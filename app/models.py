@@ -1,8 +1,9 @@
 from app import db
 from datetime import datetime
-from sqlalchemy import Numeric
+from sqlalchemy import Numeric, false
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+import json
 import os
 
 
@@ -60,6 +61,9 @@ class Categoria(db.Model):
 
 class Producto(db.Model):
     __tablename__ = 'productos'
+    __table_args__ = (
+        db.Index('ix_productos_stock_bajo', 'stock_bajo'),  # Alertas de stock bajo sin recorrer el catálogo
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     codigo_barras = db.Column(db.String(50), unique=True, nullable=False, index=True)
@@ -71,6 +75,7 @@ class Producto(db.Model):
     stock_minimo = db.Column(db.Integer, default=0)
     categoria_id = db.Column(db.Integer, db.ForeignKey('categorias.id'), nullable=True)
     activo = db.Column(db.Boolean, default=True)
+    stock_bajo = db.Column(db.Boolean, nullable=False, default=False, server_default=false())  # activo y stock <= stock_minimo (app.alertas_stock)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -86,6 +91,7 @@ class Producto(db.Model):
             'precio_compra': float(self.precio_compra),
             'stock': self.stock,
             'stock_minimo': self.stock_minimo,
+            'stock_bajo': self.stock_bajo,
             'categoria_id': self.categoria_id,
             'categoria': self.categoria_rel.nombre if self.categoria_rel else None,
             'activo': self.activo,
@@ -99,6 +105,9 @@ class Producto(db.Model):
 
 class Venta(db.Model):
     __tablename__ = 'ventas'
+    __table_args__ = (
+        db.Index('ix_ventas_fecha_venta_id', 'fecha_venta', 'id'),  # Rangos de fecha y paginación por cursor
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     numero_venta = db.Column(db.String(20), unique=True, nullable=False)
@@ -137,6 +146,8 @@ class ItemVenta(db.Model):
     cantidad = db.Column(db.Integer, nullable=False)
     precio_unitario = db.Column(Numeric(10, 2), nullable=False)
     subtotal = db.Column(Numeric(10, 2), nullable=False)
+    costo_unitario = db.Column(Numeric(10, 2), nullable=False, default=0)  # precio de compra al momento de la venta
+    cantidad_devuelta = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # suma de sus devoluciones
     
     def to_dict(self):
         return {
@@ -145,15 +156,13 @@ class ItemVenta(db.Model):
             'producto_id': self.producto_id,
             'producto_nombre': self.producto.nombre if self.producto else None,
             'cantidad': self.cantidad,
+            'cantidad_devuelta': self.cantidad_devuelta or 0,
             'precio_unitario': float(self.precio_unitario),
             'subtotal': float(self.subtotal)
         }
     
     def calcular_ganancia(self):
-        if self.producto:
-            precio_compra = float(self.producto.precio_compra)
-            return (float(self.precio_unitario) - precio_compra) * self.cantidad
-        return 0
+        return (float(self.precio_unitario) - float(self.costo_unitario or 0)) * self.cantidad
 
 
 class Devolucion(db.Model):
@@ -195,16 +204,14 @@ class ItemDevolucion(db.Model):
     cantidad = db.Column(db.Integer, nullable=False)
     precio_unitario = db.Column(Numeric(10, 2), nullable=False)
     subtotal = db.Column(Numeric(10, 2), nullable=False)
+    costo_unitario = db.Column(Numeric(10, 2), nullable=False, default=0)  # costo registrado en el item de venta
     
     item_venta = db.relationship('ItemVenta', backref='devoluciones')
     producto = db.relationship('Producto', backref='items_devolucion')
     
     def calcular_ganancia_perdida(self):
         """Calcula la ganancia perdida por este item devuelto"""
-        if self.producto:
-            precio_compra = float(self.producto.precio_compra)
-            return (float(self.precio_unitario) - precio_compra) * self.cantidad
-        return 0
+        return (float(self.precio_unitario) - float(self.costo_unitario or 0)) * self.cantidad
     
     def to_dict(self):
         return {
@@ -405,6 +412,128 @@ class ItemCompra(db.Model):
         }
 
 
+class SecuenciaDocumento(db.Model):
+    """Contador diario por tipo de documento (VTA, COM, DEV) para numeración secuencial"""
+    __tablename__ = 'secuencias_documento'
+    
+    prefijo = db.Column(db.String(10), primary_key=True)
+    fecha = db.Column(db.String(8), primary_key=True)  # YYYYMMDD
+    ultimo_numero = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SolicitudIdempotente(db.Model):
+    """Resultado de una petición POST enviada con clave de idempotencia (reintentos del cliente)"""
+    __tablename__ = 'solicitudes_idempotentes'
+    __table_args__ = (db.UniqueConstraint('endpoint', 'clave', name='uq_solicitud_endpoint_clave'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    clave = db.Column(db.String(100), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)
+    codigo_estado = db.Column(db.Integer)  # None mientras la respuesta no se ha guardado
+    respuesta = db.Column(db.Text)  # JSON de la respuesta original
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class ResumenVentaDiaria(db.Model):
+    """Acumulado de ventas y devoluciones por día, usuario, método de pago y producto"""
+    __tablename__ = 'resumen_ventas_diarias'
+    __table_args__ = (
+        db.UniqueConstraint('fecha', 'usuario_id', 'metodo_pago', 'producto_id', name='uq_resumen_venta_diaria'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False)  # Día de la venta o de la devolución
+    usuario_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = venta sin usuario
+    metodo_pago = db.Column(db.String(20), nullable=False)
+    producto_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = fila de conteo de ventas
+    num_ventas = db.Column(db.Integer, nullable=False, default=0)
+    unidades = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(Numeric(12, 2), nullable=False, default=0)
+    costo = db.Column(Numeric(12, 2), nullable=False, default=0)
+    unidades_devueltas = db.Column(db.Integer, nullable=False, default=0)
+    devoluciones = db.Column(Numeric(12, 2), nullable=False, default=0)
+    costo_devuelto = db.Column(Numeric(12, 2), nullable=False, default=0)
+
+
+class MovimientoInventario(db.Model):
+    """Kardex: cada cambio de stock de un producto (solo se agregan filas, nunca se modifican)"""
+    __tablename__ = 'movimientos_inventario'
+    __table_args__ = (
+        db.Index('ix_movimientos_producto_fecha', 'producto_id', 'fecha', 'id'),  # Historial y stock a una fecha
+        db.Index('ix_movimientos_fecha', 'fecha'),  # Saldos diarios
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'), nullable=False)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # inicial, venta, devolucion, compra, ajuste
+    cantidad = db.Column(db.Integer, nullable=False)  # positiva entra, negativa sale
+    referencia_id = db.Column(db.Integer)  # id de la venta, devolución o compra según el tipo
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'producto_id': self.producto_id,
+            'fecha': self.fecha.isoformat() if self.fecha else None,
+            'tipo': self.tipo,
+            'cantidad': self.cantidad,
+            'referencia_id': self.referencia_id,
+            'usuario_id': self.usuario_id
+        }
+
+
+class SaldoInventario(db.Model):
+    """Stock de un producto al inicio de un día (UTC); solo se guarda para productos con movimientos"""
+    __tablename__ = 'saldos_inventario'
+    __table_args__ = (
+        db.UniqueConstraint('producto_id', 'fecha', name='uq_saldo_producto_fecha'),
+        db.Index('ix_saldos_fecha', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'), nullable=False)
+    fecha = db.Column(db.Date, nullable=False)
+    stock = db.Column(db.Integer, nullable=False)
+
+
+class ReporteGenerado(db.Model):
+    """Resultado (JSON) de un reporte: uno por reporte y noche de ejecución, más los generados a pedido"""
+    __tablename__ = 'reportes_generados'
+    __table_args__ = (
+        db.UniqueConstraint('nombre', 'fecha_programada', name='uq_reporte_nombre_fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(50), nullable=False)
+    fecha_programada = db.Column(db.Date, nullable=True)  # Día de la ejecución programada (evita duplicados entre procesos); NULL = a pedido
+    desde = db.Column(db.Date, nullable=False)  # Periodo que cubre el reporte
+    hasta = db.Column(db.Date, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='generando')  # generando, completado, error
+    datos = db.Column(db.Text)  # JSON del resultado
+    error = db.Column(db.Text)
+    fecha_inicio = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    fecha_fin = db.Column(db.DateTime)
+
+    def to_dict(self, con_datos=False):
+        resultado = {
+            'id': self.id,
+            'nombre': self.nombre,
+            'fecha_programada': self.fecha_programada.isoformat() if self.fecha_programada else None,
+            'manual': self.fecha_programada is None,
+            'desde': self.desde.isoformat(),
+            'hasta': self.hasta.isoformat(),
+            'estado': self.estado,
+            'error': self.error,
+            'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None
+        }
+        if con_datos:
+            resultado['datos'] = json.loads(self.datos) if self.datos else None
+        return resultado
+
+
 class ConfiguracionNegocio(db.Model):
     __tablename__ = 'configuracion_negocio'
     
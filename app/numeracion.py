@@ -0,0 +1,101 @@
+from flask import current_app
+from app import db
+from app.models import SecuenciaDocumento, Venta, Compra, Devolucion
+from datetime import datetime
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+import threading
+
+# Columna donde se guarda el número de cada tipo de documento
+COLUMNAS_NUMERO = {
+    'VTA': Venta.numero_venta,
+    'COM': Compra.numero_compra,
+    'DEV': Devolucion.numero_devolucion,
+}
+
+TAMANO_BLOQUE_POR_DEFECTO = 10
+
+
+def _estado():
+    """Bloques reservados por este proceso (uno por prefijo)"""
+    return current_app.extensions.setdefault('numeracion', {
+        'lock': threading.Lock(),
+        'bloques': {}
+    })
+
+
+def _numero_maximo_existente(conn, prefijo, fecha):
+    """
+    Mayor número ya usado para el prefijo y día, para no chocar con los números
+    generados antes de existir el contador del día.
+    """
+    columna = COLUMNAS_NUMERO.get(prefijo)
+    if columna is None:
+        return 0
+
+    ultimo = conn.execute(
+        select(columna)
+        .where(columna.like(f'{prefijo}-{fecha}-%'))
+        .order_by(func.length(columna).desc(), columna.desc())
+        .limit(1)
+    ).scalar()
+    try:
+        return int(ultimo.rsplit('-', 1)[1]) if ultimo else 0
+    except ValueError:
+        return 0
+
+
+def _reservar_bloque(prefijo, fecha, tamano):
+    """
+    Reserva atómicamente un bloque de números en la base de datos.
+    Usa su propia transacción, independiente de la sesión de la petición,
+    para que el contador quede confirmado aunque la venta haga rollback.
+    Retorna (primer_numero, ultimo_numero) del bloque.
+    """
+    tabla = SecuenciaDocumento.__table__
+    condicion = (tabla.c.prefijo == prefijo) & (tabla.c.fecha == fecha)
+
+    for _ in range(2):
+        try:
+            with db.engine.begin() as conn:
+                resultado = conn.execute(
+                    tabla.update().where(condicion).values(ultimo_numero=tabla.c.ultimo_numero + tamano)
+                )
+                if resultado.rowcount == 0:
+                    # Primer bloque del día
+                    semilla = _numero_maximo_existente(conn, prefijo, fecha)
+                    conn.execute(tabla.insert().values(prefijo=prefijo, fecha=fecha, ultimo_numero=semilla + tamano))
+
+                ultimo = conn.execute(select(tabla.c.ultimo_numero).where(condicion)).scalar_one()
+                return ultimo - tamano + 1, ultimo
+        except IntegrityError:
+            # Otro proceso creó el contador del día al mismo tiempo; el UPDATE ya funcionará
+            continue
+
+    raise RuntimeError(f'No se pudo reservar numeración para {prefijo}')
+
+
+def siguiente_numero(prefijo):
+    """
+    Genera el siguiente número de documento del día: PREFIJO-YYYYMMDD-NNNN.
+
+    Cada proceso reserva bloques de números en la tabla secuencias_documento y
+    los entrega desde memoria, así que solo toca la base de datos una vez por
+    bloque. Los números son únicos y crecientes por día; puede haber huecos si
+    un proceso se reinicia sin agotar su bloque.
+    """
+    fecha = datetime.now().strftime('%Y%m%d')
+    estado = _estado()
+
+    with estado['lock']:
+        bloque = estado['bloques'].get(prefijo)
+        if not bloque or bloque['fecha'] != fecha or bloque['siguiente'] > bloque['limite']:
+            tamano = current_app.config.get('NUMERACION_TAMANO_BLOQUE', TAMANO_BLOQUE_POR_DEFECTO)
+            inicio, limite = _reservar_bloque(prefijo, fecha, tamano)
+            bloque = {'fecha': fecha, 'siguiente': inicio, 'limite': limite}
+            estado['bloques'][prefijo] = bloque
+
+        numero = bloque['siguiente']
+        bloque['siguiente'] += 1
+
+    return f'{prefijo}-{fecha}-{numero:04d}'
@@ -0,0 +1,130 @@
+from app import db, resumen_diario, kardex, indice_productos, alertas_stock, reservas_stock
+from app.models import Producto, ItemVenta
+from decimal import Decimal
+from sqlalchemy import insert, update, case, select
+
+
+class StockInsuficienteError(Exception):
+    """Se lanza cuando un producto del carrito no tiene stock suficiente"""
+
+    def __init__(self, producto):
+        self.producto = producto
+        super().__init__(f'Stock insuficiente para {producto.nombre}')
+
+
+class ProductoNoEncontradoError(Exception):
+    """Se lanza cuando el carrito incluye un producto que no existe"""
+
+    def __init__(self, producto_ids):
+        self.producto_ids = sorted(producto_ids)
+        super().__init__(f'Producto no encontrado: {", ".join(str(i) for i in self.producto_ids)}')
+
+
+def registrar_items_venta(venta, items, carrito=None):
+    """
+    Registra los items de una venta en lote y descuenta el stock.
+
+    Carga todos los productos del carrito con una sola consulta IN, descuenta
+    el stock con un único UPDATE condicional (sumando líneas repetidas del
+    mismo producto) e inserta todas las filas de items_venta con un único
+    INSERT multi-fila. El costo en consultas es el mismo para 1 línea que para
+    100. También acumula la venta en el resumen diario y registra la salida en
+    el kardex, dentro de la misma transacción.
+
+    El UPDATE solo descuenta si queda stock para las reservas de otros
+    carritos (`carrito` es la clave de las reservas de esta venta); si algún
+    producto no alcanza, lanza StockInsuficienteError y no descuenta nada.
+
+    Cada item es un dict con producto_id, cantidad y opcionalmente
+    precio_unitario (si falta se usa el precio de venta del producto).
+    Si algún producto no existe lanza ProductoNoEncontradoError antes de
+    tocar el stock. Retorna el total de la venta.
+    La venta ya debe tener id (después de flush).
+    """
+    producto_ids = {int(item_data['producto_id']) for item_data in items}
+    productos = {
+        p.id: p for p in Producto.query.filter(Producto.id.in_(producto_ids)).all()
+    } if producto_ids else {}
+    if len(productos) < len(producto_ids):
+        raise ProductoNoEncontradoError(producto_ids - set(productos))
+
+    cantidades = {}
+    for item_data in items:
+        producto_id = int(item_data['producto_id'])
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + int(item_data['cantidad'])
+
+    descontar_stock(productos, cantidades, carrito)
+
+    total = Decimal('0.00')
+    filas = []
+    lineas = []
+    for item_data in items:
+        producto = productos[int(item_data['producto_id'])]
+        cantidad = int(item_data['cantidad'])
+        precio = item_data.get('precio_unitario')
+        precio_unitario = Decimal(str(precio)) if precio is not None else Decimal(str(producto.precio_venta))
+        subtotal = precio_unitario * cantidad
+
+        filas.append({
+            'venta_id': venta.id,
+            'producto_id': producto.id,
+            'cantidad': cantidad,
+            'precio_unitario': precio_unitario,
+            'subtotal': subtotal,
+            'costo_unitario': producto.precio_compra
+        })
+        lineas.append((producto.id, cantidad, subtotal, producto.precio_compra))
+        total += subtotal
+
+    if filas:
+        db.session.execute(insert(ItemVenta), filas)
+    resumen_diario.registrar_venta(venta, lineas)
+    kardex.registrar_movimientos(kardex.VENTA, [(producto_id, -cantidad) for producto_id, cantidad in cantidades.items()],
+                                 referencia_id=venta.id, usuario_id=venta.usuario_id, fecha=venta.fecha_venta)
+
+    return total
+
+
+def descontar_stock(productos, cantidades, carrito=None):
+    """
+    Descuenta {producto_id: cantidad} con un solo UPDATE condicional:
+    stock = stock - cantidad solo donde stock >= cantidad + reservado por otros
+    carritos. Si falta stock de algún producto lanza StockInsuficienteError
+    (la transacción debe deshacerse). `productos` es {producto_id: Producto}.
+    """
+    if not cantidades:
+        return
+    tabla = Producto.__table__
+    reservado = reservas_stock.reservado_por_otros(cantidades, carrito)
+    descuento = case(cantidades, value=tabla.c.id)
+    minimo = case({producto_id: cantidad + reservado[producto_id]
+                   for producto_id, cantidad in cantidades.items()}, value=tabla.c.id)
+    sentencia = update(tabla).where(tabla.c.id.in_(cantidades), tabla.c.stock >= minimo) \
+        .values(stock=tabla.c.stock - descuento)
+
+    if db.session.get_bind().dialect.update_returning:
+        descontados = {fila.id for fila in db.session.execute(sentencia.returning(tabla.c.id))}
+        faltantes = [producto_id for producto_id in cantidades if producto_id not in descontados]
+    else:
+        # Sin RETURNING solo se sabe cuántas filas cambiaron: si faltan, se deshace
+        # el UPDATE (savepoint) y se consulta el stock para nombrar el producto corto
+        savepoint = db.session.begin_nested()
+        if db.session.execute(sentencia).rowcount == len(cantidades):
+            savepoint.commit()
+            faltantes = []
+        else:
+            savepoint.rollback()
+            stocks = db.session.execute(
+                select(tabla.c.id, tabla.c.stock).where(tabla.c.id.in_(cantidades))
+            ).all()
+            faltantes = [producto_id for producto_id, stock in stocks
+                         if stock < cantidades[producto_id] + reservado[producto_id]] or list(cantidades)
+
+    if faltantes:
+        raise StockInsuficienteError(productos[faltantes[0]])
+
+    # El UPDATE no pasa por el ORM: refrescar stock en memoria, índice y alertas
+    for producto_id in cantidades:
+        db.session.expire(productos[producto_id], ['stock', 'stock_bajo'])
+    indice_productos.invalidar_al_confirmar(cantidades)
+    alertas_stock.actualizar_productos(cantidades)
@@ -0,0 +1,312 @@
+"""
+Reportes programados: se calculan de noche y se guardan como JSON.
+
+Un hilo del proceso despierta cada noche a la hora REPORTES_HORA (hora local
+del servidor) y genera los reportes de REPORTES_PROGRAMADOS para el periodo
+del mes en curso hasta ayer (el día 1 queda el mes anterior completo). Cada
+resultado se guarda en reportes_generados; los endpoints del panel leen el
+último guardado en lugar de calcularlo durante el horario de atención. En la
+misma pasada se guardan los saldos diarios del kardex (ver app.kardex).
+Con REPORTES_HORA vacío no se inicia el hilo.
+
+Con varios procesos, la restricción única (nombre, fecha_programada) hace que
+cada reporte se genere una sola vez por noche. También se puede generar a
+mano (se guarda con fecha_programada NULL, aparte de los programados: no los
+reemplaza ni ocupa su lugar):
+
+    flask --app run generar-reportes [--reporte ventas] [--desde 2026-09-01 --hasta 2026-09-30]
+"""
+from flask import current_app
+from app import db, kardex
+from app.models import (ReporteGenerado, ResumenVentaDiaria, Producto, Categoria,
+                        Compra, Proveedor)
+from app.estadisticas import resumen_ventas, resumen_empleados, ranking_productos
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, time, timedelta
+import click
+import json
+import threading
+import traceback
+
+GENERANDO = 'generando'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+DIAS_RETENCION = 400  # reportes guardados que se conservan (más de un año de cierres de mes)
+
+
+def init_app(app):
+    """Registra el estado del programador, su arranque perezoso y el comando de consola"""
+    app.extensions['reportes_programados'] = {
+        'lock': threading.Lock(),
+        'hilo': None,
+        'detener': threading.Event()
+    }
+    app.before_request(_iniciar_programador)
+    app.cli.add_command(comando_generar_reportes)
+
+
+def _estado():
+    return current_app.extensions['reportes_programados']
+
+
+# ========== REPORTES ==========
+
+def _rango_datetime(desde, hasta):
+    return datetime.combine(desde, time.min), datetime.combine(hasta, time.max)
+
+
+def reporte_ventas(desde, hasta):
+    """Totales del periodo, ventas por día, por empleado y productos principales"""
+    inicio, fin = _rango_datetime(desde, hasta)
+    por_dia = db.session.query(
+        ResumenVentaDiaria.fecha,
+        func.sum(ResumenVentaDiaria.num_ventas),
+        func.sum(ResumenVentaDiaria.ingresos - ResumenVentaDiaria.devoluciones)
+    ).filter(ResumenVentaDiaria.fecha >= desde, ResumenVentaDiaria.fecha <= hasta) \
+        .group_by(ResumenVentaDiaria.fecha).order_by(ResumenVentaDiaria.fecha).all()
+
+    return {
+        'resumen': resumen_ventas(inicio, fin),
+        'por_dia': [
+            {'fecha': fecha.isoformat(), 'ventas': int(ventas or 0), 'total': round(float(total or 0), 2)}
+            for fecha, ventas, total in por_dia
+        ],
+        'empleados': resumen_empleados(inicio, fin),
+        'productos': ranking_productos(inicio, fin, limite=20)
+    }
+
+
+def reporte_ganancia_categorias(desde, hasta):
+    """Unidades, ingresos y ganancia netos de devoluciones por categoría"""
+    filas = db.session.query(
+        Categoria.nombre,
+        func.sum(ResumenVentaDiaria.unidades - ResumenVentaDiaria.unidades_devueltas),
+        func.sum(ResumenVentaDiaria.ingresos - ResumenVentaDiaria.devoluciones),
+        func.sum(ResumenVentaDiaria.ingresos - ResumenVentaDiaria.costo
+                 - ResumenVentaDiaria.devoluciones + ResumenVentaDiaria.costo_devuelto)
+    ).select_from(ResumenVentaDiaria).join(Producto, ResumenVentaDiaria.producto_id == Producto.id) \
+        .outerjoin(Categoria, Producto.categoria_id == Categoria.id) \
+        .filter(ResumenVentaDiaria.fecha >= desde, ResumenVentaDiaria.fecha <= hasta) \
+        .group_by(Categoria.nombre).all()
+
+    categorias = [{
+        'categoria': nombre or 'Sin categoría',
+        'unidades': int(unidades or 0),
+        'ingresos': round(float(ingresos or 0), 2),
+        'ganancia': round(float(ganancia or 0), 2)
+    } for nombre, unidades, ingresos, ganancia in filas]
+    categorias.sort(key=lambda x: x['ganancia'], reverse=True)
+    return {'categorias': categorias}
+
+
+def reporte_valor_inventario(desde, hasta):
+    """Valor del inventario activo al momento de generar (a costo y a precio de venta) por categoría"""
+    filas = db.session.query(
+        Categoria.nombre,
+        func.count(Producto.id),
+        func.coalesce(func.sum(Producto.stock), 0),
+        func.coalesce(func.sum(Producto.stock * Producto.precio_compra), 0),
+        func.coalesce(func.sum(Producto.stock * Producto.precio_venta), 0)
+    ).select_from(Producto).outerjoin(Categoria, Producto.categoria_id == Categoria.id) \
+        .filter(Producto.activo == True) \
+        .group_by(Categoria.nombre).all()
+
+    categorias = [{
+        'categoria': nombre or 'Sin categoría',
+        'productos': int(productos),
+        'unidades': int(unidades),
+        'valor_costo': round(float(valor_costo), 2),
+        'valor_venta': round(float(valor_venta), 2)
+    } for nombre, productos, unidades, valor_costo, valor_venta in filas]
+    categorias.sort(key=lambda x: x['valor_costo'], reverse=True)
+    return {
+        'categorias': categorias,
+        'total_costo': round(sum(c['valor_costo'] for c in categorias), 2),
+        'total_venta': round(sum(c['valor_venta'] for c in categorias), 2)
+    }
+
+
+def reporte_gasto_proveedores(desde, hasta):
+    """Compras recibidas en el periodo por proveedor"""
+    inicio, fin = _rango_datetime(desde, hasta)
+    filas = db.session.query(
+        Proveedor.nombre,
+        func.count(Compra.id),
+        func.coalesce(func.sum(Compra.total), 0)
+    ).select_from(Compra).outerjoin(Proveedor, Compra.proveedor_id == Proveedor.id) \
+        .filter(Compra.fecha_recepcion >= inicio, Compra.fecha_recepcion <= fin) \
+        .group_by(Proveedor.nombre).all()
+
+    proveedores = [{
+        'proveedor': nombre or 'Sin proveedor',
+        'compras': int(compras),
+        'total': round(float(total), 2)
+    } for nombre, compras, total in filas]
+    proveedores.sort(key=lambda x: x['total'], reverse=True)
+    return {'proveedores': proveedores, 'total': round(sum(p['total'] for p in proveedores), 2)}
+
+
+REPORTES = {
+    'ventas': reporte_ventas,
+    'ganancia_categorias': reporte_ganancia_categorias,
+    'valor_inventario': reporte_valor_inventario,
+    'gasto_proveedores': reporte_gasto_proveedores,
+}
+
+
+def periodo_por_defecto(hoy=None):
+    """Del primer día del mes de ayer hasta ayer (el día 1 cubre el mes anterior completo)"""
+    ayer = (hoy or datetime.utcnow().date()) - timedelta(days=1)
+    return ayer.replace(day=1), ayer
+
+
+def reportes_configurados():
+    """Nombres de REPORTES_PROGRAMADOS que existen (vacío = ningún reporte)"""
+    nombres = current_app.config.get('REPORTES_PROGRAMADOS', '')
+    return [nombre.strip() for nombre in nombres.split(',') if nombre.strip() in REPORTES]
+
+
+# ========== GENERACIÓN ==========
+
+def generar_reporte(nombre, desde=None, hasta=None, fecha_programada=None):
+    """
+    Genera un reporte y lo guarda. Retorna el ReporteGenerado, o None si otro
+    proceso ya reservó este reporte para la misma fecha_programada.
+    Sin fecha_programada (generación a pedido) se guarda aparte, sin tocar
+    los reportes programados.
+    """
+    if nombre not in REPORTES:
+        raise ValueError(f'Reporte no válido: {nombre}')
+    if not desde or not hasta:
+        desde, hasta = periodo_por_defecto(fecha_programada)
+
+    # Reservar el reporte: si otro proceso ya lo hizo, la restricción única lo
+    # impide (los manuales tienen fecha_programada NULL y nunca chocan)
+    reporte = ReporteGenerado(nombre=nombre, fecha_programada=fecha_programada,
+                              desde=desde, hasta=hasta, estado=GENERANDO)
+    db.session.add(reporte)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+
+    try:
+        datos = REPORTES[nombre](desde, hasta)
+        reporte.datos = json.dumps(datos)
+        reporte.estado = COMPLETADO
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error al generar el reporte {nombre}: {traceback.format_exc()}")
+        reporte.estado = ERROR
+        reporte.error = str(e)
+    reporte.fecha_fin = datetime.utcnow()
+    db.session.commit()
+    return reporte
+
+
+def ultimo_reporte(nombre, manual=False):
+    """
+    Último reporte completado con ese nombre (o None). Prefiere el programado;
+    si aún no hay, usa uno generado a pedido para el periodo por defecto.
+    Con manual=True, el último generado a pedido (cualquier periodo).
+    """
+    consulta = ReporteGenerado.query.filter_by(nombre=nombre, estado=COMPLETADO) \
+        .order_by(ReporteGenerado.fecha_fin.desc(), ReporteGenerado.id.desc())
+    if manual:
+        return consulta.filter(ReporteGenerado.fecha_programada.is_(None)).first()
+
+    programado = consulta.filter(ReporteGenerado.fecha_programada.isnot(None)).first()
+    if programado:
+        return programado
+    desde, hasta = periodo_por_defecto()
+    return consulta.filter(ReporteGenerado.fecha_programada.is_(None),
+                           ReporteGenerado.desde == desde, ReporteGenerado.hasta == hasta).first()
+
+
+def generar_en_segundo_plano(nombre, desde=None, hasta=None):
+    """Genera un reporte a pedido en un hilo, sin ocupar la petición"""
+    app = current_app._get_current_object()
+
+    def ejecutar():
+        with app.app_context():
+            try:
+                generar_reporte(nombre, desde, hasta)
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=ejecutar, name=f'reporte-{nombre}', daemon=True).start()
+
+
+def _purgar_antiguos():
+    limite = datetime.utcnow() - timedelta(days=DIAS_RETENCION)
+    ReporteGenerado.query.filter(ReporteGenerado.fecha_inicio < limite).delete(synchronize_session=False)
+    db.session.commit()
+
+
+# ========== PROGRAMADOR ==========
+
+def _iniciar_programador():
+    """Arranca el hilo del programador con la primera petición (no en comandos de consola)"""
+    estado = _estado()
+    if estado['hilo'] is not None:
+        return
+    with estado['lock']:
+        if estado['hilo'] is not None or not current_app.config.get('REPORTES_HORA'):
+            estado['hilo'] = estado['hilo'] or False
+            return
+        app = current_app._get_current_object()
+        estado['hilo'] = threading.Thread(target=_ciclo, args=(app,), name='reportes-programados', daemon=True)
+        estado['hilo'].start()
+
+
+def segundos_hasta_ejecucion(hora, ahora=None):
+    """Segundos hasta la próxima vez que el reloj local marque `hora` (HH:MM)"""
+    ahora = ahora or datetime.now()
+    horas, minutos = (int(parte) for parte in hora.split(':'))
+    siguiente = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    if siguiente <= ahora:
+        siguiente += timedelta(days=1)
+    return (siguiente - ahora).total_seconds()
+
+
+def _ciclo(app):
+    with app.app_context():
+        hora = app.config.get('REPORTES_HORA', '02:00')
+        detener = app.extensions['reportes_programados']['detener']
+    while not detener.wait(segundos_hasta_ejecucion(hora)):
+        with app.app_context():
+            try:
+                # Mismo reloj local que decide la hora de ejecución
+                fecha_programada = datetime.now().date()
+                for nombre in reportes_configurados():
+                    generar_reporte(nombre, fecha_programada=fecha_programada)
+                _purgar_antiguos()
+                kardex.tomar_saldos()
+            except Exception:
+                print(f"Error en los reportes programados: {traceback.format_exc()}")
+            finally:
+                db.session.remove()
+
+
+# ========== COMANDO DE CONSOLA ==========
+
+@click.command('generar-reportes')
+@click.option('--reporte', 'nombres', multiple=True, type=click.Choice(list(REPORTES)),
+              help='Reporte a generar (se puede repetir; por defecto, todos)')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), help='Inicio del periodo (AAAA-MM-DD)')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), help='Fin del periodo, incluido (AAAA-MM-DD)')
+def comando_generar_reportes(nombres, desde, hasta):
+    """Genera ahora los reportes (por defecto, del mes en curso hasta ayer)"""
+    if bool(desde) != bool(hasta):
+        raise click.UsageError('Indica --desde y --hasta juntos')
+    desde = desde.date() if desde else None
+    hasta = hasta.date() if hasta else None
+    for nombre in nombres or REPORTES:
+        reporte = generar_reporte(nombre, desde, hasta)
+        if reporte.estado == COMPLETADO:
+            click.echo(f'✓ {nombre}: {reporte.desde} a {reporte.hasta}')
+        else:
+            click.echo(f'✗ {nombre}: {reporte.error}')
@@ -0,0 +1,125 @@
+"""
+Reservas de stock de los carritos abiertos.
+
+Al escanear un producto en un carrito se reserva la cantidad del carrito por
+RESERVAS_TTL segundos; el punto de venta renueva las reservas mientras el
+carrito sigue abierto y las libera al cobrar o eliminarlo. Las búsquedas
+informan el stock disponible (en bodega menos lo reservado por otros
+carritos), así dos cajas no venden la misma última unidad.
+
+Las reservas viven en memoria del proceso (sin consultas extra al escanear).
+Con varios procesos cada uno ve solo sus reservas; el cobro descuenta el stock
+con un UPDATE condicional, así que nunca queda negativo aunque dos procesos
+vendan a la vez.
+"""
+from flask import current_app
+import threading
+import time
+
+TTL_POR_DEFECTO = 300  # segundos
+INTERVALO_LIMPIEZA = 60  # segundos entre barridos de reservas vencidas
+
+
+def init_app(app):
+    """Registra el almacén de reservas en memoria"""
+    app.extensions['reservas_stock'] = {
+        'lock': threading.Lock(),
+        'por_producto': {},  # producto_id -> {carrito: (cantidad, vence)}
+        'por_carrito': {},  # carrito -> set de producto_id
+        'ultima_limpieza': time.monotonic()
+    }
+
+
+def _estado():
+    return current_app.extensions['reservas_stock']
+
+
+def _limpiar(estado, ahora):
+    """Quita las reservas vencidas (cada INTERVALO_LIMPIEZA segundos)"""
+    if ahora - estado['ultima_limpieza'] < INTERVALO_LIMPIEZA:
+        return
+    estado['ultima_limpieza'] = ahora
+    for producto_id in list(estado['por_producto']):
+        for carrito, (_, vence) in list(estado['por_producto'][producto_id].items()):
+            if vence <= ahora:
+                _quitar(estado, carrito, producto_id)
+
+
+def _quitar(estado, carrito, producto_id):
+    reservas = estado['por_producto'].get(producto_id)
+    if reservas is not None:
+        reservas.pop(carrito, None)
+        if not reservas:
+            del estado['por_producto'][producto_id]
+    productos = estado['por_carrito'].get(carrito)
+    if productos is not None:
+        productos.discard(producto_id)
+        if not productos:
+            del estado['por_carrito'][carrito]
+
+
+def _reservado_por_otros(estado, producto_id, carrito, ahora):
+    return sum(cantidad for otro, (cantidad, vence) in estado['por_producto'].get(producto_id, {}).items()
+               if otro != carrito and vence > ahora)
+
+
+def _poner(estado, carrito, producto_id, cantidad, stock, ahora):
+    """Reserva hasta `cantidad` según lo disponible; retorna (reservado, disponible)"""
+    disponible = max(stock - _reservado_por_otros(estado, producto_id, carrito, ahora), 0)
+    reservado = min(cantidad, disponible)
+    if reservado > 0:
+        ttl = current_app.config.get('RESERVAS_TTL', TTL_POR_DEFECTO)
+        estado['por_producto'].setdefault(producto_id, {})[carrito] = (reservado, ahora + ttl)
+        estado['por_carrito'].setdefault(carrito, set()).add(producto_id)
+    else:
+        _quitar(estado, carrito, producto_id)
+    return reservado, disponible
+
+
+def reservar(carrito, producto_id, cantidad, stock):
+    """
+    Deja reservada para el carrito la cantidad pedida del producto (o la que
+    alcance). Retorna (reservado, disponible), donde disponible es lo que el
+    carrito puede llevar: stock menos lo reservado por otros carritos.
+    """
+    estado = _estado()
+    ahora = time.monotonic()
+    with estado['lock']:
+        _limpiar(estado, ahora)
+        return _poner(estado, carrito, producto_id, cantidad, stock, ahora)
+
+
+def sincronizar_carrito(carrito, cantidades, stocks):
+    """
+    Ajusta las reservas del carrito a `cantidades` ({producto_id: cantidad})
+    y renueva su vencimiento; libera los productos que ya no están.
+    `stocks` es {producto_id: stock}. Retorna {producto_id: (reservado, disponible)}.
+    """
+    estado = _estado()
+    ahora = time.monotonic()
+    resultado = {}
+    with estado['lock']:
+        _limpiar(estado, ahora)
+        for producto_id in estado['por_carrito'].get(carrito, set()) - set(cantidades):
+            _quitar(estado, carrito, producto_id)
+        for producto_id, cantidad in cantidades.items():
+            if producto_id in stocks:
+                resultado[producto_id] = _poner(estado, carrito, producto_id, cantidad, stocks[producto_id], ahora)
+    return resultado
+
+
+def liberar_carrito(carrito):
+    """Libera todas las reservas del carrito (venta cobrada o carrito eliminado)"""
+    estado = _estado()
+    with estado['lock']:
+        for producto_id in list(estado['por_carrito'].get(carrito, ())):
+            _quitar(estado, carrito, producto_id)
+
+
+def reservado_por_otros(producto_ids, carrito=None):
+    """Unidades reservadas por carritos distintos a `carrito`: {producto_id: cantidad}"""
+    estado = _estado()
+    ahora = time.monotonic()
+    with estado['lock']:
+        return {producto_id: _reservado_por_otros(estado, producto_id, carrito, ahora)
+                for producto_id in producto_ids}
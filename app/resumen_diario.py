@@ -0,0 +1,195 @@
+"""
+Resumen diario de ventas (tabla resumen_ventas_diarias).
+
+Cada fila acumula, para un día, usuario, método de pago y producto, las
+unidades vendidas, los ingresos, el costo, y lo devuelto ese día. Las filas
+con producto_id = 0 solo cuentan ventas (num_ventas), de modo que cualquier
+total sale de un SUM sobre el rango sin tocar ventas ni items.
+
+Las ventas y devoluciones actualizan el resumen en su misma transacción
+(registrar_venta / registrar_devolucion). Las devoluciones se acumulan en el
+día en que se hacen, con el usuario y el método de pago de la venta original.
+Para datos anteriores o correcciones:
+
+    flask --app run reconstruir-resumen [--desde 2026-10-01] [--hasta 2026-10-31]
+"""
+from app import db
+from app.models import ResumenVentaDiaria, Venta, ItemVenta, Devolucion, ItemDevolucion
+from sqlalchemy import event, inspect, select, func, literal, union_all
+from datetime import datetime, timedelta
+from decimal import Decimal
+import click
+
+CLAVE = ('fecha', 'usuario_id', 'metodo_pago', 'producto_id')
+VALORES = ('num_ventas', 'unidades', 'ingresos', 'costo', 'unidades_devueltas', 'devoluciones', 'costo_devuelto')
+
+
+def init_app(app):
+    """Registra el comando de consola y el llenado inicial al crear la tabla (db.create_all)"""
+    app.cli.add_command(comando_reconstruir_resumen)
+    if not event.contains(db.metadata, 'after_create', _despues_de_crear_tablas):
+        event.listen(db.metadata, 'after_create', _despues_de_crear_tablas)
+
+
+def _despues_de_crear_tablas(target, connection, tables=(), **kw):
+    # Tabla nueva en una base con historial: llenarla con las ventas existentes.
+    # Si a items_venta aún le faltan columnas, la migración pendiente la llenará.
+    if ResumenVentaDiaria.__table__ in tables and _columnas_al_dia(connection):
+        reconstruir_resumen(connection)
+
+
+def _columnas_al_dia(connection):
+    columnas = {columna['name'] for columna in inspect(connection).get_columns('items_venta')}
+    return 'costo_unitario' in columnas
+
+
+def _fila(fecha, usuario_id, metodo_pago, producto_id, **valores):
+    fila = {'fecha': fecha, 'usuario_id': usuario_id or 0, 'metodo_pago': metodo_pago, 'producto_id': producto_id}
+    for columna in VALORES:
+        fila[columna] = valores.get(columna, 0)
+    return fila
+
+
+def _acumular(filas):
+    """Suma las filas en resumen_ventas_diarias (INSERT ... ON CONFLICT DO UPDATE)"""
+    agrupadas = {}
+    for fila in filas:
+        clave = tuple(fila[columna] for columna in CLAVE)
+        if clave in agrupadas:
+            for columna in VALORES:
+                agrupadas[clave][columna] += fila[columna]
+        else:
+            agrupadas[clave] = dict(fila)
+    if not agrupadas:
+        return
+
+    tabla = ResumenVentaDiaria.__table__
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto in ('sqlite', 'postgresql'):
+        if dialecto == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        sentencia = insert(tabla)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=list(CLAVE),
+            set_={columna: tabla.c[columna] + sentencia.excluded[columna] for columna in VALORES}
+        )
+        db.session.execute(sentencia, list(agrupadas.values()))
+        return
+
+    # Otros motores: actualizar y, si la fila no existe, insertarla
+    for fila in agrupadas.values():
+        actualizadas = db.session.execute(
+            tabla.update()
+            .where(*[tabla.c[columna] == fila[columna] for columna in CLAVE])
+            .values({columna: tabla.c[columna] + fila[columna] for columna in VALORES})
+        ).rowcount
+        if not actualizadas:
+            db.session.execute(tabla.insert().values(fila))
+
+
+def registrar_venta(venta, lineas):
+    """Acumula una venta nueva. `lineas` son tuplas (producto_id, cantidad, subtotal, costo_unitario)"""
+    fecha = (venta.fecha_venta or datetime.utcnow()).date()
+    filas = [_fila(fecha, venta.usuario_id, venta.metodo_pago, 0, num_ventas=1)]
+    for producto_id, cantidad, subtotal, costo_unitario in lineas:
+        filas.append(_fila(
+            fecha, venta.usuario_id, venta.metodo_pago, producto_id,
+            unidades=cantidad,
+            ingresos=Decimal(str(subtotal)),
+            costo=Decimal(str(costo_unitario or 0)) * cantidad
+        ))
+    _acumular(filas)
+
+
+def registrar_devolucion(devolucion, venta, lineas):
+    """Acumula una devolución nueva. `lineas` son tuplas (producto_id, cantidad, subtotal, costo_unitario)"""
+    fecha = (devolucion.fecha_devolucion or datetime.utcnow()).date()
+    _acumular([
+        _fila(
+            fecha, venta.usuario_id, venta.metodo_pago, producto_id,
+            unidades_devueltas=cantidad,
+            devoluciones=Decimal(str(subtotal)),
+            costo_devuelto=Decimal(str(costo_unitario or 0)) * cantidad
+        )
+        for producto_id, cantidad, subtotal, costo_unitario in lineas
+    ])
+
+
+def reconstruir_resumen(connection, desde=None, hasta=None):
+    """
+    Recalcula el resumen desde ventas y devoluciones para los días entre desde y
+    hasta (fechas, ambos incluidos; None = sin límite). Es un DELETE y un
+    INSERT ... SELECT agrupado; el costo es el registrado en cada item.
+    """
+    tabla = ResumenVentaDiaria.__table__
+    inicio = datetime.combine(desde, datetime.min.time()) if desde else None
+    fin = datetime.combine(hasta + timedelta(days=1), datetime.min.time()) if hasta else None
+
+    def en_rango(columna):
+        condiciones = []
+        if inicio:
+            condiciones.append(columna >= inicio)
+        if fin:
+            condiciones.append(columna < fin)
+        return condiciones
+
+    cero = literal(0)
+    usuario = func.coalesce(Venta.usuario_id, 0)
+
+    ventas = select(
+        func.date(Venta.fecha_venta).label('fecha'), usuario.label('usuario_id'), Venta.metodo_pago,
+        cero.label('producto_id'), literal(1).label('num_ventas'),
+        cero.label('unidades'), cero.label('ingresos'), cero.label('costo'),
+        cero.label('unidades_devueltas'), cero.label('devoluciones'), cero.label('costo_devuelto')
+    ).where(*en_rango(Venta.fecha_venta))
+
+    items = select(
+        func.date(Venta.fecha_venta), usuario, Venta.metodo_pago,
+        ItemVenta.producto_id, cero,
+        ItemVenta.cantidad, ItemVenta.subtotal, ItemVenta.cantidad * ItemVenta.costo_unitario,
+        cero, cero, cero
+    ).select_from(ItemVenta).join(Venta, ItemVenta.venta_id == Venta.id) \
+        .where(*en_rango(Venta.fecha_venta))
+
+    devoluciones = select(
+        func.date(Devolucion.fecha_devolucion), usuario, Venta.metodo_pago,
+        ItemDevolucion.producto_id, cero,
+        cero, cero, cero,
+        ItemDevolucion.cantidad, ItemDevolucion.subtotal, ItemDevolucion.cantidad * ItemDevolucion.costo_unitario
+    ).select_from(ItemDevolucion).join(Devolucion, ItemDevolucion.devolucion_id == Devolucion.id) \
+        .join(Venta, Devolucion.venta_id == Venta.id) \
+        .where(*en_rango(Devolucion.fecha_devolucion))
+
+    movimientos = union_all(ventas, items, devoluciones).subquery()
+    agrupado = select(
+        *[movimientos.c[columna] for columna in CLAVE],
+        *[func.sum(movimientos.c[columna]) for columna in VALORES]
+    ).group_by(*[movimientos.c[columna] for columna in CLAVE])
+
+    borrar = tabla.delete()
+    if desde:
+        borrar = borrar.where(tabla.c.fecha >= desde)
+    if hasta:
+        borrar = borrar.where(tabla.c.fecha <= hasta)
+    connection.execute(borrar)
+    return connection.execute(tabla.insert().from_select(list(CLAVE) + list(VALORES), agrupado)).rowcount
+
+
+# ========== COMANDO DE CONSOLA ==========
+
+@click.command('reconstruir-resumen')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), help='Primer día a recalcular (AAAA-MM-DD)')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), help='Último día a recalcular, incluido (AAAA-MM-DD)')
+def comando_reconstruir_resumen(desde, hasta):
+    """Recalcula el resumen diario de ventas (todo el historial si no se indican fechas)"""
+    desde = desde.date() if desde else None
+    hasta = hasta.date() if hasta else None
+    try:
+        filas = reconstruir_resumen(db.session.connection(), desde, hasta)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    click.echo(f'✓ Resumen diario reconstruido ({filas} filas)')
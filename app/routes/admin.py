@@ -1,13 +1,17 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, send_file, Response, stream_with_context
 from flask_login import login_required, current_user
 from functools import wraps
-from app import db
-from app.models import Venta, Producto, ItemVenta, Devolucion, ItemDevolucion, Usuario, ConfiguracionNegocio
-from datetime import datetime, timedelta
-from sqlalchemy import func, extract
+from app import db, impresion_tickets, facturas_pdf, exportar_facturas, exportar_datos, resumen_diario, reportes_programados, kardex, alertas_stock
+from app.models import Venta, Producto, ItemVenta, Devolucion, ItemDevolucion, Usuario, ConfiguracionNegocio, ReporteGenerado
+from app.numeracion import siguiente_numero
+from app.idempotencia import idempotente
+from app.cache_estadisticas import respuesta_en_cache
+from app.estadisticas import (rango_fechas, resumen_ventas, resumen_empleados, ranking_productos, serie_ventas,
+                              PERIODOS, VENTANAS, ORDENES_RANKING)
+from datetime import datetime
+from sqlalchemy import func, extract, or_, and_
+from sqlalchemy.orm import selectinload, joinedload
 from decimal import Decimal
-import random
-import string
 import os
 from werkzeug.utils import secure_filename
 
@@ -34,234 +38,110 @@ def dashboard():
 
 @bp.route('/api/estadisticas', methods=['GET'])
 @login_required
+@respuesta_en_cache
 def estadisticas():
     # Filtros de fecha y usuario
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
     usuario_id = request.args.get('usuario_id')
     
-    query = Venta.query
+    desde, hasta = rango_fechas(fecha_inicio, fecha_fin)
+    resumen = resumen_ventas(desde, hasta, int(usuario_id) if usuario_id else None)
     
-    if fecha_inicio:
-        fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-        # Asegurar que incluya desde el inicio del día
-        fecha_inicio_dt = fecha_inicio_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        query = query.filter(Venta.fecha_venta >= fecha_inicio_dt)
-    if fecha_fin:
-        fecha_fin_dt = datetime.fromisoformat(fecha_fin)
-        # Ajustar fecha_fin para incluir todo el día (hasta las 23:59:59.999999)
-        fecha_fin_dt = fecha_fin_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-        query = query.filter(Venta.fecha_venta <= fecha_fin_dt)
-    if usuario_id and usuario_id != '':
-        query = query.filter(Venta.usuario_id == int(usuario_id))
-    
-    ventas = query.all()
-    
-    # Obtener IDs de ventas para buscar devoluciones
-    venta_ids = [v.id for v in ventas]
-    
-    # Obtener devoluciones: si hay filtros de fecha, considerar devoluciones por fecha_devolucion
-    # Si no hay filtros, considerar todas las devoluciones de las ventas en el rango
-    if fecha_inicio or fecha_fin:
-        # Si hay filtros de fecha, obtener devoluciones por fecha_devolucion
-        query_devoluciones = Devolucion.query
-        if fecha_inicio:
-            query_devoluciones = query_devoluciones.filter(Devolucion.fecha_devolucion >= datetime.fromisoformat(fecha_inicio))
-        if fecha_fin:
-            # Ajustar fecha_fin para incluir todo el día
-            fecha_fin_ajustada = datetime.fromisoformat(fecha_fin)
-            fecha_fin_ajustada = fecha_fin_ajustada.replace(hour=23, minute=59, second=59, microsecond=999999)
-            query_devoluciones = query_devoluciones.filter(Devolucion.fecha_devolucion <= fecha_fin_ajustada)
-        # Solo considerar devoluciones de ventas que están en el rango (para mantener consistencia)
-        if venta_ids:
-            query_devoluciones = query_devoluciones.filter(Devolucion.venta_id.in_(venta_ids))
-        devoluciones = query_devoluciones.all()
-    else:
-        # Sin filtros de fecha: obtener todas las devoluciones de estas ventas
-        devoluciones = Devolucion.query.filter(Devolucion.venta_id.in_(venta_ids)).all() if venta_ids else []
-    
-    # Calcular estadísticas
-    total_ventas = len(ventas)
-    total_ingresos = sum(float(v.total) for v in ventas)
-    
-    # Restar los ingresos devueltos
-    total_devoluciones = sum(float(d.total_devolucion) for d in devoluciones)
-    total_ingresos -= total_devoluciones
-    
-    total_ganancias = sum(v.calcular_ganancia_total() for v in ventas)
-    
-    # Restar las ganancias perdidas por devoluciones
-    ganancias_perdidas = sum(d.calcular_ganancia_perdida_total() for d in devoluciones)
-    total_ganancias -= ganancias_perdidas
-    
-    # Ventas por método de pago
-    pagos = {}
-    for venta in ventas:
-        metodo = venta.metodo_pago
-        pagos[metodo] = pagos.get(metodo, 0) + float(venta.total)
-    
-    # Productos más vendidos
-    items_query = db.session.query(
-        ItemVenta.producto_id,
-        func.sum(ItemVenta.cantidad).label('total_vendido')
-    ).join(Venta)
-    
-    if fecha_inicio:
-        fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-        fecha_inicio_dt = fecha_inicio_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        items_query = items_query.filter(Venta.fecha_venta >= fecha_inicio_dt)
-    if fecha_fin:
-        fecha_fin_dt = datetime.fromisoformat(fecha_fin)
-        fecha_fin_dt = fecha_fin_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-        items_query = items_query.filter(Venta.fecha_venta <= fecha_fin_dt)
-    
-    productos_vendidos = items_query.group_by(ItemVenta.producto_id).order_by(
-        func.sum(ItemVenta.cantidad).desc()
-    ).limit(10).all()
-    
-    productos_top = []
-    for producto_id, cantidad in productos_vendidos:
-        producto = Producto.query.get(producto_id)
-        if producto:
-            productos_top.append({
-                'nombre': producto.nombre,
-                'cantidad': int(cantidad)
-            })
+    # Productos más vendidos (unidades netas de devoluciones)
+    productos_top = ranking_productos(desde, hasta, int(usuario_id) if usuario_id else None)
     
     # Ventas por día (últimos 7 días) - descontando devoluciones
-    # Incluir desde hace 6 días hasta hoy (7 días en total)
-    ultimos_7_dias = []
-    # Usar UTC para ser consistente con cómo se guardan las fechas
-    hoy_utc = datetime.utcnow()
-    for i in range(6, -1, -1):
-        fecha = hoy_utc - timedelta(days=i)
-        fecha_solo = fecha.date()
-        fecha_inicio_dia = datetime.combine(fecha_solo, datetime.min.time())
-        fecha_fin_dia = datetime.combine(fecha_solo, datetime.max.time())
-        
-        # Usar func.date para comparar solo la fecha, sin importar la hora o zona horaria
-        ventas_dia = Venta.query.filter(
-            func.date(Venta.fecha_venta) == fecha_solo
-        ).all()
-        
-        # Calcular total de ventas del día
-        total_dia = sum(float(v.total) for v in ventas_dia)
-        
-        # Obtener IDs de ventas del día para buscar devoluciones
-        venta_ids_dia = [v.id for v in ventas_dia]
-        
-        # Obtener devoluciones de estas ventas que fueron hechas en este día
-        devoluciones_dia = Devolucion.query.filter(
-            Devolucion.venta_id.in_(venta_ids_dia),
-            func.date(Devolucion.fecha_devolucion) == fecha_solo
-        ).all() if venta_ids_dia else []
-        
-        # Descontar devoluciones del total del día
-        total_devoluciones_dia = sum(float(d.total_devolucion) for d in devoluciones_dia)
-        total_dia -= total_devoluciones_dia
-        
-        ultimos_7_dias.append({
-            'fecha': fecha_solo.strftime('%Y-%m-%d'),
-            'total': total_dia
-        })
-    
-    # Productos con stock bajo
-    productos_stock_bajo = Producto.query.filter(
-        Producto.stock <= Producto.stock_minimo,
-        Producto.activo == True
-    ).all()
+    ultimos_7_dias = [
+        {'fecha': punto['fecha'], 'total': punto['total']} for punto in serie_ventas(7, 'dia')
+    ]
     
     # Estadísticas por empleado
-    estadisticas_empleados = []
-    usuarios_con_ventas = db.session.query(
-        Usuario.id,
-        Usuario.username,
-        func.count(Venta.id).label('total_ventas'),
-        func.sum(Venta.total).label('total_ingresos')
-    ).join(Venta, Usuario.id == Venta.usuario_id, isouter=True)
-    
-    if fecha_inicio:
-        fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-        fecha_inicio_dt = fecha_inicio_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        usuarios_con_ventas = usuarios_con_ventas.filter(Venta.fecha_venta >= fecha_inicio_dt)
-    if fecha_fin:
-        fecha_fin_dt = datetime.fromisoformat(fecha_fin)
-        fecha_fin_dt = fecha_fin_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-        usuarios_con_ventas = usuarios_con_ventas.filter(Venta.fecha_venta <= fecha_fin_dt)
-    
-    usuarios_con_ventas = usuarios_con_ventas.group_by(Usuario.id, Usuario.username).all()
-    
-    for usuario_id, username, num_ventas, total_ing in usuarios_con_ventas:
-        if num_ventas > 0:
-            # Calcular ganancias para este usuario
-            ventas_usuario = Venta.query.filter_by(usuario_id=usuario_id)
-            if fecha_inicio:
-                fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-                fecha_inicio_dt = fecha_inicio_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-                ventas_usuario = ventas_usuario.filter(Venta.fecha_venta >= fecha_inicio_dt)
-            if fecha_fin:
-                fecha_fin_dt = datetime.fromisoformat(fecha_fin)
-                fecha_fin_dt = fecha_fin_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-                ventas_usuario = ventas_usuario.filter(Venta.fecha_venta <= fecha_fin_dt)
-            
-            ventas_usuario_list = ventas_usuario.all()
-            venta_ids_usuario = [v.id for v in ventas_usuario_list]
-            
-            # Obtener devoluciones de las ventas de este usuario
-            # Si hay filtros de fecha, considerar devoluciones por fecha_devolucion
-            if fecha_inicio or fecha_fin:
-                query_devoluciones_usuario = Devolucion.query
-                if fecha_inicio:
-                    query_devoluciones_usuario = query_devoluciones_usuario.filter(Devolucion.fecha_devolucion >= datetime.fromisoformat(fecha_inicio))
-                if fecha_fin:
-                    fecha_fin_ajustada = datetime.fromisoformat(fecha_fin)
-                    fecha_fin_ajustada = fecha_fin_ajustada.replace(hour=23, minute=59, second=59, microsecond=999999)
-                    query_devoluciones_usuario = query_devoluciones_usuario.filter(Devolucion.fecha_devolucion <= fecha_fin_ajustada)
-                if venta_ids_usuario:
-                    query_devoluciones_usuario = query_devoluciones_usuario.filter(Devolucion.venta_id.in_(venta_ids_usuario))
-                devoluciones_usuario = query_devoluciones_usuario.all()
-            else:
-                devoluciones_usuario = Devolucion.query.filter(Devolucion.venta_id.in_(venta_ids_usuario)).all() if venta_ids_usuario else []
-            
-            total_ganancias_usuario = sum(v.calcular_ganancia_total() for v in ventas_usuario_list)
-            
-            # Restar las ganancias perdidas por devoluciones
-            ganancias_perdidas_usuario = sum(d.calcular_ganancia_perdida_total() for d in devoluciones_usuario)
-            total_ganancias_usuario -= ganancias_perdidas_usuario
-            
-            # Calcular ingresos netos (descontando devoluciones)
-            total_ingresos_usuario = float(total_ing or 0)
-            total_devoluciones_usuario = sum(float(d.total_devolucion) for d in devoluciones_usuario)
-            total_ingresos_usuario -= total_devoluciones_usuario
-            
-            estadisticas_empleados.append({
-                'usuario_id': usuario_id,
-                'username': username,
-                'total_ventas': int(num_ventas),
-                'total_ingresos': round(total_ingresos_usuario, 2),
-                'total_ganancias': round(total_ganancias_usuario, 2)
-            })
-    
-    # Ordenar por total de ingresos descendente
-    estadisticas_empleados.sort(key=lambda x: x['total_ingresos'], reverse=True)
+    estadisticas_empleados = resumen_empleados(desde, hasta)
     
     # Lista de usuarios para el filtro
     usuarios = Usuario.query.filter_by(activo=True).order_by(Usuario.username).all()
     usuarios_lista = [{'id': u.id, 'username': u.username} for u in usuarios]
     
     return jsonify({
-        'total_ventas': total_ventas,
-        'total_ingresos': round(total_ingresos, 2),
-        'total_ganancias': round(total_ganancias, 2),
-        'pagos_por_metodo': pagos,
+        'total_ventas': resumen['total_ventas'],
+        'total_ingresos': round(resumen['total_ingresos'], 2),
+        'total_ganancias': round(resumen['total_ganancias'], 2),
+        'pagos_por_metodo': resumen['pagos_por_metodo'],
         'productos_mas_vendidos': productos_top,
         'ventas_ultimos_7_dias': ultimos_7_dias,
-        'productos_stock_bajo': [p.to_dict() for p in productos_stock_bajo],
         'estadisticas_empleados': estadisticas_empleados,
         'usuarios': usuarios_lista
     })
 
 
+@bp.route('/api/stock-bajo', methods=['GET'])
+@login_required
+def stock_bajo():
+    """Productos activos con stock bajo"""
+    return jsonify({'productos': alertas_stock.productos_stock_bajo()})
+
+
+@bp.route('/api/stock-bajo/stream', methods=['GET'])
+@login_required
+def stock_bajo_stream():
+    """Server-Sent Events con el estado de stock bajo y sus cambios"""
+    respuesta = Response(stream_with_context(alertas_stock.stream_eventos()), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+
+@bp.route('/api/estadisticas/serie', methods=['GET'])
+@login_required
+@respuesta_en_cache
+def serie_estadisticas():
+    """Ventas netas por día, semana o mes para los últimos 7, 30, 90 o 365 días"""
+    periodo = request.args.get('periodo', 'dia')
+    usuario_id = request.args.get('usuario_id')
+    try:
+        dias = int(request.args.get('dias', 7))
+    except ValueError:
+        return jsonify({'error': 'El número de días no es válido'}), 400
+
+    if dias not in VENTANAS:
+        return jsonify({'error': f'Días no válidos. Opciones: {", ".join(str(v) for v in VENTANAS)}'}), 400
+    if periodo not in PERIODOS:
+        return jsonify({'error': f'Periodo no válido. Opciones: {", ".join(PERIODOS)}'}), 400
+
+    serie = serie_ventas(dias, periodo, int(usuario_id) if usuario_id else None)
+    return jsonify({
+        'periodo': periodo,
+        'dias': dias,
+        'serie': serie,
+        'total': round(sum(punto['total'] for punto in serie), 2)
+    })
+
+
+@bp.route('/api/estadisticas/productos', methods=['GET'])
+@login_required
+@respuesta_en_cache
+def ranking_productos_estadisticas():
+    """Ranking de productos por unidades, ingresos, ganancia o margen, neto de devoluciones"""
+    orden = request.args.get('orden', 'unidades')
+    usuario_id = request.args.get('usuario_id')
+    categoria_id = request.args.get('categoria_id')
+    if orden not in ORDENES_RANKING:
+        return jsonify({'error': f'Orden no válido. Opciones: {", ".join(ORDENES_RANKING)}'}), 400
+    try:
+        limite = min(max(int(request.args.get('limite', 10)), 1), 100)
+        desde, hasta = rango_fechas(request.args.get('fecha_inicio'), request.args.get('fecha_fin'))
+        usuario_id = int(usuario_id) if usuario_id else None
+        categoria_id = int(categoria_id) if categoria_id else None
+    except ValueError:
+        return jsonify({'error': 'Parámetros no válidos'}), 400
+
+    return jsonify({
+        'orden': orden,
+        'productos': ranking_productos(desde, hasta, usuario_id, categoria_id, orden, limite)
+    })
+
+
 @bp.route('/ventas')
 @login_required
 def listar_ventas():
@@ -271,80 +151,276 @@ def listar_ventas():
 @bp.route('/api/ventas', methods=['GET'])
 @login_required
 def api_ventas():
+    """
+    Historial de ventas, de la más reciente a la más antigua, paginado por
+    cursor sobre (fecha_venta, id): cada página cuesta lo mismo sin importar
+    su profundidad. La respuesta trae siguiente_cursor para pedir la próxima.
+    """
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
     usuario_id = request.args.get('usuario_id')
-    pagina = int(request.args.get('pagina', 1))
-    por_pagina = int(request.args.get('por_pagina', 20))
-    
-    query = Venta.query.order_by(Venta.fecha_venta.desc())
-    
-    if fecha_inicio:
-        query = query.filter(Venta.fecha_venta >= datetime.fromisoformat(fecha_inicio))
-    if fecha_fin:
-        query = query.filter(Venta.fecha_venta <= datetime.fromisoformat(fecha_fin))
+    cursor = request.args.get('cursor')
+    try:
+        por_pagina = min(max(int(request.args.get('por_pagina', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'por_pagina no es válido'}), 400
+    
+    query = Venta.query.options(
+        selectinload(Venta.items).joinedload(ItemVenta.producto),
+        joinedload(Venta.usuario)
+    ).order_by(Venta.fecha_venta.desc(), Venta.id.desc())
+    
+    desde, hasta = rango_fechas(fecha_inicio, fecha_fin)
+    if desde:
+        query = query.filter(Venta.fecha_venta >= desde)
+    if hasta:
+        query = query.filter(Venta.fecha_venta <= hasta)
     if usuario_id and usuario_id != '':
         query = query.filter(Venta.usuario_id == int(usuario_id))
     
-    paginacion = query.paginate(page=pagina, per_page=por_pagina, error_out=False)
+    if cursor:
+        # El cursor es "fecha_venta_id" de la última venta de la página anterior
+        try:
+            fecha_cursor, id_cursor = cursor.rsplit('_', 1)
+            fecha_cursor, id_cursor = datetime.fromisoformat(fecha_cursor), int(id_cursor)
+        except ValueError:
+            return jsonify({'error': 'Cursor no válido'}), 400
+        query = query.filter(or_(
+            Venta.fecha_venta < fecha_cursor,
+            and_(Venta.fecha_venta == fecha_cursor, Venta.id < id_cursor)
+        ))
+    
+    # Una venta de más para saber si hay otra página
+    ventas = query.limit(por_pagina + 1).all()
+    hay_mas = len(ventas) > por_pagina
+    ventas = ventas[:por_pagina]
+    
+    # Devoluciones de toda la página en una consulta agrupada
+    devoluciones = {
+        venta_id: (int(cantidad), float(total))
+        for venta_id, cantidad, total in db.session.query(
+            Devolucion.venta_id,
+            func.count(Devolucion.id),
+            func.coalesce(func.sum(Devolucion.total_devolucion), 0)
+        ).filter(Devolucion.venta_id.in_([venta.id for venta in ventas])).group_by(Devolucion.venta_id)
+    } if ventas else {}
     
-    # Agregar información de devoluciones a cada venta
     ventas_con_devoluciones = []
-    for venta in paginacion.items:
+    for venta in ventas:
         venta_dict = venta.to_dict()
-        devoluciones = Devolucion.query.filter_by(venta_id=venta.id).all()
-        total_devuelto = sum(float(d.total_devolucion) for d in devoluciones)
-        venta_dict['tiene_devoluciones'] = len(devoluciones) > 0
+        cantidad_devoluciones, total_devuelto = devoluciones.get(venta.id, (0, 0.0))
+        venta_dict['tiene_devoluciones'] = cantidad_devoluciones > 0
         venta_dict['total_devuelto'] = total_devuelto
-        venta_dict['cantidad_devoluciones'] = len(devoluciones)
+        venta_dict['cantidad_devoluciones'] = cantidad_devoluciones
         ventas_con_devoluciones.append(venta_dict)
     
+    siguiente_cursor = None
+    if hay_mas:
+        siguiente_cursor = f'{ventas[-1].fecha_venta.isoformat()}_{ventas[-1].id}'
+    
     return jsonify({
         'ventas': ventas_con_devoluciones,
-        'total': paginacion.total,
-        'paginas': paginacion.pages,
-        'pagina_actual': pagina
+        'siguiente_cursor': siguiente_cursor,
+        'hay_mas': hay_mas
     })
 
 
+@bp.route('/api/facturas/exportar', methods=['POST'])
+@login_required
+def iniciar_exportacion_facturas():
+    """
+    Iniciar la exportación de las facturas de un rango de fechas: ZIP o PDF
+    combinado (este último hasta exportar_facturas.MAX_FACTURAS_PDF_COMBINADO facturas)
+    """
+    try:
+        data = request.get_json() or {}
+        if not data.get('fecha_inicio') or not data.get('fecha_fin'):
+            return jsonify({'error': 'Fecha inicio y fecha fin son requeridas'}), 400
+
+        desde = datetime.fromisoformat(data['fecha_inicio']).date()
+        hasta = datetime.fromisoformat(data['fecha_fin']).date()
+        if hasta < desde:
+            return jsonify({'error': 'La fecha fin debe ser posterior a la fecha inicio'}), 400
+
+        formato = data.get('formato', 'zip')
+        if formato not in exportar_facturas.FORMATOS:
+            return jsonify({'error': 'Formato no válido (zip o pdf)'}), 400
+
+        usuario_id = int(data['usuario_id']) if data.get('usuario_id') else None
+        trabajo = exportar_facturas.iniciar_exportacion(desde, hasta, usuario_id,
+                                                        data.get('metodo_pago') or None, formato)
+        if not trabajo:
+            return jsonify({'error': 'No hay ventas en el rango seleccionado'}), 400
+
+        return jsonify({
+            'success': True,
+            'trabajo_id': trabajo['id'],
+            'total': trabajo['total'],
+            'estado': trabajo['estado']
+        }), 202
+
+    except ValueError as e:
+        return jsonify({'error': f'Datos inválidos: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/api/facturas/exportar/<trabajo_id>')
+@login_required
+def estado_exportacion_facturas(trabajo_id):
+    """Consultar el avance de una exportación de facturas"""
+    trabajo = exportar_facturas.obtener_exportacion(trabajo_id)
+    if not trabajo:
+        return jsonify({'error': 'Exportación no encontrada'}), 404
+
+    return jsonify({
+        'trabajo_id': trabajo['id'],
+        'estado': trabajo['estado'],
+        'total': trabajo['total'],
+        'procesadas': trabajo['procesadas'],
+        'error': trabajo['error'],
+        'url_descarga': url_for('admin.descargar_exportacion_facturas', trabajo_id=trabajo['id'])
+        if trabajo['estado'] == exportar_facturas.COMPLETADO else None
+    })
+
+
+@bp.route('/facturas/exportar/<trabajo_id>/descargar')
+@login_required
+def descargar_exportacion_facturas(trabajo_id):
+    """Descargar el archivo de una exportación terminada"""
+    trabajo = exportar_facturas.obtener_exportacion(trabajo_id)
+    if not trabajo or trabajo['estado'] != exportar_facturas.COMPLETADO or not os.path.exists(trabajo['ruta']):
+        return jsonify({'error': 'Exportación no disponible'}), 404
+
+    mimetype = 'application/zip' if trabajo['formato'] == 'zip' else 'application/pdf'
+    return send_file(trabajo['ruta'], mimetype=mimetype, as_attachment=True,
+                     download_name=trabajo['nombre_archivo'])
+
+
+@bp.route('/exportar/<tipo>', methods=['GET'])
+@login_required
+def exportar_datos_rango(tipo):
+    """Descargar ventas, items, devoluciones o compras del rango en CSV o XLSX (se genera mientras se envía)"""
+    formato = request.args.get('formato', 'csv')
+    if tipo not in exportar_datos.TIPOS:
+        return jsonify({'error': f'Tipo no válido. Opciones: {", ".join(exportar_datos.TIPOS)}'}), 400
+    if formato not in exportar_datos.FORMATOS:
+        return jsonify({'error': 'Formato no válido. Opciones: csv, xlsx'}), 400
+
+    fecha_inicio = request.args.get('fecha_inicio')
+    fecha_fin = request.args.get('fecha_fin')
+    try:
+        desde, hasta = rango_fechas(fecha_inicio, fecha_fin)
+    except ValueError:
+        return jsonify({'error': 'Fecha no válida'}), 400
+
+    nombre = tipo
+    if fecha_inicio or fecha_fin:
+        nombre += f'_{fecha_inicio or "inicio"}_{fecha_fin or "hoy"}'
+    respuesta = Response(
+        stream_with_context(exportar_datos.generar_archivo(tipo, formato, desde, hasta)),
+        mimetype=exportar_datos.MIMETYPES[formato]
+    )
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    # Que los proxies no acumulen la respuesta antes de enviarla
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+
+@bp.route('/api/reportes', methods=['GET'])
+@login_required
+def listar_reportes():
+    """Reportes disponibles con su último guardado (sin los datos)"""
+    reportes = []
+    for nombre in reportes_programados.REPORTES:
+        ultimo = ReporteGenerado.query.filter_by(nombre=nombre) \
+            .order_by(ReporteGenerado.fecha_inicio.desc(), ReporteGenerado.id.desc()).first()
+        completado = reportes_programados.ultimo_reporte(nombre)
+        reportes.append({
+            'nombre': nombre,
+            'programado': nombre in reportes_programados.reportes_configurados(),
+            'ultimo': ultimo.to_dict() if ultimo else None,
+            'ultimo_completado': completado.to_dict() if completado else None
+        })
+    return jsonify({'reportes': reportes})
+
+
+@bp.route('/api/reportes/<nombre>', methods=['GET'])
+@login_required
+def obtener_reporte(nombre):
+    """
+    Último reporte programado completado (o el generado en ?fecha=AAAA-MM-DD)
+    con sus datos; con ?manual=1, el último generado a pedido.
+    """
+    if nombre not in reportes_programados.REPORTES:
+        return jsonify({'error': 'Reporte no válido'}), 404
+
+    fecha = request.args.get('fecha')
+    if fecha:
+        try:
+            fecha = datetime.strptime(fecha, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Fecha no válida'}), 400
+        reporte = ReporteGenerado.query.filter_by(
+            nombre=nombre, fecha_programada=fecha, estado=reportes_programados.COMPLETADO).first()
+    else:
+        reporte = reportes_programados.ultimo_reporte(nombre, manual=request.args.get('manual') == '1')
+
+    if not reporte:
+        return jsonify({'error': 'El reporte aún no se ha generado'}), 404
+    return jsonify(reporte.to_dict(con_datos=True))
+
+
+@bp.route('/api/reportes/<nombre>/generar', methods=['POST'])
+@admin_required
+def generar_reporte_ahora(nombre):
+    """Generar un reporte ahora en segundo plano (se guarda aparte de los programados)"""
+    if nombre not in reportes_programados.REPORTES:
+        return jsonify({'error': 'Reporte no válido'}), 404
+
+    data = request.get_json(silent=True) or {}
+    desde = hasta = None
+    if data.get('desde') or data.get('hasta'):
+        try:
+            desde = datetime.strptime(data['desde'], '%Y-%m-%d').date()
+            hasta = datetime.strptime(data['hasta'], '%Y-%m-%d').date()
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Indica desde y hasta como AAAA-MM-DD'}), 400
+        if desde > hasta:
+            return jsonify({'error': 'desde debe ser anterior a hasta'}), 400
+
+    reportes_programados.generar_en_segundo_plano(nombre, desde, hasta)
+    return jsonify({'success': True, 'message': f'Generando el reporte {nombre}'}), 202
+
+
 def generar_numero_devolucion():
-    fecha = datetime.now().strftime('%Y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f'DEV-{fecha}-{random_str}'
+    return siguiente_numero('DEV')
 
 
 @bp.route('/api/venta/<int:venta_id>', methods=['GET'])
 @login_required
 def obtener_venta(venta_id):
-    venta = Venta.query.get_or_404(venta_id)
-    
-    # Verificar si ya tiene devoluciones
-    devoluciones = Devolucion.query.filter_by(venta_id=venta_id).all()
-    total_devuelto = sum(float(d.total_devolucion) for d in devoluciones)
-    
-    # Calcular cantidades ya devueltas por item
-    items_devueltos = {}
-    for devolucion in devoluciones:
-        for item_dev in devolucion.items:
-            item_venta_id = item_dev.item_venta_id
-            if item_venta_id not in items_devueltos:
-                items_devueltos[item_venta_id] = 0
-            items_devueltos[item_venta_id] += item_dev.cantidad
+    venta = Venta.query.options(
+        joinedload(Venta.usuario),
+        joinedload(Venta.items).joinedload(ItemVenta.producto)
+    ).filter(Venta.id == venta_id).first_or_404()
     
-    # Agregar información de devoluciones a los items
+    # Cantidades ya devueltas por item (cada devolución cobra precio_unitario * cantidad)
     venta_dict = venta.to_dict()
+    total_devuelto = 0.0
     for item in venta_dict['items']:
-        item['cantidad_devuelta'] = items_devueltos.get(item['id'], 0)
         item['cantidad_disponible'] = item['cantidad'] - item['cantidad_devuelta']
+        total_devuelto += item['precio_unitario'] * item['cantidad_devuelta']
     
-    venta_dict['total_devuelto'] = total_devuelto
-    venta_dict['total_disponible'] = float(venta.total) - total_devuelto
+    venta_dict['total_devuelto'] = round(total_devuelto, 2)
+    venta_dict['total_disponible'] = round(float(venta.total) - total_devuelto, 2)
     
     return jsonify(venta_dict)
 
 
 @bp.route('/api/devolucion', methods=['POST'])
 @login_required
+@idempotente
 def procesar_devolucion():
     try:
         data = request.get_json()
@@ -358,17 +434,11 @@ def procesar_devolucion():
         if not items:
             return jsonify({'error': 'No hay items para devolver'}), 400
         
-        venta = Venta.query.get_or_404(venta_id)
-        
-        # Verificar que no se devuelva más de lo disponible
-        devoluciones_existentes = Devolucion.query.filter_by(venta_id=venta_id).all()
-        items_devueltos = {}
-        for devolucion in devoluciones_existentes:
-            for item_dev in devolucion.items:
-                item_venta_id = item_dev.item_venta_id
-                if item_venta_id not in items_devueltos:
-                    items_devueltos[item_venta_id] = 0
-                items_devueltos[item_venta_id] += item_dev.cantidad
+        # La venta con sus items y productos en una sola consulta
+        venta = Venta.query.options(
+            joinedload(Venta.items).joinedload(ItemVenta.producto)
+        ).filter(Venta.id == venta_id).first_or_404()
+        items_venta = {item.id: item for item in venta.items}
         
         total_devolucion = Decimal('0.00')
         numero_devolucion = generar_numero_devolucion()
@@ -384,26 +454,33 @@ def procesar_devolucion():
         db.session.flush()
         
         # Crear items de devolución
+        lineas_resumen = []
         for item_data in items:
             item_venta_id = item_data['item_venta_id']
             cantidad_devolver = int(item_data['cantidad'])
             
-            item_venta = ItemVenta.query.get(item_venta_id)
+            item_venta = items_venta.get(item_venta_id)
             if not item_venta:
                 continue
             
-            # Verificar cantidad disponible
-            cantidad_ya_devuelta = items_devueltos.get(item_venta_id, 0)
-            cantidad_disponible = item_venta.cantidad - cantidad_ya_devuelta
+            if cantidad_devolver <= 0:
+                db.session.rollback()
+                return jsonify({'error': 'La cantidad a devolver debe ser mayor a 0'}), 400
             
-            if cantidad_devolver > cantidad_disponible:
+            # Sumar lo devuelto solo si no supera lo vendido; la condición en el
+            # UPDATE evita que dos devoluciones simultáneas devuelvan de más
+            actualizados = ItemVenta.query.filter(
+                ItemVenta.id == item_venta_id,
+                ItemVenta.cantidad_devuelta + cantidad_devolver <= ItemVenta.cantidad
+            ).update({ItemVenta.cantidad_devuelta: ItemVenta.cantidad_devuelta + cantidad_devolver},
+                     synchronize_session=False)
+            if not actualizados:
                 db.session.rollback()
                 return jsonify({'error': f'Cantidad a devolver mayor a la disponible para {item_venta.producto.nombre}'}), 400
             
-            # Restaurar stock
-            producto = Producto.query.get(item_venta.producto_id)
-            if producto:
-                producto.stock += cantidad_devolver
+            # Restaurar stock (UPDATE stock = stock + cantidad)
+            if item_venta.producto:
+                item_venta.producto.stock = Producto.stock + cantidad_devolver
             
             # Calcular subtotal
             subtotal = item_venta.precio_unitario * cantidad_devolver
@@ -415,12 +492,19 @@ def procesar_devolucion():
                 producto_id=item_venta.producto_id,
                 cantidad=cantidad_devolver,
                 precio_unitario=item_venta.precio_unitario,
-                subtotal=subtotal
+                subtotal=subtotal,
+                costo_unitario=item_venta.costo_unitario
             )
             db.session.add(item_devolucion)
+            lineas_resumen.append((item_venta.producto_id, cantidad_devolver, subtotal, item_venta.costo_unitario))
         
         devolucion.total_devolucion = total_devolucion
+        resumen_diario.registrar_devolucion(devolucion, venta, lineas_resumen)
+        kardex.registrar_movimientos(kardex.DEVOLUCION, [(linea[0], linea[1]) for linea in lineas_resumen],
+                                     referencia_id=devolucion.id, usuario_id=current_user.id,
+                                     fecha=devolucion.fecha_devolucion)
         db.session.commit()
+        facturas_pdf.invalidar_factura(venta_id)
         
         return jsonify({
             'success': True,
@@ -551,7 +635,8 @@ def configuracion_negocio():
                     # Verificar que sea PNG
                     if not logo_file.filename.lower().endswith('.png'):
                         flash('El logo debe ser un archivo PNG', 'error')
-                        return render_template('admin/configuracion.html', config=config)
+                        return render_template('admin/configuracion.html', config=config,
+                                               impresora=impresion_tickets.impresora_en_cache())
                     
                     # Crear directorio si no existe
                     upload_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads', 'logos')
@@ -563,6 +648,8 @@ def configuracion_negocio():
                             old_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', config.logo_path)
                             if os.path.exists(old_path):
                                 os.remove(old_path)
+                            if os.path.exists(impresion_tickets.ruta_logo_escpos(old_path)):
+                                os.remove(impresion_tickets.ruta_logo_escpos(old_path))
                         except:
                             pass
                     
@@ -571,8 +658,15 @@ def configuracion_negocio():
                     filepath = os.path.join(upload_dir, filename)
                     logo_file.save(filepath)
                     config.logo_path = f'uploads/logos/{filename}'
+
+                    # Convertir el logo a ESC/POS una sola vez para los tickets
+                    try:
+                        impresion_tickets.rasterizar_logo(filepath)
+                    except Exception as e:
+                        print(f"No se pudo preparar el logo para la impresora: {str(e)}")
             
             db.session.commit()
+            facturas_pdf.invalidar_todas()
             flash('Configuración actualizada exitosamente', 'success')
             return redirect(url_for('admin.configuracion_negocio'))
         
@@ -580,7 +674,21 @@ def configuracion_negocio():
             db.session.rollback()
             flash(f'Error al actualizar la configuración: {str(e)}', 'error')
     
-    return render_template('admin/configuracion.html', config=config)
+    return render_template('admin/configuracion.html', config=config,
+                           impresora=impresion_tickets.impresora_en_cache())
+
+
+@bp.route('/configuracion/redetectar-impresora', methods=['POST'])
+@admin_required
+def redetectar_impresora():
+    """Olvidar la impresora guardada y buscarla de nuevo (no espera a que termine)"""
+    trabajo = impresion_tickets.redetectar_impresora()
+    return jsonify({
+        'success': True,
+        'trabajo_id': trabajo['id'],
+        'estado': trabajo['estado'],
+        'posicion': trabajo['posicion']
+    }), 202
 
 
 @bp.route('/uploads/logos/<filename>')
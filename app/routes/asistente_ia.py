@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required
+from app import busqueda_productos
 from app.models import Producto, Categoria
 from sqlalchemy import or_
 import google.generativeai as genai
@@ -86,17 +87,10 @@ def buscar_productos_filtrados(clasificacion):
     # PASO 1: Buscar por palabras clave (más específico)
     palabras_clave = clasificacion.get('palabras_clave', [])
     if palabras_clave:
-        query = Producto.query.filter(Producto.activo == True, Producto.stock > 0)
-        
-        # Crear filtros OR para buscar en nombre o descripción
-        filtros = []
-        for palabra in palabras_clave:
-            filtros.append(Producto.nombre.ilike(f'%{palabra}%'))
-            filtros.append(Producto.descripcion.ilike(f'%{palabra}%'))
-        
-        if filtros:
-            query = query.filter(or_(*filtros))
-            productos = query.limit(20).all()
+        # Cualquiera de las palabras en nombre, descripción o categoría
+        productos = busqueda_productos.buscar_productos(
+            ' '.join(palabras_clave), limite=20, solo_con_stock=True, cualquiera=True
+        )
     
     # PASO 2: Si no encontró nada por palabras clave, buscar por categoría
     if not productos and clasificacion.get('categoria'):
@@ -1,20 +1,17 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import login_required, current_user
-from app import db
+from app import db, indice_productos, busqueda_productos, kardex
 from app.models import Producto, Proveedor, Compra, ItemCompra
+from app.numeracion import siguiente_numero
+from app.idempotencia import idempotente
 from decimal import Decimal
-from datetime import datetime
 from sqlalchemy import func
-import random
-import string
 
 bp = Blueprint('compras', __name__, url_prefix='/compras')
 
 
 def generar_numero_compra():
-    fecha = datetime.now().strftime('%Y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f'COM-{fecha}-{random_str}'
+    return siguiente_numero('COM')
 
 
 @bp.route('/')
@@ -38,16 +35,13 @@ def buscar_producto():
     nombre = request.args.get('nombre', '').strip()
     
     if codigo:
-        producto = Producto.query.filter_by(codigo_barras=codigo, activo=True).first()
+        producto = indice_productos.obtener_producto(codigo)
         if producto:
-            return jsonify(producto.to_dict())
+            return jsonify(producto)
         return jsonify({'error': 'Producto no encontrado'}), 404
     
     if nombre and len(nombre) >= 2:
-        productos = Producto.query.filter(
-            func.lower(Producto.nombre).like(f'%{nombre.lower()}%'),
-            Producto.activo == True
-        ).limit(20).all()
+        productos = busqueda_productos.buscar_productos(nombre, limite=20)
         return jsonify([p.to_dict() for p in productos])
     
     return jsonify({'error': 'Código o nombre requerido'}), 400
@@ -55,6 +49,7 @@ def buscar_producto():
 
 @bp.route('/api/procesar', methods=['POST'])
 @login_required
+@idempotente
 def procesar_compra():
     try:
         data = request.get_json()
@@ -83,6 +78,7 @@ def procesar_compra():
         
         # Crear items de compra y actualizar stock
         total_calculado = Decimal('0.00')
+        incrementos = {}
         for item_data in items:
             producto_id = item_data.get('producto_id')
             cantidad = int(item_data.get('cantidad', 0))
@@ -93,8 +89,7 @@ def procesar_compra():
             if not producto:
                 continue
             
-            # Actualizar stock
-            producto.stock += cantidad
+            incrementos[producto.id] = incrementos.get(producto.id, 0) + cantidad
             
             # Crear item de compra
             item_compra = ItemCompra(
@@ -107,7 +102,14 @@ def procesar_compra():
             db.session.add(item_compra)
             total_calculado += subtotal
         
+        # Actualizar stock en la BD (stock = stock + n), sin pisar ventas concurrentes
+        for producto_id, cantidad in incrementos.items():
+            producto = Producto.query.get(producto_id)
+            producto.stock = Producto.stock + cantidad
+
         compra.total = total_calculado
+        kardex.registrar_movimientos(kardex.COMPRA, list(incrementos.items()), referencia_id=compra.id,
+                                     usuario_id=current_user.id, fecha=compra.fecha_recepcion)
         db.session.commit()
         
         return jsonify({
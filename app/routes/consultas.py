@@ -1,20 +1,18 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import login_required, current_user
 from app import db
-from app.models import Animal, Consulta, Venta, Producto, ItemVenta, ItemConsulta
+from app.models import Animal, Consulta, Venta, Producto, ItemConsulta
+from app.numeracion import siguiente_numero
+from app.registro_ventas import registrar_items_venta, StockInsuficienteError, ProductoNoEncontradoError
 from datetime import datetime
 from decimal import Decimal
 from sqlalchemy import func, or_
-import random
-import string
 
 bp = Blueprint('consultas', __name__, url_prefix='/consultas')
 
 
 def generar_numero_venta():
-    fecha = datetime.now().strftime('%Y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f'VTA-{fecha}-{random_str}'
+    return siguiente_numero('VTA')
 
 
 @bp.route('/')
@@ -234,6 +232,9 @@ def crear_consulta_con_venta():
         
         animal = Animal.query.get_or_404(animal_id)
         
+        # Reservar el número antes de escribir: la numeración usa su propia transacción
+        numero_venta = generar_numero_venta() if items and metodo_pago else None
+        
         # Crear consulta
         consulta = Consulta(
             animal_id=animal.id,
@@ -251,9 +252,6 @@ def crear_consulta_con_venta():
         
         # Si hay items, crear venta
         if items and metodo_pago:
-            numero_venta = generar_numero_venta()
-            total = Decimal('0.00')
-            
             venta = Venta(
                 numero_venta=numero_venta,
                 total=Decimal('0.00'),
@@ -265,33 +263,12 @@ def crear_consulta_con_venta():
             db.session.flush()
             venta_id = venta.id
             
-            # Crear items de venta
-            for item_data in items:
-                producto = Producto.query.get(item_data['producto_id'])
-                if not producto:
-                    continue
-                
-                cantidad = int(item_data['cantidad'])
-                precio_unitario = Decimal(str(item_data['precio_unitario']))
-                subtotal = precio_unitario * cantidad
-                
-                # Verificar stock
-                if producto.stock < cantidad:
-                    db.session.rollback()
-                    return jsonify({'error': f'Stock insuficiente para {producto.nombre}'}), 400
-                
-                # Actualizar stock
-                producto.stock -= cantidad
-                
-                item_venta = ItemVenta(
-                    venta_id=venta.id,
-                    producto_id=producto.id,
-                    cantidad=cantidad,
-                    precio_unitario=precio_unitario,
-                    subtotal=subtotal
-                )
-                db.session.add(item_venta)
-                total += subtotal
+            # Crear items de venta en lote
+            try:
+                total = registrar_items_venta(venta, items)
+            except (StockInsuficienteError, ProductoNoEncontradoError) as e:
+                db.session.rollback()
+                return jsonify({'error': str(e)}), 400
             
             venta.total = total
             consulta.venta_id = venta_id
@@ -374,7 +351,6 @@ def crear_venta_desde_consulta(consulta_id):
             
             # Crear venta
             numero_venta = generar_numero_venta()
-            total = Decimal('0.00')
             
             venta = Venta(
                 numero_venta=numero_venta,
@@ -386,29 +362,17 @@ def crear_venta_desde_consulta(consulta_id):
             db.session.add(venta)
             db.session.flush()
             
-            # Crear items de venta desde los medicamentos de la consulta
-            for item_consulta in consulta.items:
-                producto = Producto.query.get(item_consulta.producto_id)
-                if not producto or producto.stock < item_consulta.cantidad:
-                    db.session.rollback()
-                    flash(f'Stock insuficiente para {producto.nombre if producto else "producto desconocido"}', 'error')
-                    return render_template('consultas/crear_venta_consulta.html', consulta=consulta)
-                
-                precio_unitario = Decimal(str(producto.precio_venta))
-                subtotal = precio_unitario * item_consulta.cantidad
-                
-                # Actualizar stock
-                producto.stock -= item_consulta.cantidad
-                
-                item_venta = ItemVenta(
-                    venta_id=venta.id,
-                    producto_id=producto.id,
-                    cantidad=item_consulta.cantidad,
-                    precio_unitario=precio_unitario,
-                    subtotal=subtotal
-                )
-                db.session.add(item_venta)
-                total += subtotal
+            # Crear items de venta desde los medicamentos de la consulta (al precio actual)
+            items = [
+                {'producto_id': item_consulta.producto_id, 'cantidad': item_consulta.cantidad}
+                for item_consulta in consulta.items
+            ]
+            try:
+                total = registrar_items_venta(venta, items)
+            except (StockInsuficienteError, ProductoNoEncontradoError) as e:
+                db.session.rollback()
+                flash(str(e), 'error')
+                return render_template('consultas/crear_venta_consulta.html', consulta=consulta)
             
             venta.total = total
             consulta.venta_id = venta.id
@@ -1,9 +1,9 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
-from flask_login import login_required
-from app import db
+from flask_login import login_required, current_user
+from app import db, indice_productos, busqueda_productos, kardex, importar_productos
 from app.models import Producto, Categoria
 from decimal import Decimal
-from sqlalchemy import func
+from datetime import datetime, timedelta
 
 bp = Blueprint('productos', __name__, url_prefix='/productos')
 
@@ -50,6 +50,8 @@ def crear():
                 categoria_id=int(categoria_id) if categoria_id and categoria_id != '' else None
             )
             db.session.add(producto)
+            db.session.flush()
+            kardex.registrar_movimientos(kardex.INICIAL, [(producto.id, producto.stock)], usuario_id=current_user.id)
             db.session.commit()
             flash('Producto creado exitosamente', 'success')
             return redirect(url_for('productos.listar'))
@@ -73,6 +75,7 @@ def editar(id):
         try:
             # Guardar el estado anterior para el mensaje
             estaba_inactivo = not producto.activo
+            stock_anterior = producto.stock
             
             categoria_id = request.form.get('categoria_id')
             producto.codigo_barras = request.form.get('codigo_barras')
@@ -88,6 +91,9 @@ def editar(id):
             if estaba_inactivo:
                 producto.activo = True
             
+            # Un cambio manual del stock queda en el kardex como ajuste
+            kardex.registrar_movimientos(kardex.AJUSTE, [(producto.id, producto.stock - stock_anterior)],
+                                         usuario_id=current_user.id)
             db.session.commit()
             
             if estaba_inactivo:
@@ -129,11 +135,11 @@ def buscar_api():
     if not codigo:
         return jsonify({'error': 'Código requerido'}), 400
     
-    producto = Producto.query.filter_by(codigo_barras=codigo, activo=True).first()
+    producto = indice_productos.obtener_producto(codigo)
     if not producto:
         return jsonify({'error': 'Producto no encontrado'}), 404
     
-    return jsonify(producto.to_dict())
+    return jsonify(producto)
 
 
 @bp.route('/api/listar', methods=['GET'])
@@ -151,15 +157,112 @@ def buscar_nombre():
     if not nombre or len(nombre) < 2:
         return jsonify([])
     
-    # Búsqueda por nombre (case insensitive, parcial) - incluye productos sin stock
-    productos = Producto.query.filter(
-        func.lower(Producto.nombre).like(f'%{nombre.lower()}%'),
-        Producto.activo == True
-    ).limit(20).all()
+    # Búsqueda por texto completo - incluye productos sin stock
+    productos = busqueda_productos.buscar_productos(nombre, limite=20)
     
     return jsonify([p.to_dict() for p in productos])
 
 
+@bp.route('/api/importar', methods=['POST'])
+@login_required
+def importar_api():
+    """Iniciar la importación del catálogo desde un archivo CSV o XLSX (campo 'archivo')"""
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        return jsonify({'error': 'Archivo requerido'}), 400
+    
+    try:
+        trabajo = importar_productos.iniciar_importacion(archivo, archivo.filename, current_user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'success': True,
+        'trabajo_id': trabajo['id'],
+        'estado': trabajo['estado']
+    }), 202
+
+
+@bp.route('/api/importar/<trabajo_id>', methods=['GET'])
+@login_required
+def estado_importacion(trabajo_id):
+    """Consultar el avance y el resultado de una importación"""
+    trabajo = importar_productos.obtener_importacion(trabajo_id)
+    if not trabajo:
+        return jsonify({'error': 'Importación no encontrada'}), 404
+    
+    return jsonify({
+        'trabajo_id': trabajo['id'],
+        'estado': trabajo['estado'],
+        'nombre_archivo': trabajo['nombre_archivo'],
+        'resultado': trabajo['resultado'],
+        'error': trabajo['error']
+    })
+
+
+@bp.route('/api/<int:id>/kardex', methods=['GET'])
+@login_required
+def kardex_producto(id):
+    """Movimientos de inventario de un producto con el saldo después de cada uno"""
+    producto = Producto.query.get_or_404(id)
+    try:
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d') if request.args.get('hasta') \
+            else datetime.utcnow()
+        desde = datetime.strptime(request.args['desde'], '%Y-%m-%d') if request.args.get('desde') \
+            else hasta - timedelta(days=30)
+        limite = min(max(int(request.args.get('limite', 100)), 1), 500)
+        cursor = request.args.get('cursor')
+        if cursor:
+            fecha_cursor, id_cursor = cursor.rsplit('_', 1)
+            cursor = (datetime.fromisoformat(fecha_cursor), int(id_cursor))
+    except ValueError:
+        return jsonify({'error': 'Parámetros no válidos'}), 400
+    if request.args.get('hasta'):
+        hasta += timedelta(days=1)  # incluir el día completo
+
+    saldo_inicial, movimientos, hay_mas = kardex.historial_producto(producto.id, desde, hasta, cursor, limite)
+    siguiente_cursor = f"{movimientos[-1]['fecha']}_{movimientos[-1]['id']}" if hay_mas else None
+    return jsonify({
+        'producto_id': producto.id,
+        'stock_actual': producto.stock,
+        'saldo_inicial': saldo_inicial,
+        'movimientos': movimientos,
+        'siguiente_cursor': siguiente_cursor,
+        'hay_mas': hay_mas
+    })
+
+
+@bp.route('/api/stock-en-fecha', methods=['GET'])
+@login_required
+def stock_en_fecha():
+    """Stock al cierre de un día (UTC) de un producto (?producto_id=) o de todos los activos"""
+    try:
+        fecha = datetime.strptime(request.args.get('fecha', ''), '%Y-%m-%d')
+        producto_id = int(request.args['producto_id']) if request.args.get('producto_id') else None
+    except ValueError:
+        return jsonify({'error': 'Indica fecha como AAAA-MM-DD'}), 400
+
+    momento = fecha + timedelta(days=1)
+    if producto_id:
+        producto = Producto.query.get_or_404(producto_id)
+        productos = [producto]
+        stock = kardex.stock_en(momento, [producto_id])
+    else:
+        productos = Producto.query.filter_by(activo=True).order_by(Producto.nombre).all()
+        stock = kardex.stock_en(momento)
+
+    return jsonify({
+        'fecha': fecha.date().isoformat(),
+        'productos': [{
+            'producto_id': p.id,
+            'codigo_barras': p.codigo_barras,
+            'nombre': p.nombre,
+            'stock': stock.get(p.id, 0)
+        } for p in productos]
+    })
+
 @bp.route('/api/recibir-pedido', methods=['POST'])
 @login_required
 def recibir_pedido():
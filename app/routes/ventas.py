@@ -1,40 +1,26 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, make_response
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, make_response, send_file
 from flask_login import login_required, current_user
-from app import db
-from app.models import Producto, Venta, ItemVenta, Categoria, Consulta, Animal, ItemConsulta, ConfiguracionNegocio
+from app import db, indice_productos, busqueda_productos, impresion_tickets, facturas_pdf, reservas_stock
+from app.models import Producto, Venta, Categoria, Consulta, Animal, ItemConsulta, ConfiguracionNegocio
+from app.numeracion import siguiente_numero
+from app.idempotencia import idempotente
+from app.registro_ventas import registrar_items_venta, StockInsuficienteError, ProductoNoEncontradoError
 from decimal import Decimal
-from datetime import datetime
-import random
-import string
-import time
 import google.generativeai as genai
-from sqlalchemy import func, or_
+from sqlalchemy import or_
 import json
 import re
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as ReportLabImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from io import BytesIO
-import os
-
-# Imports opcionales para impresora térmica
-try:
-    import usb.core
-    import usb.util
-    USB_AVAILABLE = True
-except ImportError:
-    USB_AVAILABLE = False
 
 bp = Blueprint('ventas', __name__, url_prefix='/ventas')
 
 
 def generar_numero_venta():
-    fecha = datetime.now().strftime('%Y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f'VTA-{fecha}-{random_str}'
+    return siguiente_numero('VTA')
+
+
+def clave_carrito(carrito_id):
+    """Clave de las reservas de un carrito del punto de venta (por usuario)"""
+    return f'{current_user.id}:{carrito_id}' if carrito_id else None
 
 
 @bp.route('/')
@@ -45,12 +31,14 @@ def nueva_venta():
 
 @bp.route('/procesar', methods=['POST'])
 @login_required
+@idempotente
 def procesar_venta():
     try:
         data = request.get_json()
         items = data.get('items', [])
         metodo_pago = data.get('metodo_pago')
         notas = data.get('notas', '')
+        carrito = clave_carrito(data.get('carrito_id'))
         
         if not items:
             return jsonify({'error': 'No hay items en la venta'}), 400
@@ -60,7 +48,6 @@ def procesar_venta():
         
         # Crear venta
         numero_venta = generar_numero_venta()
-        total = Decimal('0.00')
         
         venta = Venta(
             numero_venta=numero_venta,
@@ -72,36 +59,17 @@ def procesar_venta():
         db.session.add(venta)
         db.session.flush()
         
-        # Crear items de venta
-        for item_data in items:
-            producto = Producto.query.get(item_data['producto_id'])
-            if not producto:
-                continue
-            
-            cantidad = int(item_data['cantidad'])
-            precio_unitario = Decimal(str(item_data['precio_unitario']))
-            subtotal = precio_unitario * cantidad
-            
-            # Verificar stock
-            if producto.stock < cantidad:
-                db.session.rollback()
-                return jsonify({'error': f'Stock insuficiente para {producto.nombre}'}), 400
-            
-            # Actualizar stock
-            producto.stock -= cantidad
-            
-            item_venta = ItemVenta(
-                venta_id=venta.id,
-                producto_id=producto.id,
-                cantidad=cantidad,
-                precio_unitario=precio_unitario,
-                subtotal=subtotal
-            )
-            db.session.add(item_venta)
-            total += subtotal
+        # Crear items de venta (una consulta para productos, un INSERT para items)
+        try:
+            total = registrar_items_venta(venta, items, carrito)
+        except (StockInsuficienteError, ProductoNoEncontradoError) as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
         
         venta.total = total
         db.session.commit()
+        if carrito:
+            reservas_stock.liberar_carrito(carrito)
         
         return jsonify({
             'success': True,
@@ -122,14 +90,23 @@ def buscar_producto():
     if not codigo:
         return jsonify({'error': 'Código requerido'}), 400
     
-    producto = Producto.query.filter_by(codigo_barras=codigo, activo=True).first()
+    producto = indice_productos.obtener_producto(codigo)
     if not producto:
         return jsonify({'error': 'Producto no encontrado'}), 404
     
-    if producto.stock <= 0:
+    # Con carrito: reservar la cantidad que tendrá en el carrito (la ya escaneada + 1)
+    carrito = clave_carrito(request.args.get('carrito'))
+    if carrito:
+        cantidad = request.args.get('cantidad', 1, type=int)
+        producto['reservado'], producto['stock'] = reservas_stock.reservar(
+            carrito, producto['id'], cantidad, producto['stock'])
+    else:
+        producto['stock'] -= reservas_stock.reservado_por_otros([producto['id']])[producto['id']]
+    
+    if producto['stock'] <= 0:
         return jsonify({'error': 'Producto sin stock disponible'}), 400
     
-    return jsonify(producto.to_dict())
+    return jsonify(producto)
 
 
 @bp.route('/api/buscar-producto-nombre', methods=['GET'])
@@ -139,14 +116,61 @@ def buscar_producto_nombre():
     if not nombre or len(nombre) < 2:
         return jsonify([])
     
-    # Búsqueda por nombre (case insensitive, parcial) - compatible con SQLite
-    productos = Producto.query.filter(
-        func.lower(Producto.nombre).like(f'%{nombre.lower()}%'),
-        Producto.activo == True,
-        Producto.stock > 0
-    ).limit(20).all()
+    # Búsqueda por texto completo (nombre, descripción, categoría) ordenada por relevancia
+    productos = busqueda_productos.buscar_productos(nombre, limite=20, solo_con_stock=True)
+    
+    # Stock disponible: en bodega menos lo reservado por otros carritos; los
+    # productos que otro carrito tiene reservados por completo no se ofrecen
+    carrito = clave_carrito(request.args.get('carrito'))
+    reservado = reservas_stock.reservado_por_otros([p.id for p in productos], carrito)
+    resultado = []
+    for p in productos:
+        disponible = p.stock - reservado[p.id]
+        if disponible <= 0:
+            continue
+        datos = p.to_dict()
+        datos['stock'] = disponible
+        resultado.append(datos)
     
-    return jsonify([p.to_dict() for p in productos])
+    return jsonify(resultado)
+
+
+@bp.route('/api/reservas/<carrito_id>', methods=['PUT'])
+@login_required
+def sincronizar_reservas(carrito_id):
+    """Ajusta y renueva las reservas del carrito; retorna el stock disponible de cada producto"""
+    data = request.get_json(silent=True) or {}
+    items = data.get('items', []) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({'error': 'Se requiere una lista de items'}), 400
+    
+    cantidades = {}
+    for item in items:
+        try:
+            producto_id = int(item['producto_id'])
+            cantidad = int(item['cantidad'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Cada item requiere producto_id y cantidad numéricos'}), 400
+        if cantidad <= 0:
+            return jsonify({'error': 'La cantidad debe ser mayor que cero'}), 400
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    
+    stocks = dict(db.session.query(Producto.id, Producto.stock).filter(
+        Producto.id.in_(cantidades), Producto.activo == True
+    ).all()) if cantidades else {}
+    resultado = reservas_stock.sincronizar_carrito(clave_carrito(carrito_id), cantidades, stocks)
+    
+    return jsonify({
+        str(producto_id): {'reservado': reservado, 'disponible': disponible}
+        for producto_id, (reservado, disponible) in resultado.items()
+    })
+
+
+@bp.route('/api/reservas/<carrito_id>', methods=['DELETE'])
+@login_required
+def liberar_reservas(carrito_id):
+    reservas_stock.liberar_carrito(clave_carrito(carrito_id))
+    return jsonify({'success': True})
 
 
 @bp.route('/api/buscar-consulta', methods=['GET'])
@@ -246,17 +270,10 @@ def buscar_productos_filtrados_ventas(clasificacion):
     # PASO 1: Buscar por palabras clave (más específico)
     palabras_clave = clasificacion.get('palabras_clave', [])
     if palabras_clave:
-        query = Producto.query.filter(Producto.activo == True, Producto.stock > 0)
-        
-        # Crear filtros OR para buscar en nombre o descripción
-        filtros = []
-        for palabra in palabras_clave:
-            filtros.append(Producto.nombre.ilike(f'%{palabra}%'))
-            filtros.append(Producto.descripcion.ilike(f'%{palabra}%'))
-        
-        if filtros:
-            query = query.filter(or_(*filtros))
-            productos = query.limit(20).all()
+        # Cualquiera de las palabras en nombre, descripción o categoría
+        productos = busqueda_productos.buscar_productos(
+            ' '.join(palabras_clave), limite=20, solo_con_stock=True, cualquiera=True
+        )
     
     # PASO 2: Si no encontró nada por palabras clave, buscar por categoría
     if not productos and clasificacion.get('categoria'):
@@ -473,543 +490,43 @@ Responde como un veterinario experto, amable y accesible que realmente se preocu
 @bp.route('/pdf/<int:venta_id>')
 @login_required
 def generar_pdf(venta_id):
-    """Generar PDF de factura para una venta"""
+    """Descargar el PDF de factura de una venta (se genera una vez y se guarda en caché)"""
     venta = Venta.query.get_or_404(venta_id)
     config = ConfiguracionNegocio.obtener_configuracion()
-    
-    # Crear buffer para el PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, 
-                            rightMargin=72, leftMargin=72,
-                            topMargin=72, bottomMargin=18)
-    
-    # Contenedor para los elementos del PDF
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Estilos personalizados
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#1e40af'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#1e40af'),
-        spaceAfter=12
-    )
-    
-    # Logo e información de la empresa
-    empresa_data = []
-    
-    # Logo si existe
-    if config and config.logo_path:
-        logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', config.logo_path)
-        if os.path.exists(logo_path):
-            try:
-                logo_img = ReportLabImage(logo_path, width=2*inch, height=1*inch)
-                logo_img.hAlign = 'CENTER'
-                elements.append(logo_img)
-                elements.append(Spacer(1, 0.2*inch))
-            except:
-                pass
-    
-    # Título
-    elements.append(Paragraph("FACTURA DE VENTA", title_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Información de la empresa
-    nombre_negocio = config.nombre_negocio if config and config.nombre_negocio else "VETERINARIA"
-    elements.append(Paragraph(f"<b>{nombre_negocio.upper()}</b>", styles['Heading2']))
-    
-    # Información adicional del negocio
-    info_negocio = []
-    if config:
-        if config.nit:
-            info_negocio.append(f"NIT: {config.nit}")
-        if config.direccion:
-            info_negocio.append(config.direccion)
-        if config.telefono:
-            info_negocio.append(f"Tel: {config.telefono}")
-        if config.correo:
-            info_negocio.append(f"Email: {config.correo}")
-    
-    if info_negocio:
-        for info in info_negocio:
-            elements.append(Paragraph(info, styles['Normal']))
-    
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Información de la venta
-    data_venta = [
-        ['Número de Venta:', venta.numero_venta],
-        ['Fecha:', venta.fecha_venta.strftime('%d/%m/%Y %H:%M')],
-        ['Método de Pago:', venta.metodo_pago.upper()],
-        ['Vendedor:', venta.usuario.username if venta.usuario else 'N/A'],
-    ]
-    
-    # Si la venta viene de una consulta, agregar información del animal
-    consulta = Consulta.query.filter_by(venta_id=venta_id).first()
-    if consulta and consulta.animal:
-        animal = consulta.animal
-        elements.append(Spacer(1, 0.2*inch))
-        elements.append(Paragraph("<b>INFORMACIÓN DEL PACIENTE</b>", heading_style))
-        data_animal = [
-            ['Nombre del Animal:', animal.nombre],
-            ['Especie:', animal.especie],
-            ['Raza:', animal.raza or 'No especificada'],
-            ['Edad:', animal.get_edad_display()],
-            ['Dueño:', animal.nombre_dueno],
-            ['Contacto:', animal.telefono_dueno or 'No registrado'],
-        ]
-        table_animal = Table(data_animal, colWidths=[2.5*inch, 3.5*inch])
-        table_animal.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e5e7eb')),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ]))
-        elements.append(table_animal)
-        elements.append(Spacer(1, 0.2*inch))
-    
-    # Tabla de información de venta
-    table_venta = Table(data_venta, colWidths=[2.5*inch, 3.5*inch])
-    table_venta.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e5e7eb')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-    ]))
-    elements.append(table_venta)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Tabla de productos
-    elements.append(Paragraph("<b>DETALLE DE PRODUCTOS</b>", heading_style))
-    
-    data_productos = [['Producto', 'Cantidad', 'Precio Unit.', 'Subtotal']]
-    for item in venta.items:
-        data_productos.append([
-            item.producto.nombre,
-            str(item.cantidad),
-            f"${item.precio_unitario:,.0f}",
-            f"${item.subtotal:,.0f}"
-        ])
-    
-    # Agregar total
-    data_productos.append(['TOTAL', '', '', f"${venta.total:,.0f}"])
-    
-    table_productos = Table(data_productos, colWidths=[3.5*inch, 1*inch, 1.25*inch, 1.25*inch])
-    table_productos.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-2, -2), colors.white),
-        ('TEXTCOLOR', (0, 1), (-2, -2), colors.black),
-        ('FONTNAME', (0, 1), (-2, -2), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-2, -2), 10),
-        ('GRID', (0, 0), (-1, -2), 1, colors.grey),
-        ('LINEBELOW', (0, -2), (-1, -2), 2, colors.black),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#f3f4f6')),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 12),
-        ('TOPPADDING', (0, -1), (-1, -1), 12),
-        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
-    ]))
-    elements.append(table_productos)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Notas si existen
-    if venta.notas:
-        elements.append(Paragraph("<b>NOTAS:</b>", styles['Heading3']))
-        elements.append(Paragraph(venta.notas, styles['Normal']))
-        elements.append(Spacer(1, 0.2*inch))
-    
-    # Pie de página
-    elements.append(Spacer(1, 0.5*inch))
-    elements.append(Paragraph("Gracias por su compra", styles['Normal']))
-    footer_text = nombre_negocio
-    if config and config.telefono:
-        footer_text += f" | Tel: {config.telefono}"
-    elements.append(Paragraph(footer_text, 
-                             ParagraphStyle('Footer', parent=styles['Normal'], 
-                                           fontSize=8, textColor=colors.grey, 
-                                           alignment=TA_CENTER)))
-    
-    # Construir PDF
-    doc.build(elements)
-    
-    # Obtener el valor del buffer
-    buffer.seek(0)
-    pdf = buffer.getvalue()
-    buffer.close()
-    
-    # Crear respuesta para descarga
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=factura_{venta.numero_venta}.pdf'
-    
-    return response
-
 
-def detectar_impresora_usb():
-    """
-    Detecta la impresora térmica Xprinter XP-58IIT conectada por USB.
-    Retorna el objeto de la impresora o None si no se encuentra.
-    """
-    if not USB_AVAILABLE:
-        return None
-    
-    try:
-        from escpos.printer import Usb
-        
-        # IDs comunes de impresoras Xprinter (pueden variar)
-        # Xprinter XP-58IIT comúnmente usa estos IDs
-        # Puedes agregar más IDs si conoces el de tu impresora específica
-        impresoras_xprinter = [
-            (0x0483, 0x070b),  # Xprinter XP-58IIT detectada (1155, 1803 en decimal)
-            (1155, 1803),       # Xprinter XP-58IIT (IDs en decimal)
-            (0x0483, 0x5743),  # Otra variante Xprinter común
-            (0x04e8, 0x0202),  # Samsung (algunas Xprinter usan este)
-            (0x04b8, 0x0202),  # Epson (compatible ESC/POS)
-            (0x0483, 0x5840),  # Otra variante Xprinter
-        ]
-        
-        # Intentar encontrar la impresora con IDs conocidos
-        for vendor_id, product_id in impresoras_xprinter:
-            # Primero intentar sin especificar endpoints (auto-detección)
-            try:
-                printer = Usb(vendor_id, product_id, timeout=0)
-                # Verificar que la impresora responde (intento silencioso)
-                return printer
-            except Exception as e:
-                # Si falla, intentar con diferentes combinaciones de endpoints
-                endpoints_configs = [
-                    (0x81, 0x03),  # Endpoints comunes
-                    (0x82, 0x01),  # Alternativa 1
-                    (0x83, 0x02),  # Alternativa 2
-                    (0x81, 0x01),  # Alternativa 3
-                    (0x82, 0x03),  # Alternativa 4
-                ]
-                
-                for in_ep, out_ep in endpoints_configs:
-                    try:
-                        printer = Usb(vendor_id, product_id, timeout=0, in_ep=in_ep, out_ep=out_ep)
-                        return printer
-                    except Exception as e:
-                        continue
-        
-        # Si no se encuentra con IDs conocidos, intentar buscar todas las impresoras USB
-        # que sean compatibles con ESC/POS
-        try:
-            if not USB_AVAILABLE:
-                return None
-            devices = usb.core.find(find_all=True)
-            for device in devices:
-                # Primero intentar sin especificar endpoints (auto-detección)
-                try:
-                    printer = Usb(device.idVendor, device.idProduct, timeout=0)
-                    return printer
-                except:
-                    # Si falla, intentar con endpoints comunes
-                    try:
-                        printer = Usb(device.idVendor, device.idProduct, timeout=0, in_ep=0x81, out_ep=0x03)
-                        return printer
-                    except:
-                        continue
-        except Exception:
-            pass
-        
-        return None
-    except ImportError as e:
-        print(f"Error: python-escpos no está instalado: {str(e)}")
-        return None
-    except Exception as e:
-        print(f"Error al detectar impresora: {str(e)}")
-        return None
+    version = facturas_pdf.version_factura(venta, config)
+    etag = f'{venta.id}-{version}'
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    ruta = facturas_pdf.obtener_factura(venta, config, version)
+    response = send_file(ruta, mimetype='application/pdf', as_attachment=True,
+                         download_name=f'factura_{venta.numero_venta}.pdf',
+                         etag=etag, conditional=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @bp.route('/imprimir-ticket/<int:venta_id>')
 @login_required
 def imprimir_ticket(venta_id):
-    """Imprimir ticket de venta en impresora térmica"""
+    """Encolar el ticket de venta para la impresora térmica (no espera a que termine)"""
     try:
         venta = Venta.query.get_or_404(venta_id)
-        
-        # Detectar impresora
-        try:
-            printer = detectar_impresora_usb()
-        except Exception as e:
-            import traceback
-            print(f"Error al detectar impresora: {traceback.format_exc()}")
-            return jsonify({
-                'success': False,
-                'error': f'Error al detectar impresora: {str(e)}'
-            }), 500
-        
-        if not printer:
-            return jsonify({
-                'success': False,
-                'error': 'No se pudo detectar la impresora. Verifica que esté conectada por USB y que tengas los permisos necesarios.'
-            }), 400
-        
-        # Obtener configuración del negocio
         config = ConfiguracionNegocio.obtener_configuracion()
-        nombre_negocio = config.nombre_negocio.upper() if config and config.nombre_negocio else "VETERINARIA"
-        
-        try:
-            # IMPORTANTE: Abrir cajón ANTES de imprimir (como en Eleventa punto de ventas)
-            # Según el manual de programación 58XX Program Manual V6.3:
-            # Comando: ESC p m t1 t2
-            # - m = 0, 1, 48, o 49 (pin del cajón)
-            # - t1 = 0-255 (tiempo ON en unidades de 2ms)
-            # - t2 = 0-255 (tiempo OFF en unidades de 2ms)
-            # - Tiempo ON = t1 × 2ms, Tiempo OFF = t2 × 2ms
-            
-            # IMPORTANTE: Enviar comandos del cajón ANTES de cualquier otra operación
-            # Según el manual ESC/POS (serie 80XX):
-            # Comando: ESC p m t1 t2
-            # - m = 0 (pin 2 del conector de expulsión del cajón)
-            # - t1 = tiempo ON en unidades de 2ms (t1 × 2ms = tiempo ON)
-            # - t2 = tiempo OFF en unidades de 2ms (t2 × 2ms = tiempo OFF)
-            # 
-            # Comando recomendado según manual: ESC p 0 50 50
-            # - t1 = 50 → 50 × 2ms = 100ms ON
-            # - t2 = 50 → 50 × 2ms = 100ms OFF
-            # Secuencia: \x1B\x70\x00\x32\x32
-            
-            # Inicializar impresora primero (importante para algunos modelos)
-            try:
-                if hasattr(printer, 'device') and printer.device:
-                    printer._raw(b'\x1B\x40')  # ESC @ - Inicializar impresora
-                    time.sleep(0.1)
-            except:
-                pass
-            
-            # COMANDO PRINCIPAL según el manual (100ms ON, 100ms OFF)
-            comando_principal = b'\x1B\x70\x00\x32\x32'  # ESC p 0 50 50
-            
-            # COMANDO ALTERNATIVO (32ms ON, 32ms OFF) - para cajones más sensibles
-            comando_alternativo = b'\x1B\x70\x00\x10\x10'  # ESC p 0 16 16
-            
-            # Enviar el comando principal primero (el más común según el manual)
-            try:
-                if hasattr(printer, 'device') and printer.device:
-                    printer._raw(comando_principal)
-                    time.sleep(0.2)  # Pausa para dar tiempo al cajón
-            except Exception as e:
-                print(f"Error al enviar comando principal del cajón: {e}")
-            
-            # Si el principal no funciona, probar el alternativo
-            try:
-                if hasattr(printer, 'device') and printer.device:
-                    printer._raw(comando_alternativo)
-                    time.sleep(0.2)
-            except Exception as e:
-                print(f"Error al enviar comando alternativo del cajón: {e}")
-            
-            # También probar con pin 1 (por si acaso)
-            try:
-                if hasattr(printer, 'device') and printer.device:
-                    printer._raw(b'\x1B\x70\x01\x32\x32')  # ESC p 1 50 50
-                    time.sleep(0.2)
-            except:
-                pass
-            
-            # Probar cashdraw() como respaldo (pin 2 es el estándar según el manual)
-            try:
-                if hasattr(printer, 'device') and printer.device:
-                    printer.cashdraw(2)  # Pin 2 según el manual
-                    time.sleep(0.2)
-            except:
-                pass
-            
-            # Verificar que la conexión siga activa antes de imprimir
-            if not (hasattr(printer, 'device') and printer.device):
-                # Recrear la conexión
-                try:
-                    printer.close()
-                except:
-                    pass
-                printer = detectar_impresora_usb()
-                if not printer:
-                    raise Exception("No se pudo mantener la conexión con la impresora")
-            
-            # Inicializar impresora (reset básico) DESPUÉS de los comandos del cajón
-            try:
-                if hasattr(printer, 'device') and printer.device:
-                    printer._raw(b'\x1B\x40')  # ESC @ - Inicializar impresora
-                    time.sleep(0.05)
-            except:
-                pass
-            
-            # Configurar impresora (centrado, tamaño de fuente)
-            printer.set(align='center', font='a', width=1, height=1)
-            
-            # Logo si existe (para impresoras térmicas)
-            if config and config.logo_path:
-                logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', config.logo_path)
-                if os.path.exists(logo_path):
-                    try:
-                        from PIL import Image as PILImage
-                        # Cargar y redimensionar imagen para impresora térmica (máximo 384px de ancho para 80mm)
-                        img = PILImage.open(logo_path)
-                        # Convertir a escala de grises si es necesario
-                        if img.mode != '1':  # Modo 1 es bitmap (blanco y negro)
-                            img = img.convert('L')  # Escala de grises
-                            # Convertir a bitmap (umbral)
-                            threshold = 128
-                            img = img.point(lambda x: 0 if x < threshold else 255, '1')
-                        
-                        # Redimensionar manteniendo proporción (máximo 384px de ancho)
-                        max_width = 384
-                        if img.width > max_width:
-                            ratio = max_width / img.width
-                            new_height = int(img.height * ratio)
-                            # Usar LANCZOS si está disponible, sino usar NEAREST
-                            try:
-                                img = img.resize((max_width, new_height), PILImage.Resampling.LANCZOS)
-                            except AttributeError:
-                                # Fallback para versiones antiguas de PIL
-                                img = img.resize((max_width, new_height), PILImage.LANCZOS)
-                        
-                        # Imprimir logo centrado
-                        printer.set(align='center')
-                        printer.image(img)
-                        printer.text("\n")
-                    except ImportError:
-                        print("PIL/Pillow no disponible para imprimir logo")
-                    except Exception as e:
-                        print(f"Error al imprimir logo: {str(e)}")
-                        # Continuar sin logo si hay error
-            
-            # Encabezado
-            printer.text("\n")
-            printer.set(align='center', font='b', width=2, height=2)
-            printer.text(f"{nombre_negocio}\n")
-            printer.set(align='center', font='a', width=1, height=1)
-            
-            # Información adicional del negocio
-            if config:
-                if config.nit:
-                    printer.text(f"NIT: {config.nit}\n")
-                if config.direccion:
-                    # Dividir dirección si es muy larga
-                    direccion = config.direccion
-                    if len(direccion) > 32:
-                        palabras = direccion.split()
-                        linea = ""
-                        for palabra in palabras:
-                            if len(linea + palabra) <= 32:
-                                linea += palabra + " "
-                            else:
-                                if linea:
-                                    printer.text(f"{linea.strip()}\n")
-                                linea = palabra + " "
-                        if linea:
-                            printer.text(f"{linea.strip()}\n")
-                    else:
-                        printer.text(f"{direccion}\n")
-                if config.telefono:
-                    printer.text(f"Tel: {config.telefono}\n")
-                if config.correo:
-                    printer.text(f"{config.correo}\n")
-            
-            printer.text("=" * 32 + "\n")
-            printer.text("\n")
-            
-            # Información de la venta
-            printer.set(align='left')
-            printer.text(f"Venta: {venta.numero_venta}\n")
-            printer.text(f"Fecha: {venta.fecha_venta.strftime('%d/%m/%Y %H:%M')}\n")
-            printer.text(f"Vendedor: {venta.usuario.username if venta.usuario else 'N/A'}\n")
-            printer.text(f"Pago: {venta.metodo_pago.upper()}\n")
-            printer.text("-" * 32 + "\n")
-            printer.text("\n")
-            
-            # Productos
-            printer.set(align='center', font='b')
-            printer.text("PRODUCTOS\n")
-            printer.set(align='left', font='a')
-            printer.text("-" * 32 + "\n")
-            
-            for item in venta.items:
-                # Nombre del producto (puede ser largo, ajustar si es necesario)
-                nombre_producto = item.producto.nombre[:28]  # Limitar a 28 caracteres
-                if len(item.producto.nombre) > 28:
-                    nombre_producto += "..."
-                
-                printer.text(f"{nombre_producto}\n")
-                printer.text(f"  {item.cantidad} x ${float(item.precio_unitario):,.0f} = ${float(item.subtotal):,.0f}\n")
-                printer.text("\n")
-            
-            printer.text("=" * 32 + "\n")
-            
-            # Total
-            printer.set(align='right', font='b', width=2, height=2)
-            printer.text(f"TOTAL: ${float(venta.total):,.0f}\n")
-            printer.set(align='left', font='a', width=1, height=1)
-            printer.text("\n")
-            printer.text("=" * 32 + "\n")
-            printer.text("\n")
-            
-            # Pie de página
-            printer.set(align='center')
-            printer.text("Gracias por su compra\n")
-            if config and config.telefono:
-                printer.text(f"{nombre_negocio}\n")
-                printer.text(f"Tel: {config.telefono}\n")
-            printer.text("\n")
-            printer.text("\n")
-            
-            # Cortar el ticket
-            printer.cut()
-            
-            # Cerrar conexión
-            printer.close()
-            
-            return jsonify({
-                'success': True,
-                'message': 'Ticket impreso correctamente'
-            })
-            
-        except Exception as e:
-            try:
-                printer.close()
-            except:
-                pass
-            error_msg = str(e)
-            # Log del error completo para debugging
-            import traceback
-            print(f"Error completo al imprimir ticket: {traceback.format_exc()}")
-            # Mensaje más amigable para errores comunes
-            if 'not found' in error_msg.lower() or 'device not found' in error_msg.lower():
-                error_msg = 'Impresora no encontrada. Verifica que esté conectada y encendida. En Linux, puede necesitar permisos USB (ver INSTRUCCIONES_IMPRESORA.md)'
-            elif 'permission' in error_msg.lower() or 'access denied' in error_msg.lower():
-                error_msg = 'Sin permisos para acceder a la impresora. En Linux, configura reglas udev o ejecuta con sudo (ver INSTRUCCIONES_IMPRESORA.md)'
-            return jsonify({
-                'success': False,
-                'error': f'Error al imprimir: {error_msg}'
-            }), 500
-            
+        trabajo = impresion_tickets.encolar_ticket(venta, config)
+
+        return jsonify({
+            'success': True,
+            'trabajo_id': trabajo['id'],
+            'estado': trabajo['estado'],
+            'posicion': trabajo['posicion'],
+            'message': 'Ticket enviado a la impresora'
+        }), 202
+
     except Exception as e:
         import traceback
         print(f"Error en imprimir_ticket (nivel superior): {traceback.format_exc()}")
@@ -1018,3 +535,21 @@ def imprimir_ticket(venta_id):
             'error': f'Error: {str(e)}'
         }), 500
 
+
+@bp.route('/imprimir-ticket/estado/<trabajo_id>')
+@login_required
+def estado_impresion(trabajo_id):
+    """Consultar el estado de un trabajo de impresión"""
+    trabajo = impresion_tickets.obtener_trabajo(trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Trabajo de impresión no encontrado'}), 404
+
+    return jsonify({
+        'success': trabajo['estado'] != impresion_tickets.ERROR,
+        'trabajo_id': trabajo['id'],
+        'venta_id': trabajo['venta_id'],
+        'estado': trabajo['estado'],
+        'error': trabajo['error'],
+        'dispositivo': trabajo['dispositivo']
+    })
+
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la búsqueda de productos por nombre (type-ahead)
+Crea un catálogo sintético en SQLite (en memoria) y mide el tiempo de
+busqueda_productos.buscar_productos con prefijos de distinta longitud.
+
+Ejecutar: python benchmark_busqueda.py [cantidad_productos]
+"""
+
+import os
+import random
+import sys
+import time
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import insert
+from app import create_app, db, busqueda_productos
+from app.models import Producto, Categoria
+
+PALABRAS = ['antibiotico', 'desparasitante', 'vacuna', 'shampoo', 'collar', 'alimento',
+            'cachorro', 'gato', 'perro', 'adulto', 'tableta', 'jarabe', 'crema', 'spray',
+            'vitamina', 'arena', 'juguete', 'snack', 'pipeta', 'antipulgas']
+BUSQUEDAS = ['an', 'ant', 'antib', 'vacuna gato', 'des perro', 'pip', 'alimento cach', 'zzz']
+REPETICIONES = 50
+OBJETIVO_MS = 10  # promedio máximo aceptable por búsqueda (type-ahead)
+
+
+def preparar_catalogo(cantidad):
+    """Inserta categorías y productos sintéticos en lote"""
+    categorias = ['Medicamentos', 'Alimentos', 'Accesorios', 'Higiene', 'Juguetes']
+    for nombre in categorias:
+        db.session.add(Categoria(nombre=nombre))
+    db.session.flush()
+
+    random.seed(42)
+    filas = []
+    for i in range(cantidad):
+        nombre = ' '.join(random.sample(PALABRAS, 3)).capitalize()
+        filas.append({
+            'codigo_barras': f'BENCH{i:06d}',
+            'nombre': f'{nombre} {i}',
+            'descripcion': ' '.join(random.sample(PALABRAS, 5)),
+            'precio_venta': 1000,
+            'precio_compra': 600,
+            'stock': random.randint(0, 50),
+            'categoria_id': random.randint(1, len(categorias)),
+            'activo': True
+        })
+    db.session.execute(insert(Producto), filas)
+    db.session.commit()
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        print(f"Creando catálogo de {cantidad} productos...")
+        preparar_catalogo(cantidad)
+
+        print("=" * 60)
+        print(f"BENCHMARK DE BÚSQUEDA (motor: {busqueda_productos._motor()})")
+        print("=" * 60)
+        print(f"{'Búsqueda':<18} {'Resultados':>10} {'Promedio (ms)':>15} {'Máximo (ms)':>13}")
+
+        lentas = []
+        for texto in BUSQUEDAS:
+            tiempos = []
+            for _ in range(REPETICIONES):
+                inicio = time.perf_counter()
+                resultados = busqueda_productos.buscar_productos(texto, limite=20, solo_con_stock=True)
+                [p.to_dict() for p in resultados]
+                tiempos.append(time.perf_counter() - inicio)
+                db.session.expunge_all()
+
+            promedio_ms = sum(tiempos) / len(tiempos) * 1000
+            print(f"{texto:<18} {len(resultados):>10} {promedio_ms:>15.2f} {max(tiempos) * 1000:>13.2f}")
+            if promedio_ms > OBJETIVO_MS:
+                lentas.append(texto)
+
+        assert not lentas, f"Búsquedas sobre el objetivo de {OBJETIVO_MS} ms: {', '.join(lentas)}"
+        print(f"✓ Todas las búsquedas por debajo de {OBJETIVO_MS} ms en promedio")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark del proceso de venta (/ventas/procesar)
+Mide latencia y número de consultas SQL para carritos de distinto tamaño.
+Usa una base de datos SQLite en memoria, no toca la base de datos real.
+
+Ejecutar: python benchmark_venta.py
+"""
+
+import os
+import time
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import event
+from app import create_app, db
+from app.models import Usuario, Producto
+
+TAMANOS_CARRITO = [1, 10, 40, 100]
+REPETICIONES = 20
+
+
+def preparar_datos():
+    """Crea un usuario y un catálogo de productos de prueba"""
+    usuario = Usuario(username='benchmark', es_admin=True, activo=True)
+    usuario.set_password('benchmark')
+    db.session.add(usuario)
+    for i in range(max(TAMANOS_CARRITO)):
+        db.session.add(Producto(
+            codigo_barras=f'BENCH{i:05d}',
+            nombre=f'Producto benchmark {i}',
+            precio_venta=1000,
+            precio_compra=600,
+            stock=1000000
+        ))
+    db.session.commit()
+
+
+def main():
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        preparar_datos()
+
+        consultas = {'total': 0}
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def contar_consulta(conn, cursor, statement, parameters, context, executemany):
+            consultas['total'] += 1
+
+        cliente = app.test_client()
+        cliente.post('/auth/login', data={'username': 'benchmark', 'password': 'benchmark'})
+
+        print("=" * 60)
+        print("BENCHMARK DE PROCESAR VENTA")
+        print("=" * 60)
+        print(f"{'Líneas':>8} {'Consultas SQL':>15} {'Promedio (ms)':>15}")
+
+        for tamano in TAMANOS_CARRITO:
+            items = [
+                {'producto_id': i + 1, 'cantidad': 1, 'precio_unitario': 1000}
+                for i in range(tamano)
+            ]
+            payload = {'items': items, 'metodo_pago': 'efectivo'}
+
+            tiempos = []
+            for _ in range(REPETICIONES):
+                consultas['total'] = 0
+                inicio = time.perf_counter()
+                respuesta = cliente.post('/ventas/procesar', json=payload)
+                tiempos.append(time.perf_counter() - inicio)
+                if respuesta.status_code != 200:
+                    print(f"✗ Error en la venta: {respuesta.get_json()}")
+                    return
+
+            promedio_ms = sum(tiempos) / len(tiempos) * 1000
+            print(f"{tamano:>8} {consultas['total']:>15} {promedio_ms:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
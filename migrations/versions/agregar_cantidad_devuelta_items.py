@@ -0,0 +1,38 @@
+"""Agregar cantidad_devuelta a items_venta (unidades ya devueltas de cada item)
+
+Revision ID: agregar_cantidad_devuelta_items
+Revises: agregar_reportes_generados
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect, text
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_cantidad_devuelta_items'
+down_revision = 'agregar_reportes_generados'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    columnas = [columna['name'] for columna in inspector.get_columns('items_venta')]
+
+    if 'cantidad_devuelta' not in columnas:
+        with op.batch_alter_table('items_venta', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('cantidad_devuelta', sa.Integer(), nullable=False, server_default='0'))
+
+    # Historial: sumar lo devuelto en las devoluciones existentes
+    op.execute(text("""
+        UPDATE items_venta SET cantidad_devuelta = COALESCE(
+            (SELECT SUM(cantidad) FROM items_devolucion WHERE items_devolucion.item_venta_id = items_venta.id), 0)
+    """))
+
+
+def downgrade():
+    with op.batch_alter_table('items_venta', schema=None) as batch_op:
+        batch_op.drop_column('cantidad_devuelta')
@@ -0,0 +1,82 @@
+"""Agregar costo_unitario a items_venta e items_devolucion (costo al momento de la venta)
+
+Revision ID: agregar_costo_unitario_items
+Revises: agregar_indice_ventas_fecha
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect, text
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_costo_unitario_items'
+down_revision = 'agregar_indice_ventas_fecha'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    for tabla in ('items_venta', 'items_devolucion'):
+        columnas = [columna['name'] for columna in inspector.get_columns(tabla)]
+        if 'costo_unitario' not in columnas:
+            with op.batch_alter_table(tabla, schema=None) as batch_op:
+                batch_op.add_column(sa.Column('costo_unitario', sa.Numeric(precision=10, scale=2), nullable=True))
+
+    # Historial: el mejor dato disponible es el precio de compra actual del producto
+    op.execute(text("""
+        UPDATE items_venta SET costo_unitario = COALESCE(
+            (SELECT precio_compra FROM productos WHERE productos.id = items_venta.producto_id), 0)
+        WHERE costo_unitario IS NULL
+    """))
+    # Las devoluciones usan el costo del item de venta que devuelven
+    op.execute(text("""
+        UPDATE items_devolucion SET costo_unitario = COALESCE(
+            (SELECT costo_unitario FROM items_venta WHERE items_venta.id = items_devolucion.item_venta_id), 0)
+        WHERE costo_unitario IS NULL
+    """))
+
+    for tabla in ('items_venta', 'items_devolucion'):
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.alter_column('costo_unitario', existing_type=sa.Numeric(precision=10, scale=2), nullable=False)
+
+    # Recalcular el resumen diario con los costos registrados (también lo llena
+    # si la tabla la creó create_all antes de esta migración, sin historial)
+    if 'resumen_ventas_diarias' in inspector.get_table_names():
+        op.execute(text("DELETE FROM resumen_ventas_diarias"))
+        op.execute(text("""
+            INSERT INTO resumen_ventas_diarias (fecha, usuario_id, metodo_pago, producto_id, num_ventas,
+                unidades, ingresos, costo, unidades_devueltas, devoluciones, costo_devuelto)
+            SELECT fecha, usuario_id, metodo_pago, producto_id, SUM(num_ventas),
+                SUM(unidades), SUM(ingresos), SUM(costo), SUM(unidades_devueltas), SUM(devoluciones), SUM(costo_devuelto)
+            FROM (
+                SELECT DATE(v.fecha_venta) AS fecha, COALESCE(v.usuario_id, 0) AS usuario_id,
+                    v.metodo_pago AS metodo_pago, 0 AS producto_id, 1 AS num_ventas,
+                    0 AS unidades, 0 AS ingresos, 0 AS costo,
+                    0 AS unidades_devueltas, 0 AS devoluciones, 0 AS costo_devuelto
+                FROM ventas v
+                UNION ALL
+                SELECT DATE(v.fecha_venta), COALESCE(v.usuario_id, 0), v.metodo_pago, i.producto_id, 0,
+                    i.cantidad, i.subtotal, i.cantidad * i.costo_unitario, 0, 0, 0
+                FROM items_venta i
+                JOIN ventas v ON i.venta_id = v.id
+                UNION ALL
+                SELECT DATE(d.fecha_devolucion), COALESCE(v.usuario_id, 0), v.metodo_pago, di.producto_id, 0,
+                    0, 0, 0, di.cantidad, di.subtotal, di.cantidad * di.costo_unitario
+                FROM items_devolucion di
+                JOIN devoluciones d ON di.devolucion_id = d.id
+                JOIN ventas v ON d.venta_id = v.id
+            ) movimientos
+            GROUP BY fecha, usuario_id, metodo_pago, producto_id
+        """))
+
+
+def downgrade():
+    with op.batch_alter_table('items_devolucion', schema=None) as batch_op:
+        batch_op.drop_column('costo_unitario')
+    with op.batch_alter_table('items_venta', schema=None) as batch_op:
+        batch_op.drop_column('costo_unitario')
@@ -0,0 +1,89 @@
+"""Agregar índice de búsqueda de productos (FTS5 en SQLite, pg_trgm en PostgreSQL)
+
+Revision ID: agregar_busqueda_productos
+Revises: agregar_secuencias_documento
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_busqueda_productos'
+down_revision = 'agregar_secuencias_documento'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        existe = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'productos_fts'")
+        ).scalar()
+        if existe:
+            return
+        try:
+            op.execute(text("""
+                CREATE VIRTUAL TABLE productos_fts USING fts5(
+                    nombre, descripcion, categoria,
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            """))
+        except Exception as e:
+            # SQLite compilado sin FTS5: la búsqueda usará LIKE
+            print(f"No se pudo crear el índice FTS5 de productos: {e}")
+            return
+        op.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+                INSERT INTO productos_fts(rowid, nombre, descripcion, categoria)
+                VALUES (new.id, new.nombre, COALESCE(new.descripcion, ''),
+                        COALESCE((SELECT nombre FROM categorias WHERE id = new.categoria_id), ''));
+            END
+        """))
+        op.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre, descripcion, categoria_id ON productos BEGIN
+                DELETE FROM productos_fts WHERE rowid = old.id;
+                INSERT INTO productos_fts(rowid, nombre, descripcion, categoria)
+                VALUES (new.id, new.nombre, COALESCE(new.descripcion, ''),
+                        COALESCE((SELECT nombre FROM categorias WHERE id = new.categoria_id), ''));
+            END
+        """))
+        op.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+                DELETE FROM productos_fts WHERE rowid = old.id;
+            END
+        """))
+        op.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS categorias_fts_au AFTER UPDATE OF nombre ON categorias BEGIN
+                UPDATE productos_fts SET categoria = new.nombre
+                WHERE rowid IN (SELECT id FROM productos WHERE categoria_id = new.id);
+            END
+        """))
+        op.execute(text("""
+            INSERT INTO productos_fts(rowid, nombre, descripcion, categoria)
+            SELECT p.id, p.nombre, COALESCE(p.descripcion, ''), COALESCE(c.nombre, '')
+            FROM productos p LEFT JOIN categorias c ON c.id = p.categoria_id
+        """))
+    elif conn.dialect.name == 'postgresql':
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_productos_nombre_trgm ON productos USING gin (nombre gin_trgm_ops)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_productos_descripcion_trgm ON productos USING gin (descripcion gin_trgm_ops)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_categorias_nombre_trgm ON categorias USING gin (nombre gin_trgm_ops)"))
+        except Exception as e:
+            # Sin permisos para la extensión: la búsqueda usará ILIKE
+            print(f"No se pudo crear el índice pg_trgm de productos: {e}")
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        for trigger in ['productos_fts_ai', 'productos_fts_au', 'productos_fts_ad', 'categorias_fts_au']:
+            op.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+        op.execute(text('DROP TABLE IF EXISTS productos_fts'))
+    elif conn.dialect.name == 'postgresql':
+        for indice in ['ix_productos_nombre_trgm', 'ix_productos_descripcion_trgm', 'ix_categorias_nombre_trgm']:
+            op.execute(text(f'DROP INDEX IF EXISTS {indice}'))
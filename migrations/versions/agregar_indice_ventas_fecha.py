@@ -0,0 +1,31 @@
+"""Agregar índice (fecha_venta, id) en ventas para rangos de fechas y paginación por cursor
+
+Revision ID: agregar_indice_ventas_fecha
+Revises: agregar_resumen_ventas_diarias
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_indice_ventas_fecha'
+down_revision = 'agregar_resumen_ventas_diarias'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    indices = [indice['name'] for indice in inspector.get_indexes('ventas')]
+
+    if 'ix_ventas_fecha_venta_id' not in indices:
+        with op.batch_alter_table('ventas', schema=None) as batch_op:
+            batch_op.create_index('ix_ventas_fecha_venta_id', ['fecha_venta', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ventas', schema=None) as batch_op:
+        batch_op.drop_index('ix_ventas_fecha_venta_id')
@@ -0,0 +1,77 @@
+"""Agregar kardex: movimientos_inventario y saldos_inventario
+
+Revision ID: agregar_kardex_inventario
+Revises: agregar_cantidad_devuelta_items
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect, text
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_kardex_inventario'
+down_revision = 'agregar_cantidad_devuelta_items'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'movimientos_inventario' not in tables:
+        op.create_table('movimientos_inventario',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('producto_id', sa.Integer(), nullable=False),
+            sa.Column('fecha', sa.DateTime(), nullable=False),
+            sa.Column('tipo', sa.String(length=20), nullable=False),
+            sa.Column('cantidad', sa.Integer(), nullable=False),
+            sa.Column('referencia_id', sa.Integer(), nullable=True),
+            sa.Column('usuario_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['producto_id'], ['productos.id'], ),
+            sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('movimientos_inventario', schema=None) as batch_op:
+            batch_op.create_index('ix_movimientos_producto_fecha', ['producto_id', 'fecha', 'id'], unique=False)
+            batch_op.create_index('ix_movimientos_fecha', ['fecha'], unique=False)
+
+    if 'saldos_inventario' not in tables:
+        op.create_table('saldos_inventario',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('producto_id', sa.Integer(), nullable=False),
+            sa.Column('fecha', sa.Date(), nullable=False),
+            sa.Column('stock', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['producto_id'], ['productos.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('producto_id', 'fecha', name='uq_saldo_producto_fecha')
+        )
+        with op.batch_alter_table('saldos_inventario', schema=None) as batch_op:
+            batch_op.create_index('ix_saldos_fecha', ['fecha'], unique=False)
+
+    # El kardex empieza con el stock actual de cada producto
+    # (no hace nada si db.create_all ya creó la tabla y la llenó)
+    conn.execute(text("""
+        INSERT INTO movimientos_inventario (producto_id, fecha, tipo, cantidad)
+        SELECT productos.id, :fecha, 'inicial', productos.stock - COALESCE(
+            (SELECT SUM(m.cantidad) FROM movimientos_inventario m WHERE m.producto_id = productos.id), 0)
+        FROM productos
+        WHERE NOT EXISTS (SELECT 1 FROM movimientos_inventario m
+                          WHERE m.producto_id = productos.id AND m.tipo = 'inicial')
+          AND productos.stock - COALESCE(
+            (SELECT SUM(m.cantidad) FROM movimientos_inventario m WHERE m.producto_id = productos.id), 0) <> 0
+    """), {'fecha': datetime.utcnow()})
+
+
+def downgrade():
+    with op.batch_alter_table('saldos_inventario', schema=None) as batch_op:
+        batch_op.drop_index('ix_saldos_fecha')
+    op.drop_table('saldos_inventario')
+    with op.batch_alter_table('movimientos_inventario', schema=None) as batch_op:
+        batch_op.drop_index('ix_movimientos_fecha')
+        batch_op.drop_index('ix_movimientos_producto_fecha')
+    op.drop_table('movimientos_inventario')
@@ -0,0 +1,43 @@
+"""Agregar tabla reportes_generados (resultados de los reportes programados)
+
+Revision ID: agregar_reportes_generados
+Revises: agregar_costo_unitario_items
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_reportes_generados'
+down_revision = 'agregar_costo_unitario_items'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'reportes_generados' not in tables:
+        op.create_table('reportes_generados',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('nombre', sa.String(length=50), nullable=False),
+            sa.Column('fecha_programada', sa.Date(), nullable=False),
+            sa.Column('desde', sa.Date(), nullable=False),
+            sa.Column('hasta', sa.Date(), nullable=False),
+            sa.Column('estado', sa.String(length=20), nullable=False),
+            sa.Column('datos', sa.Text(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('fecha_inicio', sa.DateTime(), nullable=False),
+            sa.Column('fecha_fin', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('nombre', 'fecha_programada', name='uq_reporte_nombre_fecha')
+        )
+
+
+def downgrade():
+    op.drop_table('reportes_generados')
@@ -0,0 +1,74 @@
+"""Agregar tabla resumen_ventas_diarias (acumulado diario de ventas y devoluciones)
+
+Revision ID: agregar_resumen_ventas_diarias
+Revises: agregar_solicitudes_idempotentes
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect, text
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_resumen_ventas_diarias'
+down_revision = 'agregar_solicitudes_idempotentes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'resumen_ventas_diarias' not in tables:
+        op.create_table('resumen_ventas_diarias',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('fecha', sa.Date(), nullable=False),
+            sa.Column('usuario_id', sa.Integer(), nullable=False),
+            sa.Column('metodo_pago', sa.String(length=20), nullable=False),
+            sa.Column('producto_id', sa.Integer(), nullable=False),
+            sa.Column('num_ventas', sa.Integer(), nullable=False),
+            sa.Column('unidades', sa.Integer(), nullable=False),
+            sa.Column('ingresos', sa.Numeric(precision=12, scale=2), nullable=False),
+            sa.Column('costo', sa.Numeric(precision=12, scale=2), nullable=False),
+            sa.Column('unidades_devueltas', sa.Integer(), nullable=False),
+            sa.Column('devoluciones', sa.Numeric(precision=12, scale=2), nullable=False),
+            sa.Column('costo_devuelto', sa.Numeric(precision=12, scale=2), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('fecha', 'usuario_id', 'metodo_pago', 'producto_id', name='uq_resumen_venta_diaria')
+        )
+
+        # Llenar el resumen con el historial existente (costo: precio de compra del producto)
+        op.execute(text("""
+            INSERT INTO resumen_ventas_diarias (fecha, usuario_id, metodo_pago, producto_id, num_ventas,
+                unidades, ingresos, costo, unidades_devueltas, devoluciones, costo_devuelto)
+            SELECT fecha, usuario_id, metodo_pago, producto_id, SUM(num_ventas),
+                SUM(unidades), SUM(ingresos), SUM(costo), SUM(unidades_devueltas), SUM(devoluciones), SUM(costo_devuelto)
+            FROM (
+                SELECT DATE(v.fecha_venta) AS fecha, COALESCE(v.usuario_id, 0) AS usuario_id,
+                    v.metodo_pago AS metodo_pago, 0 AS producto_id, 1 AS num_ventas,
+                    0 AS unidades, 0 AS ingresos, 0 AS costo,
+                    0 AS unidades_devueltas, 0 AS devoluciones, 0 AS costo_devuelto
+                FROM ventas v
+                UNION ALL
+                SELECT DATE(v.fecha_venta), COALESCE(v.usuario_id, 0), v.metodo_pago, i.producto_id, 0,
+                    i.cantidad, i.subtotal, i.cantidad * COALESCE(p.precio_compra, 0), 0, 0, 0
+                FROM items_venta i
+                JOIN ventas v ON i.venta_id = v.id
+                LEFT JOIN productos p ON i.producto_id = p.id
+                UNION ALL
+                SELECT DATE(d.fecha_devolucion), COALESCE(v.usuario_id, 0), v.metodo_pago, di.producto_id, 0,
+                    0, 0, 0, di.cantidad, di.subtotal, di.cantidad * COALESCE(p.precio_compra, 0)
+                FROM items_devolucion di
+                JOIN devoluciones d ON di.devolucion_id = d.id
+                JOIN ventas v ON d.venta_id = v.id
+                LEFT JOIN productos p ON di.producto_id = p.id
+            ) movimientos
+            GROUP BY fecha, usuario_id, metodo_pago, producto_id
+        """))
+
+
+def downgrade():
+    op.drop_table('resumen_ventas_diarias')
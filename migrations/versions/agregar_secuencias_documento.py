@@ -0,0 +1,35 @@
+"""Agregar tabla secuencias_documento para numeración secuencial
+
+Revision ID: agregar_secuencias_documento
+Revises: 0108cc977548
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_secuencias_documento'
+down_revision = '0108cc977548'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'secuencias_documento' not in tables:
+        op.create_table('secuencias_documento',
+            sa.Column('prefijo', sa.String(length=10), nullable=False),
+            sa.Column('fecha', sa.String(length=8), nullable=False),
+            sa.Column('ultimo_numero', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('prefijo', 'fecha')
+        )
+
+
+def downgrade():
+    op.drop_table('secuencias_documento')
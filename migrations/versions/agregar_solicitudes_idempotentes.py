@@ -0,0 +1,45 @@
+"""Agregar tabla solicitudes_idempotentes para reintentos de ventas, compras y devoluciones
+
+Revision ID: agregar_solicitudes_idempotentes
+Revises: agregar_busqueda_productos
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_solicitudes_idempotentes'
+down_revision = 'agregar_busqueda_productos'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'solicitudes_idempotentes' not in tables:
+        op.create_table('solicitudes_idempotentes',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('endpoint', sa.String(length=100), nullable=False),
+            sa.Column('clave', sa.String(length=100), nullable=False),
+            sa.Column('usuario_id', sa.Integer(), nullable=True),
+            sa.Column('codigo_estado', sa.Integer(), nullable=True),
+            sa.Column('respuesta', sa.Text(), nullable=True),
+            sa.Column('fecha_creacion', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('endpoint', 'clave', name='uq_solicitud_endpoint_clave')
+        )
+        with op.batch_alter_table('solicitudes_idempotentes', schema=None) as batch_op:
+            batch_op.create_index('ix_solicitudes_idempotentes_fecha_creacion', ['fecha_creacion'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('solicitudes_idempotentes', schema=None) as batch_op:
+        batch_op.drop_index('ix_solicitudes_idempotentes_fecha_creacion')
+    op.drop_table('solicitudes_idempotentes')
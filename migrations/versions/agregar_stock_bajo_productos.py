@@ -0,0 +1,47 @@
+"""Agregar stock_bajo a productos (alertas de stock bajo indexadas)
+
+Revision ID: agregar_stock_bajo_productos
+Revises: agregar_kardex_inventario
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'agregar_stock_bajo_productos'
+down_revision = 'agregar_kardex_inventario'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    columnas = [columna['name'] for columna in inspector.get_columns('productos')]
+    indices = [indice['name'] for indice in inspector.get_indexes('productos')]
+
+    # Sin batch_alter_table: en SQLite recrearía productos y rompería los triggers de productos_fts
+    if 'stock_bajo' not in columnas:
+        op.add_column('productos', sa.Column('stock_bajo', sa.Boolean(), nullable=False, server_default=sa.false()))
+    if 'ix_productos_stock_bajo' not in indices:
+        op.create_index('ix_productos_stock_bajo', 'productos', ['stock_bajo'], unique=False)
+
+    # Estado actual: activo y stock <= stock_minimo
+    productos = sa.table('productos',
+        sa.column('activo', sa.Boolean()),
+        sa.column('stock', sa.Integer()),
+        sa.column('stock_minimo', sa.Integer()),
+        sa.column('stock_bajo', sa.Boolean())
+    )
+    op.execute(productos.update().values(stock_bajo=sa.case(
+        (sa.and_(productos.c.activo == sa.true(), productos.c.stock <= productos.c.stock_minimo), sa.true()),
+        else_=sa.false()
+    )))
+
+
+def downgrade():
+    op.drop_index('ix_productos_stock_bajo', table_name='productos')
+    op.drop_column('productos', 'stock_bajo')
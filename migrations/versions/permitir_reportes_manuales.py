@@ -0,0 +1,33 @@
+"""Permitir reportes generados a pedido (fecha_programada NULL)
+
+Revision ID: permitir_reportes_manuales
+Revises: agregar_stock_bajo_productos
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'permitir_reportes_manuales'
+down_revision = 'agregar_stock_bajo_productos'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    columnas = {c['name']: c for c in inspector.get_columns('reportes_generados')}
+
+    if not columnas['fecha_programada']['nullable']:
+        with op.batch_alter_table('reportes_generados', schema=None) as batch_op:
+            batch_op.alter_column('fecha_programada', existing_type=sa.Date(), nullable=True)
+
+
+def downgrade():
+    op.execute("DELETE FROM reportes_generados WHERE fecha_programada IS NULL")
+    with op.batch_alter_table('reportes_generados', schema=None) as batch_op:
+        batch_op.alter_column('fecha_programada', existing_type=sa.Date(), nullable=False)